@@ -0,0 +1,68 @@
+"""Windowed aggregation of readings sampled faster than they're published."""
+from rpi2mqtt.report import flatten, _is_number
+import threading
+
+
+class WindowAggregator(object):
+    """Min, max, mean, last and count of every numeric field over the readings sampled since the last publish.
+
+    The published payload is the last reading with its numeric fields replaced by their window mean, so existing
+    value templates keep working, plus a `window` field holding the statistics keyed by (dotted) field name, e.g.
+    `{'temperature': 70.1, 'window': {'temperature': {'min': 69.8, 'max': 71.5, 'mean': 70.1, 'last': 70.0,
+    'count': 12}}}`.
+
+    Attributes:
+        samples (int): Readings in the current window.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fields = {}
+        self._last = None
+        self.samples = 0
+
+    def add(self, data):
+        with self._lock:
+            for key, value in flatten(data).items():
+                if not _is_number(value):
+                    continue
+                stats = self._fields.get(key)
+                if stats is None:
+                    # min, max, sum, count, last
+                    self._fields[key] = [value, value, value, 1, value]
+                else:
+                    stats[0] = min(stats[0], value)
+                    stats[1] = max(stats[1], value)
+                    stats[2] += value
+                    stats[3] += 1
+                    stats[4] = value
+            self._last = data
+            self.samples += 1
+
+    def flush(self):
+        """Aggregated payload of the current window and start a new one. Returns None if nothing was sampled."""
+        with self._lock:
+            if self._last is None:
+                return None
+            window = {}
+            for key, (low, high, total, count, last) in self._fields.items():
+                window[key] = {'min': low, 'max': high, 'mean': total / count, 'last': last, 'count': count}
+            data = WindowAggregator._means(self._last, window)
+            data['window'] = window
+            self._fields = {}
+            self._last = None
+            self.samples = 0
+            return data
+
+    @staticmethod
+    def _means(data, window, prefix=''):
+        means = {}
+        for key, value in data.items():
+            path = '{}{}'.format(prefix, key)
+            if isinstance(value, dict):
+                means[key] = WindowAggregator._means(value, window, path + '.')
+            elif path in window:
+                means[key] = window[path]['mean']
+            else:
+                means[key] = value
+        return means
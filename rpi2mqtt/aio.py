@@ -0,0 +1,189 @@
+"""asyncio runtime. Enable with `runtime: asyncio` in config.yaml or `--asyncio`.
+
+Every sensor runs as a task on one event loop. Blocking sensor drivers are read on the SensorReader's worker pool and
+the MQTT client's socket, keepalives and outbox are serviced by the same loop, so no thread is needed per sensor or
+for the network. Command callbacks block on GPIO and I2C, they run on a single command thread in the order they
+arrived.
+
+Services shared by all sensors keep their own thread when they're used: edge detection, iBeacon away timeouts, the
+BLE scanner, history backfill and the gpiod backend's edge events.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+from rpi2mqtt.mqtt import MQTT
+from rpi2mqtt.reader import SensorReader
+from rpi2mqtt.scheduler import Job
+
+
+class AsyncioHelper(object):
+    """Drive a paho client's socket from an asyncio loop instead of the `loop_start()` thread.
+
+    paho calls the socket callbacks from whichever thread touched the client, so they're handed to the loop with
+    `call_soon_threadsafe`. Message callbacks wrapped with `dispatch` run on the command thread.
+    """
+
+    def __init__(self, loop, client):
+        self.loop = loop
+        self.client = client
+        self.misc = None
+        self.reconnecting = None
+        self.stopped = False
+        # one thread keeps commands in order, e.g. ON followed by OFF
+        self.commands = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rpi2mqtt-commands')
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self._open, sock)
+
+    def _open(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        if self.misc is None or self.misc.done():
+            self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self._close, sock)
+
+    def _close(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if not self.stopped and (self.reconnecting is None or self.reconnecting.done()):
+            self.reconnecting = self.loop.create_task(self.reconnect())
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.add_writer, sock, self.client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.remove_writer, sock)
+
+    def dispatch(self, callback):
+        """Wrap a message callback to run on the command thread instead of blocking the loop reading the socket."""
+        def run(client, userdata, message):
+            command = self.loop.run_in_executor(self.commands, callback, client, userdata, message)
+            command.add_done_callback(lambda future: AsyncioHelper._done(future, message.topic))
+        return run
+
+    @staticmethod
+    def _done(future, topic):
+        if not future.cancelled() and future.exception() is not None:
+            logging.error('Command on {} failed.'.format(topic), exc_info=future.exception())
+
+    async def misc_loop(self):
+        """Keepalive pings and timeouts, normally done by paho's network thread."""
+        while self.client.loop_misc() == MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    async def reconnect(self, min_delay=1, max_delay=120):
+        delay = min_delay
+        while not self.stopped:
+            await asyncio.sleep(delay)
+            try:
+                logging.info('Reconnecting to MQTT broker...')
+                # connecting blocks on DNS, TCP and TLS
+                await self.loop.run_in_executor(None, self.client.reconnect)
+                return
+            except Exception as e:
+                logging.warning('Reconnect failed ({}). Retrying in {}s.'.format(e, delay))
+                delay = min(delay * 2, max_delay)
+
+    def stop(self):
+        self.stopped = True
+        if MQTT.status_topic:
+            # a clean disconnect doesn't publish the last will
+            self.client.publish(MQTT.status_topic, 'offline', qos=1, retain=True)
+        self.client.disconnect()
+        self.commands.shutdown(wait=False)
+
+
+async def publisher(outbox):
+    """Drain the MQTT outbox on the event loop."""
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    outbox.listener = lambda: loop.call_soon_threadsafe(wakeup.set)
+    try:
+        while True:
+            wakeup.clear()
+            message = outbox.get(timeout=0)
+            if message is None:
+                await wakeup.wait()
+                continue
+            delay = MQTT.deliver(message)
+            if delay:
+                await asyncio.sleep(delay)
+    finally:
+        outbox.listener = None
+
+
+async def sensor_task(reader, name, sensor, sensor_type, interval, offset=0, jitter=0, timeout=None,
+                      sample_interval=None):
+    """Read `sensor` every `interval` seconds on the reader's worker pool.
+
+    A read that misses its deadline, counted from when it started running, marks the sensor stale. Its next read starts once the hung read returned. With a
+    `sample_interval` the sensor is also sampled at that rate, see `SensorReader.add`.
+    """
+    timeout = reader.timeout(sensor_type, timeout)
+    reader.register(name)
+    reader.jobs[name] = Job(name, sensor.callback, interval, offset, jitter)
+    polls = [poll(reader, name, sensor, reader.jobs[name], timeout)]
+    if sample_interval:
+        sample_name = '{}_sample'.format(name)
+        reader.register(sample_name)
+        reader.jobs[sample_name] = Job(sample_name, sensor.sample, sample_interval, offset, jitter)
+        polls.append(poll(reader, sample_name, sensor, reader.jobs[sample_name], timeout))
+    await asyncio.gather(*polls)
+
+
+async def poll(reader, name, sensor, job, timeout):
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(max(0.0, job.schedule(loop.time()) - loop.time()))
+        job.last_lag = loop.time() - job.deadline
+        if reader.lag_histogram is not None:
+            reader.lag_histogram.observe(job.last_lag)
+        read = loop.run_in_executor(reader.pool, reader.read, name, sensor, job.callback)
+        done, _ = await asyncio.wait({read}, timeout=timeout)
+        while not done and reader.remaining(name, timeout):
+            # queued behind other reads, the deadline counts from when it started
+            done, _ = await asyncio.wait({read}, timeout=reader.remaining(name, timeout))
+        if not done:
+            reader.mark_stale(name, sensor, timeout)
+            await read
+
+
+async def main(config, args):
+    from rpi2mqtt.event_loop import setup_services, close_services, setup_sensors, read_schedule, start_scanner
+
+    loop = asyncio.get_running_loop()
+    MQTT.setup(loop)
+    tasks = [loop.create_task(publisher(MQTT.outbox))]
+    reader = SensorReader(None, config.get('read_workers', 4), config.get('read_timeouts'))
+    scanner = None
+
+    try:
+        setup_services(config, args, reader)
+        # sensor setup blocks on GPIO, I2C and Discovery.flush, which waits for the broker's acknowledgements
+        sensors = await loop.run_in_executor(None, setup_sensors, config, args)
+        for sensor, s in sensors:
+            tasks.append(loop.create_task(sensor_task(reader, sensor.name, s, sensor.type, *read_schedule(config, sensor))))
+        scanner = start_scanner(sensors)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        reader.shutdown()
+        MQTT.loop_helper.stop()
+        close_services(config)
+        if scanner:
+            scanner.stop()
+
+
+def run(config, args):
+    try:
+        asyncio.run(main(config, args))
+    except KeyboardInterrupt:
+        pass
@@ -1,8 +1,11 @@
 from rpi2mqtt.mqtt import MQTT as mqtt
+from rpi2mqtt.discovery import Discovery
+from rpi2mqtt import encoding
 import json
 import logging
 from rpi2mqtt.version import __version__
-import RPi.GPIO as GPIO
+import threading
+import time
 
 # logging.basicConfig(level=logging.INFO)
 
@@ -16,11 +19,15 @@ def sensor(func):
             SENSORS[args.name].append(func)
     return wrap
 
-GPIO.setmode(GPIO.BCM)
-
 class Sensor(object):
 
     BINARY_SENSORS = ['reed']
+    # ReportPolicy deciding which readings are published. None publishes every reading.
+    report = None
+    # WindowAggregator of readings taken by sample(). None publishes single readings.
+    aggregate = None
+    # PayloadEncoder of published readings.
+    encoder = encoding.DEFAULT
 
     def __init__(self, name, pin, topic, device_class, device_model, **kwargs):
         self.name = name
@@ -47,8 +54,23 @@ class Sensor(object):
                 'unique_id': '{}_{}_{}_rpi2mqtt'.format(self.name, self.device_model, self.device_class),
                 'state_topic': self.topic,
                 "json_attributes_topic": self.topic,
+                'availability': self.availability,
+                'availability_mode': 'all',
                 'device': self.device_config}
 
+    @property
+    def availability_topic(self):
+        return '{}/availability'.format(self.topic)
+
+    @property
+    def availability(self):
+        """Home Assistant availability topics. The sensor is unavailable once its reads time out or the device's last
+        will marked it offline."""
+        topics = [{'topic': self.availability_topic}]
+        if mqtt.status_topic:
+            topics.append({'topic': mqtt.status_topic})
+        return topics
+
     @property
     def homeassistant_mqtt_config_json(self):
         return json.dumps(self.homeassistant_mqtt_config)
@@ -66,9 +88,19 @@ class Sensor(object):
         return 'homeassistant/{}/{}_{}/config'.format(homeassistant_sensor_type, self.name, self.device_class)
 
     def publish_mqtt_discovery(self):
+        """Queue the discovery config. Changed configs are published by `Discovery.flush`."""
+        Discovery.add(self.homeassistant_mqtt_config_topic, self.homeassistant_mqtt_config_json)
+        logging.debug("Queued MQTT discovery config for {}".format(self.homeassistant_mqtt_config_topic))
+
+    @classmethod
+    def from_config(cls, sensor, args):
+        """Create the sensor from its entry in config.yaml. Required for sensor types in the registry.
 
-        mqtt.publish(self.homeassistant_mqtt_config_topic, self.homeassistant_mqtt_config_json)
-        logging.debug("Published MQTT discovery config to {}".format(self.homeassistant_mqtt_config_topic))
+        Args:
+            sensor (DotMap): Sensor entry in config.yaml.
+            args (Namespace): Command line arguments.
+        """
+        raise NotImplementedError("from_config method is required.")
 
     def setup(self):
         raise NotImplementedError("Setup method is required.")
@@ -76,11 +108,37 @@ class Sensor(object):
     def state(self):
         raise NotImplementedError("State method is required.")
 
-    def payload(self):
-        return json.dumps({'state': self.state()})
+    def data(self):
+        return {'state': self.state()}
+
+    def payload(self, data=None):
+        return self.encoder.encode(self.data() if data is None else data)
+
+    def sample(self):
+        """Add a reading to the aggregation window. It's published by the next `publish_state`."""
+        self.aggregate.add(self.data())
+
+    def publish_state(self, force=False, priority=False):
+        """Read the sensor and publish the reading if the report policy allows it.
+
+        Sampled sensors publish the aggregate of their window on their scheduled publish, or a new reading if nothing
+        was sampled. Forced and priority publishes, e.g. command acks and edges, always publish a new reading and leave
+        the window for the next scheduled publish.
+
+        Args:
+            force (bool): Publish even if the reading didn't change, e.g. to acknowledge a command.
+            priority (bool): Send ahead of queued telemetry.
+        """
+        data = None
+        if self.aggregate and not force and not priority:
+            data = self.aggregate.flush()
+        if data is None:
+            data = self.data()
+        if self.report is None or self.report.should_publish(data, force):
+            mqtt.publish(self.topic, self.payload(data), priority)
 
     def callback(self, **kwargs):
-        mqtt.publish(self.topic, self.payload())
+        self.publish_state()
 
 
 class SensorGroup(Sensor):
@@ -96,19 +154,48 @@ class SensorGroup(Sensor):
         topic (str): Base topic name. This is prepended to '/state' and '/config' to create respective topics in HA.
         device_class (str): Home Assistant device class for this sensor.
         device_type (str): Type of sensor. e.g. DHT22, Reed Switch, etc. 
+        max_age (float): Seconds a reading is reused by `state()` before the sensor is read again.
     """
-    def __init__(self, name, pin, topic, device_class, device_type):
+    DEFAULT_MAX_AGE = 5
+
+    def __init__(self, name, pin, topic, device_class, device_type, max_age=None):
         self.name = name
         self.pin = pin
         self.topic = topic
         self.device_class = device_class
         self.device_type = device_type
         self.sensors = []
+        self.max_age = SensorGroup.DEFAULT_MAX_AGE if max_age is None else max_age
+        self._snapshot = None
+        self._snapshot_time = None
+        self._snapshot_lock = threading.Lock()
 
     def setup(self):
         for sensor in self.sensors:
             sensor.setup()
 
+    def read(self):
+        """Read all values from the physical sensor."""
+        raise NotImplementedError("Read method is required.")
+
+    def sample(self):
+        # every sample is a new reading, not the cached snapshot
+        self.state(force=True)
+        super(SensorGroup, self).sample()
+
+    def state(self, force=False):
+        """Snapshot of the last reading. The sensor is only read again once the snapshot is older than `max_age`.
+
+        Args:
+            force (bool): Read the sensor even if the snapshot is still fresh.
+        """
+        with self._snapshot_lock:
+            now = time.monotonic()
+            if force or self._snapshot is None or now - self._snapshot_time > self.max_age:
+                self._snapshot = self.read()
+                self._snapshot_time = now
+            return self._snapshot
+
     # def state(self):
     #     raise NotImplementedError('State method is required.')
 
@@ -0,0 +1,156 @@
+"""Batch analytics over many sensor histories at once.
+
+Histories are passed as columnar 2D arrays of shape (sensors, samples), e.g. one row per temperature sensor and one
+column per reading. Missing readings are NaN (None in the pure Python fallback). NumPy is used when it's installed
+(>= 1.20, `pip install rpi2mqtt[batch]`), otherwise every function falls back to plain Python lists.
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _use_numpy(use_numpy):
+    if use_numpy and np is None:
+        raise ImportError('NumPy is required for use_numpy=True.')
+    return np is not None if use_numpy is None else use_numpy
+
+
+def _missing(value):
+    return value is None or value != value
+
+
+def _window_sums(y, window):
+    """Sums and whether any reading is missing, for every full trailing window of `y`."""
+    nan = np.isnan(y)
+
+    def windowed(a):
+        cumsum = np.cumsum(np.pad(a, ((0, 0), (1, 0))), axis=1)
+        return cumsum[:, window:] - cumsum[:, :-window]
+
+    return windowed(np.where(nan, 0, y)), windowed(nan.astype(int)) > 0
+
+
+def rates_of_change(values, timestamps=None, use_numpy=None):
+    """Least-squares slope of every series.
+
+    Args:
+        values: (sensors, samples) readings.
+        timestamps: Sample times in seconds, either shared by all series (samples,) or per series (sensors, samples).
+            Defaults to the sample index.
+        use_numpy (bool): Force (True) or disable (False) NumPy. Defaults to NumPy when installed.
+
+    Returns:
+        One slope per series in value units per second (per sample without timestamps). NaN if a series has fewer
+        than two readings.
+    """
+    if _use_numpy(use_numpy):
+        y = np.asarray(values, dtype=float)
+        if timestamps is None:
+            t = np.arange(y.shape[1], dtype=float)
+        else:
+            t = np.asarray(timestamps, dtype=float)
+        t = np.broadcast_to(t, y.shape)
+        valid = ~(np.isnan(y) | np.isnan(t))
+        n = valid.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t_mean = np.where(valid, t, 0).sum(axis=1) / n
+            y_mean = np.where(valid, y, 0).sum(axis=1) / n
+            dt = np.where(valid, t - t_mean[:, None], 0)
+            dy = np.where(valid, y - y_mean[:, None], 0)
+            return (dt * dy).sum(axis=1) / (dt * dt).sum(axis=1)
+
+    slopes = []
+    for row, series in enumerate(values):
+        if timestamps is None:
+            times = range(len(series))
+        elif len(timestamps) and hasattr(timestamps[0], '__len__'):
+            # per series, lists or the rows of an array
+            times = timestamps[row]
+        else:
+            times = timestamps
+        points = [(t, y) for t, y in zip(times, series) if not _missing(t) and not _missing(y)]
+        if len(points) < 2:
+            slopes.append(float('nan'))
+            continue
+        t_mean = sum(t for t, _ in points) / len(points)
+        y_mean = sum(y for _, y in points) / len(points)
+        denominator = sum((t - t_mean) ** 2 for t, _ in points)
+        numerator = sum((t - t_mean) * (y - y_mean) for t, y in points)
+        slopes.append(numerator / denominator if denominator else float('nan'))
+    return slopes
+
+
+def rolling_mean(values, window, use_numpy=None):
+    """Trailing mean over `window` samples of every series.
+
+    Returns:
+        Same shape as `values`. The first `window - 1` samples of each series, and windows with missing readings,
+        are NaN.
+    """
+    if _use_numpy(use_numpy):
+        y = np.asarray(values, dtype=float)
+        result = np.full(y.shape, np.nan)
+        if y.shape[1] < window:
+            return result
+        total, missing = _window_sums(y, window)
+        result[:, window - 1:] = np.where(missing, np.nan, total / window)
+        return result
+
+    result = []
+    for series in values:
+        means = [float('nan')] * len(series)
+        total = 0.0
+        missing = 0
+        for i, value in enumerate(series):
+            if _missing(value):
+                missing += 1
+            else:
+                total += value
+            if i >= window:
+                old = series[i - window]
+                if _missing(old):
+                    missing -= 1
+                else:
+                    total -= old
+            if i >= window - 1 and not missing:
+                means[i] = total / window
+        result.append(means)
+    return result
+
+
+def outlier_mask(values, window=12, threshold=3.0, use_numpy=None):
+    """Flag readings more than `threshold` standard deviations away from the preceding `window` readings.
+
+    Returns:
+        Boolean mask with the shape of `values`. Readings without a full preceding window are never outliers.
+    """
+    if _use_numpy(use_numpy):
+        y = np.asarray(values, dtype=float)
+        mask = np.zeros(y.shape, dtype=bool)
+        if y.shape[1] <= window:
+            return mask
+        # the samples [i - window, i) preceding every sample i >= window. The variance is taken from the deviations,
+        # a difference of sums of squares loses it for readings far from zero, e.g. pressure in Pa.
+        previous = np.lib.stride_tricks.sliding_window_view(y[:, :-1], window, axis=1)
+        missing = np.isnan(previous).any(axis=2)
+        mean = previous.mean(axis=2)
+        std = np.sqrt(((previous - mean[:, :, None]) ** 2).mean(axis=2))
+        with np.errstate(invalid='ignore'):
+            mask[:, window:] = (np.abs(y[:, window:] - mean) > threshold * std) & ~missing
+        return mask
+
+    result = []
+    for series in values:
+        mask = [False] * len(series)
+        for i in range(window, len(series)):
+            previous = series[i - window:i]
+            if _missing(series[i]) or any(_missing(v) for v in previous):
+                continue
+            mean = sum(previous) / window
+            std = math.sqrt(sum((v - mean) ** 2 for v in previous) / window)
+            mask[i] = abs(series[i] - mean) > threshold * std
+        result.append(mask)
+    return result
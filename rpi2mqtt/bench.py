@@ -0,0 +1,637 @@
+"""Benchmarks for rpi2mqtt hot paths.
+
+Run with ``rpi2mqtt bench`` (or ``python -m rpi2mqtt.bench``). Sensors run against the in-process fakes in
+`rpi2mqtt.fakes` unless ``--hardware`` is passed, so results are comparable between machines and releases.
+Benchmarks needing a real broker (``publish``) only run with ``-c config.yaml``. Results are printed as JSON.
+"""
+from types import SimpleNamespace
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from rpi2mqtt.config import Config
+from rpi2mqtt.version import __version__
+
+
+BENCHMARKS = {}
+# benchmarks publishing to the broker in config.yaml
+BROKER_BENCHMARKS = {'publish'}
+
+
+def benchmark(func):
+    """Register a benchmark under its function name without the `bench_` prefix."""
+    BENCHMARKS[func.__name__.replace('bench_', '', 1)] = func
+    return func
+
+
+def timed(func, count):
+    """Call `func` `count` times and return elapsed seconds."""
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return time.perf_counter() - start
+
+
+def percentiles(samples, scale=1e3):
+    """p50, p90, p99 and max of `samples`, multiplied by `scale` (seconds to milliseconds by default)."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * scale, 3)
+
+    return {'p50': at(0.5), 'p90': at(0.9), 'p99': at(0.99), 'max': round(ordered[-1] * scale, 3)}
+
+
+def fake_mqtt():
+    """Point MQTT at a FakeClient and a fresh outbox. Returns the client."""
+    from rpi2mqtt.fakes import FakeClient
+    from rpi2mqtt.mqtt import MQTT
+    from rpi2mqtt.outbox import Outbox, RetryPolicy
+
+    MQTT.client = FakeClient()
+    MQTT.outbox = Outbox()
+    MQTT.retry_policy = RetryPolicy()
+    MQTT.subscribed_topics = {}
+    MQTT.pending_subscriptions = {}
+    MQTT.connected = True
+    return MQTT.client
+
+
+def drain():
+    """Deliver everything queued in the outbox on the calling thread."""
+    from rpi2mqtt.mqtt import MQTT
+
+    while len(MQTT.outbox):
+        message = MQTT.outbox.get(timeout=0)
+        if message:
+            MQTT.deliver(message)
+
+
+def suite_sensors(w1_dir, onewire_devices=8):
+    """One sensor of every built in type except ibeacon, created from config entries like config.yaml's."""
+    from collections import OrderedDict
+    from dotmap import DotMap
+    from rpi2mqtt.discovery import Discovery
+    from rpi2mqtt.fakes import w1_tree
+    from rpi2mqtt.registry import Registry
+
+    w1_tree(w1_dir, onewire_devices)
+    entries = [
+        {'type': 'reed', 'name': 'bench_door', 'pin': 24, 'normally_open': True},
+        {'type': 'switch', 'name': 'bench_switch', 'pin': 25},
+        {'type': 'dht22', 'name': 'bench_dht', 'pin': 4},
+        {'type': 'bme280', 'name': 'bench_bme280'},
+        {'type': 'onewire', 'name': 'bench_onewire', 'base_dir': w1_dir},
+        {'type': 'hestiapi', 'name': 'bench_hestiapi', 'heat_setpoint': 68, 'cool_setpoint': 76},
+    ]
+    args = SimpleNamespace(dry_run=True)
+    sensors = []
+    for entry in entries:
+        entry['topic'] = 'rpi2mqtt/bench/{}'.format(entry['name'])
+        sensor = DotMap(entry)
+        sensors.append((sensor, Registry.create(sensor, args)))
+    # discovery configs aren't part of a cycle
+    Discovery.pending = OrderedDict()
+    return sensors
+
+
+@benchmark
+def bench_publish(count=100, topic='rpi2mqtt/bench'):
+    """Compare publishes per second of a connection per message against the persistent client."""
+    import paho.mqtt.publish as single
+    from rpi2mqtt.mqtt import MQTT
+
+    config = Config.get_instance()
+    auth = None
+    if config.mqtt.username or config.mqtt.password:
+        auth = {'username': config.mqtt.username, 'password': config.mqtt.password}
+
+    def legacy(i):
+        single.single(topic, str(i),
+                      hostname=config.mqtt.host,
+                      port=config.mqtt.port,
+                      auth=auth,
+                      tls={'ca_certs': config.mqtt.ca_cert},
+                      retain=True)
+
+    legacy_elapsed = timed(legacy, count)
+
+    MQTT.setup()
+
+    def persistent(i):
+        # wait for every message so the outbox doesn't conflate them away
+        MQTT.publish(topic, str(i))
+        MQTT.outbox.join()
+
+    persistent_elapsed = timed(persistent, count)
+    MQTT.client.loop_stop()
+
+    return {'count': count,
+            'single_per_second': round(count / legacy_elapsed, 1),
+            'persistent_per_second': round(count / persistent_elapsed, 1)}
+
+
+@benchmark
+def bench_hvac_state(count=10000):
+    """Per-callback cost of decoding the HVAC state, scanning modes on every access vs. one pin read per tick.
+
+    HestiaPi.callback and HestiaPi.state look up hvac_state about six times per cycle.
+    """
+    from rpi2mqtt.thermostat import HVAC
+
+    lookups_per_callback = 6
+    levels = {pin: 0 for pin in HVAC.HEAT_PUMP.values()}
+    for pin in HVAC.HEAT_PUMP_MODES[HVAC.HEAT]:
+        levels[pin] = 1
+    reads = [0]
+
+    def gpio_input(pin):
+        reads[0] += 1
+        return levels[pin]
+
+    def scan():
+        active_pins = set(pin for pin in HVAC.HEAT_PUMP.values() if gpio_input(pin))
+        for mode, pins in HVAC.HEAT_PUMP_MODES.items():
+            if active_pins == set(pins):
+                return mode
+
+    def legacy(i):
+        for _ in range(lookups_per_callback):
+            scan()
+
+    def bitmask(i):
+        mask = 0
+        for pin, bit in HVAC.PIN_BITS.items():
+            if gpio_input(pin):
+                mask |= bit
+        for _ in range(lookups_per_callback):
+            HVAC.MODES_BY_MASK.get(mask)
+
+    legacy_elapsed = timed(legacy, count)
+    legacy_reads, reads[0] = reads[0], 0
+    bitmask_elapsed = timed(bitmask, count)
+
+    return {'count': count,
+            'legacy_us_per_callback': round(legacy_elapsed / count * 1e6, 3),
+            'legacy_pin_reads_per_callback': legacy_reads / count,
+            'bitmask_us_per_callback': round(bitmask_elapsed / count * 1e6, 3),
+            'bitmask_pin_reads_per_callback': reads[0] / count}
+
+
+@benchmark
+def bench_gpio_bank(count=10000, reed_switches=8):
+    """Reading the four HVAC pins one call per pin vs. one `read_many` call on the configured GPIO backend, and a
+    tick of a reed switch panel reading its pins one by one vs. through its PinBank.
+
+    The gpiod backend reads a line request with a single ioctl, RPi.GPIO reads pin by pin either way. Backend calls
+    are what would be syscalls on the gpiod backend.
+    """
+    from collections import OrderedDict
+    from rpi2mqtt.binary import ReedSwitch
+    from rpi2mqtt.discovery import Discovery
+    from rpi2mqtt.gpio import GPIO, PinBank
+    from rpi2mqtt.thermostat import HVAC
+
+    pins = list(HVAC.PIN_BITS)
+    GPIO.setup_input(pins)
+
+    def per_pin(i):
+        for pin in pins:
+            GPIO.read(pin)
+
+    def bank(i):
+        GPIO.read_many(pins)
+
+    per_pin_elapsed = timed(per_pin, count)
+    bank_elapsed = timed(bank, count)
+
+    panel = [ReedSwitch('bench_reed_{}'.format(i), 5 + i, 'rpi2mqtt/bench/reed_{}'.format(i), True)
+             for i in range(reed_switches)]
+    Discovery.pending = OrderedDict()
+    backend = GPIO.get()
+    calls = [0]
+    read, read_many = backend.read, backend.read_many
+
+    def counted(func):
+        def wrapper(*args):
+            calls[0] += 1
+            return func(*args)
+        return wrapper
+
+    backend.read, backend.read_many = counted(read), counted(read_many)
+
+    def panel_tick(i):
+        # levels of the previous tick are never reused
+        for switch in panel:
+            switch.bank.invalidate()
+        for switch in panel:
+            switch.state()
+
+    shared = panel[0].bank
+    try:
+        # a bank per switch reads like every switch reading its own pin
+        for switch in panel:
+            switch.bank = PinBank()
+            switch.bank.add(switch.pin)
+        panel_per_pin_elapsed = timed(panel_tick, count)
+        per_pin_calls, calls[0] = calls[0], 0
+        for switch in panel:
+            switch.bank = shared
+        panel_bank_elapsed = timed(panel_tick, count)
+        bank_calls = calls[0]
+    finally:
+        backend.read, backend.read_many = read, read_many
+        ReedSwitch.banks.clear()
+    return {'count': count,
+            'backend': type(backend).__name__,
+            'pins': len(pins),
+            'per_pin_us': round(per_pin_elapsed / count * 1e6, 3),
+            'read_many_us': round(bank_elapsed / count * 1e6, 3),
+            'reed_switches': reed_switches,
+            'panel_per_pin_us_per_tick': round(panel_per_pin_elapsed / count * 1e6, 3),
+            'panel_per_pin_backend_calls_per_tick': per_pin_calls / count,
+            'panel_bank_us_per_tick': round(panel_bank_elapsed / count * 1e6, 3),
+            'panel_bank_backend_calls_per_tick': bank_calls / count}
+
+
+@benchmark
+def bench_encoding(count=1000):
+    """Payload bytes and encode time per cycle of every sensor type's reading with each payload encoder.
+
+    Encoders whose library isn't installed are reported as null.
+    """
+    from rpi2mqtt import encoding
+    from rpi2mqtt.fakes import FakeClient
+
+    variants = [
+        ('json', 'json', {}),
+        ('json_orjson', 'json', {'use_orjson': True}),
+        ('json_compact_precision_2', 'json', {'compact': True, 'precision': 2}),
+        ('cbor', 'cbor', {}),
+        ('msgpack', 'msgpack', {}),
+        ('msgpack_single_float', 'msgpack', {'single_float': True}),
+    ]
+    fake_mqtt()
+    w1_dir = tempfile.mkdtemp(prefix='rpi2mqtt-w1-')
+    logging.disable(logging.INFO)
+    try:
+        readings = [(s.topic, s.data()) for _, s in suite_sensors(w1_dir)]
+    finally:
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(w1_dir)
+
+    results = {'count': count, 'sensors': len(readings)}
+    for name, encoder_name, options in variants:
+        try:
+            encoder = encoding.ENCODERS[encoder_name](**options)
+        except ImportError:
+            results[name] = None
+            continue
+        if options.get('use_orjson') and encoder.orjson is None:
+            results[name] = None
+            continue
+
+        def cycle(i):
+            for topic, data in readings:
+                encoder.encode(data)
+
+        elapsed = timed(cycle, count)
+        payloads = [(topic, encoder.encode(data)) for topic, data in readings]
+        results[name] = {
+            'us_per_cycle': round(elapsed / count * 1e6, 2),
+            'payload_bytes_per_cycle': sum(len(p.encode('utf-8') if isinstance(p, str) else p) for _, p in payloads),
+            'packet_bytes_per_cycle': sum(FakeClient.packet_size(topic, p) for topic, p in payloads)}
+    return results
+
+
+@benchmark
+def bench_rate_of_change(count=10000, windows=(4, 8, 16, 64, 256)):
+    """Append a sample and compute the rate of change with rpi2mqtt.math's list history vs. StreamingStats."""
+    import random
+    import rpi2mqtt.math as rmath
+    from rpi2mqtt.stats import StreamingStats
+
+    samples = [70 + random.random() for _ in range(count)]
+    results = {'count': count}
+    for window in windows:
+        history = []
+
+        def legacy(i):
+            history.append(samples[i])
+            if len(history) > window:
+                history.pop(0)
+            if len(history) > 1:
+                rmath.rate_of_change(history)
+
+        stats = StreamingStats(window)
+
+        def streaming(i):
+            stats.append(samples[i], i * 300.0)
+            stats.slope
+
+        results['legacy_us_window_{}'.format(window)] = round(timed(legacy, count) / count * 1e6, 3)
+        results['streaming_us_window_{}'.format(window)] = round(timed(streaming, count) / count * 1e6, 3)
+    return results
+
+
+@benchmark
+def bench_onewire(count=100, devices=64):
+    """Read a synthetic sysfs tree of `devices` one wire probes, reopening and regex parsing every file vs. OneWire.
+
+    Both the `w1_slave` files of older kernels and the `temperature` attribute are measured, read one device after the
+    other (serial) and through `OneWire.state`. Files in a temp dir return instantly, so the thread pool only pays
+    off on a real bus where every read waits for a conversion.
+    """
+    import glob
+    import re
+    from rpi2mqtt.fakes import w1_tree
+    from rpi2mqtt.temperature import OneWire
+
+    regex = re.compile('.*? t=(\\d*)')
+    base_dir = tempfile.mkdtemp(prefix='rpi2mqtt-w1-')
+    results = {'count': count, 'devices': devices}
+    try:
+        w1_tree(base_dir, devices)
+        paths = sorted(glob.glob(os.path.join(base_dir, '**/w1_slave')))
+
+        def legacy(i):
+            for path in paths:
+                with open(path, 'r') as f:
+                    float(regex.search(f.read()).groups()[0]) / 1000.0
+
+        results['legacy_ms_per_cycle'] = round(timed(legacy, count) / count * 1e3, 3)
+
+        for attribute in ('w1_slave', 'temperature'):
+            if attribute == 'temperature':
+                w1_tree(base_dir, devices, temperature_attribute=True)
+            sensor = OneWire('bench', 'rpi2mqtt/bench', base_dir=base_dir)
+            try:
+                serial = timed(lambda i: [sensor.read_device(w1_id) for w1_id in sensor.fds], count)
+                results['{}_serial_ms_per_cycle'.format(attribute)] = round(serial / count * 1e3, 3)
+                results['{}_ms_per_cycle'.format(attribute)] = round(timed(lambda i: sensor.state(), count) / count * 1e3, 3)
+            finally:
+                sensor.close()
+    finally:
+        shutil.rmtree(base_dir)
+    return results
+
+
+@benchmark
+def bench_ble_dispatch(count=100, beacons=500, tracked=50, batch=1000):
+    """Advertisements per second routed to `tracked` iBeacon sensors among `beacons` beacons in range.
+
+    Compares offering every advertisement to every sensor, which is what wiring more sensors to the scanner
+    callback amounts to, with BeaconDispatcher. Publishes go to an in-memory outbox.
+    """
+    import random
+    import uuid
+    from rpi2mqtt.ble import BeaconDispatcher
+    from rpi2mqtt.ibeacon import Scanner
+    from rpi2mqtt.mqtt import MQTT
+
+    fake_mqtt()
+    logging.disable(logging.INFO)
+
+    beacon_ids = [(str(uuid.uuid4()), random.randrange(65536), random.randrange(65536)) for _ in range(beacons)]
+    sensors = [Scanner('bench_{}'.format(i), 'rpi2mqtt/bench/{}'.format(i), beacon_uuid, major=major, minor=minor)
+               for i, (beacon_uuid, major, minor) in enumerate(random.sample(beacon_ids, tracked))]
+    advertisements = [('aa:bb:cc:dd:ee:ff', -random.randrange(40, 90), None, {'uuid': u, 'major': ma, 'minor': mi})
+                      for u, ma, mi in (random.choice(beacon_ids) for _ in range(batch))]
+
+    def legacy(i):
+        for advertisement in advertisements:
+            info = advertisement[3]
+            for sensor in sensors:
+                if (sensor.beacon_uuid, sensor.major, sensor.minor) == (info['uuid'], info['major'], info['minor']):
+                    sensor.process_ble_update(*advertisement)
+
+    dispatcher = BeaconDispatcher()
+    for sensor in sensors:
+        dispatcher.register(sensor)
+
+    def indexed(i):
+        for advertisement in advertisements:
+            dispatcher.dispatch(*advertisement)
+
+    legacy_elapsed = timed(legacy, count)
+    indexed_elapsed = timed(indexed, count)
+    logging.disable(logging.NOTSET)
+    return {'advertisements': count * batch,
+            'beacons': beacons,
+            'tracked': tracked,
+            'legacy_per_second': round(count * batch / legacy_elapsed),
+            'dispatcher_per_second': round(count * batch / indexed_elapsed),
+            'published': MQTT.outbox.sent + len(MQTT.outbox) + MQTT.outbox.conflated}
+
+
+@benchmark
+def bench_cycle(count=100, onewire_devices=8):
+    """Read and publish every sensor type once per cycle, HestiaPi.callback included, with the outbox drained to
+    `FakeClient`, which counts packets without any network round trip.
+
+    Reports per-cycle latency percentiles, publishes per second and bytes that would be on the wire. A second pass
+    under tracemalloc reports the mean peak of traced memory above the start of a cycle (`peak_alloc_bytes`) and the
+    number of memory blocks still allocated after the run (`retained_blocks`). Neither counts allocations.
+    """
+    import tracemalloc
+
+    client = fake_mqtt()
+    w1_dir = tempfile.mkdtemp(prefix='rpi2mqtt-w1-')
+    logging.disable(logging.INFO)
+    try:
+        sensors = [s for _, s in suite_sensors(w1_dir, onewire_devices)]
+
+        def cycle():
+            for sensor in sensors:
+                sensor.callback()
+            drain()
+
+        latencies = []
+        for _ in range(count):
+            start = time.perf_counter()
+            cycle()
+            latencies.append(time.perf_counter() - start)
+        elapsed = sum(latencies)
+        results = {'count': count,
+                   'sensors': len(sensors),
+                   'cycle_ms': percentiles(latencies),
+                   'publishes': client.messages,
+                   'publishes_per_second': round(client.messages / elapsed, 1),
+                   'bytes_per_cycle': round(client.bytes / count, 1)}
+
+        peaks = []
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for _ in range(count):
+            current = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            cycle()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        results['peak_alloc_bytes'] = round(sum(peaks) / count)
+        results['retained_blocks'] = sum(stat.count_diff for stat in after.compare_to(before, 'lineno'))
+        return results
+    finally:
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(w1_dir)
+
+
+@benchmark
+def bench_event_loop(count=100, interval=0.05, onewire_devices=8):
+    """Run the sensors of `cycle` through the Scheduler and SensorReader every `interval` seconds for `count`
+    intervals, with a publisher thread draining the outbox.
+
+    Reports how late jobs started (scheduler lag), read latency per sensor type and publishes per second.
+    """
+    from rpi2mqtt.mqtt import MQTT
+    from rpi2mqtt.reader import SensorReader
+    from rpi2mqtt.scheduler import Scheduler
+
+    client = fake_mqtt()
+    w1_dir = tempfile.mkdtemp(prefix='rpi2mqtt-w1-')
+    logging.disable(logging.WARNING)
+    scheduler = Scheduler()
+    reader = SensorReader(scheduler)
+    stopped = threading.Event()
+
+    def publisher():
+        while not stopped.is_set():
+            message = MQTT.outbox.get(timeout=0.1)
+            if message:
+                MQTT.deliver(message)
+
+    try:
+        lags = []
+        for sensor, s in suite_sensors(w1_dir, onewire_devices):
+            job = reader.add(sensor.type, s, sensor.type, interval)
+
+            def submit(job=job, callback=job.callback):
+                lags.append(job.last_lag)
+                callback()
+
+            job.callback = submit
+
+        threads = [threading.Thread(target=scheduler.run, daemon=True), threading.Thread(target=publisher, daemon=True)]
+        for thread in threads:
+            thread.start()
+        time.sleep(count * interval)
+        scheduler.stop()
+        MQTT.outbox.join(timeout=5)
+        stopped.set()
+        for thread in threads:
+            thread.join()
+
+        return {'count': count,
+                'interval': interval,
+                'scheduler_lag_ms': percentiles(lags),
+                'read_ms': {name: {'mean': round((stats.mean or 0) * 1e3, 3), 'max': round(stats.max * 1e3, 3),
+                                   'failures': stats.failures, 'timeouts': stats.timeouts}
+                            for name, stats in reader.stats.items()},
+                'publishes_per_second': round(client.messages / (count * interval), 1),
+                'bytes_per_second': round(client.bytes / (count * interval), 1),
+                'outbox': MQTT.outbox.stats()}
+    finally:
+        reader.shutdown()
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(w1_dir)
+
+
+STARTUP = """
+import resource, sys, time
+if sys.argv[1:2] == ['--fakes']:
+    del sys.argv[1]
+    from rpi2mqtt import fakes
+    fakes.install()
+start = time.perf_counter()
+import rpi2mqtt.event_loop
+from rpi2mqtt.registry import Registry
+for sensor_type in sys.argv[1:]:
+    Registry.load(sensor_type)
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+@benchmark
+def bench_startup(count=10, types=('reed',), fakes=True):
+    """Import time and peak RSS of a fresh interpreter loading the drivers of `types` vs. every built in driver.
+
+    Loading every driver is what rpi2mqtt did before sensor types were imported lazily. Runs at most 10 interpreters
+    per variant and reports the median.
+    """
+    import statistics
+    import subprocess
+    from rpi2mqtt.registry import Registry
+
+    def measure(sensor_types):
+        seconds, rss = [], []
+        for _ in range(min(count, 10)):
+            argv = [sys.executable, '-c', STARTUP] + (['--fakes'] if fakes else []) + list(sensor_types)
+            output = subprocess.check_output(argv)
+            elapsed, maxrss = output.split()[-2:]
+            seconds.append(float(elapsed))
+            rss.append(int(maxrss))
+        return round(statistics.median(seconds) * 1e3, 1), statistics.median(rss)
+
+    results = {'types': list(types)}
+    results['all_drivers_ms'], results['all_drivers_max_rss_kb'] = measure(sorted(Registry.types))
+    results['lazy_ms'], results['lazy_max_rss_kb'] = measure(types)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='rpi2mqtt bench')
+    parser.add_argument('-c', '--config', help='Path to config.yaml. Required for benchmarks using the broker.')
+    parser.add_argument('-n', '--count', type=int, default=100, help='Iterations per benchmark.')
+    parser.add_argument('-o', '--output', help='Also write the results to this file.')
+    parser.add_argument('--hardware', action='store_true', help='Use the real GPIO, I2C and DHT drivers.')
+    parser.add_argument('names', nargs='*', help='Benchmarks to run. Default runs all of {}.'.format(sorted(BENCHMARKS)))
+    args = parser.parse_args(argv)
+
+    if args.config:
+        config = Config.get_instance(filename=args.config)
+        if args.hardware and config.get('gpio'):
+            from rpi2mqtt.gpio import GPIO
+            GPIO.setup(config.get('gpio'))
+    if not args.hardware:
+        from rpi2mqtt import fakes
+        fakes.install()
+
+    names = args.names or sorted(name for name in BENCHMARKS if args.config or name not in BROKER_BENCHMARKS)
+    results = {'meta': {'version': __version__,
+                        'python': platform.python_version(),
+                        'machine': platform.machine(),
+                        'hardware': args.hardware,
+                        'timestamp': time.time()}}
+    for name in names:
+        if name not in BENCHMARKS:
+            logging.error('Unknown benchmark {}.'.format(name))
+            sys.exit(1)
+        if name in BROKER_BENCHMARKS and not args.config:
+            logging.error('Benchmark {} needs a broker, pass -c config.yaml.'.format(name))
+            sys.exit(1)
+        if name == 'startup':
+            results[name] = BENCHMARKS[name](count=args.count, fakes=not args.hardware)
+        else:
+            results[name] = BENCHMARKS[name](count=args.count)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    return results
+
+
+if __name__ == '__main__':
+    main()
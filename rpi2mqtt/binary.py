@@ -1,6 +1,7 @@
-import RPi.GPIO as GPIO
 from rpi2mqtt.base import Sensor
+from rpi2mqtt.gpio import GPIO, PinBank, PULL_UP, PULL_DOWN
 from rpi2mqtt.mqtt import MQTT as mqtt
+from rpi2mqtt.edge import edges
 import json
 import logging
 
@@ -8,13 +9,28 @@ import logging
 class ReedSwitch(Sensor):
     """
     Extends simple binary sensor by adding configuration for normally open or normally closed reed switches.
+
+    In event mode changes are published as soon as the input settles for `debounce` milliseconds and the payload
+    includes the timestamp of the change. Polling continues as a reconciliation check.
+
+    Reed switches with the same pull share a PinBank, the gpiod backend requests them as one line request. A panel
+    of switches polled on the same schedule is read with one `read_many` per tick.
     """
+    # pull to PinBank
+    banks = {}
 
-    def __init__(self, name, pin, topic, normally_open, device_class=None):
+    def __init__(self, name, pin, topic, normally_open, device_class=None, mode='poll', debounce=50):
         super(ReedSwitch, self).__init__(name, pin, topic, device_class, 'reed_switch')
         self.normally_open = normally_open
+        self.event_mode = mode == 'event'
+        self.debounce = debounce
         self.setup()
 
+    @classmethod
+    def from_config(cls, sensor, args):
+        return cls(sensor.name, sensor.pin, sensor.topic, sensor.normally_open, sensor.get('device_type'),
+                   mode=sensor.get('mode', 'poll'), debounce=sensor.get('debounce', 50))
+
     def setup(self):
         """
         Setup GPIO pin to read input value.
@@ -37,28 +53,39 @@ class ReedSwitch(Sensor):
 
         # mqtt.publish('homeassistant/{}/{}_{}/config'.format(self.device_class, self.name, self.device_model), config)
         # logging.debug("Published MQTT discovery config to homeassistant/{}/{}_{}/config.format(self.device_class, self.name, self.device_model)")
-        GPIO.setmode(GPIO.BCM)
         # g.setup(self.pin, g.OUT)
         # mqtt.subscribe(self.topic + '/set', self.mqtt_callback)
 
         if self.normally_open:
-            mode = GPIO.PUD_UP
+            mode = PULL_UP
         else:
-            mode = GPIO.PUD_DOWN
+            mode = PULL_DOWN
 
-        GPIO.setup(self.pin, GPIO.IN, pull_up_down=mode)
+        GPIO.setup_input(self.pin, pull=mode)
+        self.bank = ReedSwitch.banks.setdefault(mode, PinBank())
+        self.bank.add(self.pin)
         logging.debug('Reed Switch {} configured as input on GPIO{} witn pull_up_down set to {}'.format(self.name, self.pin, mode))
 
+        if self.event_mode:
+            edges.watch(self, [self.pin], self.debounce)
+
+    def edge(self):
+        # the debounced publish must not reuse levels read before the edge
+        self.bank.invalidate()
+
     def state(self):
-        state = GPIO.input(self.pin) 
+        state = self.bank.read(self.pin)
         logging.debug("Reed Switch {}: GPIO{} state is {}".format(self.name, self.pin, state))
         if state == 1:
             return "ON"
         else:
             return "OFF"
 
-    def payload(self):
-        return json.dumps({'state': self.state()})
+    def data(self):
+        data = {'state': self.state()}
+        if self.event_mode:
+            data['timestamp'] = edges.changed_at(self, data['state'])
+        return data
 
     def callback(self, *args):
-        mqtt.publish(self.topic, self.payload())
+        self.publish_state()
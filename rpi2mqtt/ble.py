@@ -0,0 +1,131 @@
+"""Routes BLE advertisements from a single scanner to the iBeacon sensors tracking them."""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class BeaconDispatcher(object):
+    """Index of iBeacon sensors by beacon id.
+
+    Sensors tracking a specific beacon are indexed by (uuid, major, minor), sensors tracking every beacon of a uuid by
+    uuid alone. Routing an advertisement costs two dict lookups regardless of the number of sensors, and
+    advertisements of untracked beacons never reach a sensor.
+
+    Attributes:
+        advertisements (int): Advertisements received.
+        dispatched (int): Advertisements routed to at least one sensor.
+    """
+
+    def __init__(self):
+        self._by_uuid = {}
+        self._by_id = {}
+        self.advertisements = 0
+        self.dispatched = 0
+
+    def __len__(self):
+        return sum(len(sensors) for sensors in self._by_uuid.values()) + \
+            sum(len(sensors) for sensors in self._by_id.values())
+
+    @staticmethod
+    def normalize(uuid):
+        return str(uuid).lower()
+
+    def register(self, sensor):
+        """Route advertisements of `sensor.beacon_uuid` (and `major`/`minor` if set) to `sensor.process_ble_update`."""
+        uuid = BeaconDispatcher.normalize(sensor.beacon_uuid)
+        if sensor.major is None and sensor.minor is None:
+            self._by_uuid.setdefault(uuid, []).append(sensor)
+        else:
+            self._by_id.setdefault((uuid, sensor.major, sensor.minor), []).append(sensor)
+        logging.debug('Dispatching advertisements of {} ({}/{}) to {}.'.format(uuid, sensor.major, sensor.minor,
+                                                                               sensor.name))
+
+    def dispatch(self, bt_addr, rssi, packet, additional_info):
+        """beacontools callback."""
+        self.advertisements += 1
+        uuid = additional_info.get('uuid')
+        if uuid is None:
+            return
+        uuid = BeaconDispatcher.normalize(uuid)
+        sensors = self._by_uuid.get(uuid, ())
+        specific = self._by_id.get((uuid, additional_info.get('major'), additional_info.get('minor')), ())
+        if not sensors and not specific:
+            return
+
+        self.dispatched += 1
+        for sensor in sensors:
+            sensor.process_ble_update(bt_addr, rssi, packet, additional_info)
+        for sensor in specific:
+            sensor.process_ble_update(bt_addr, rssi, packet, additional_info)
+
+
+class AwayDetector(object):
+    """Publishes a beacon's departure as soon as its `away_timeout` expires.
+
+    Present beacons are kept in a heap ordered by the time they'd be away if no further advertisement arrived. A
+    single worker thread sleeps until the earliest of those deadlines. Advertisements only update `last_seen`, so a
+    beacon whose deadline passed while it kept advertising is pushed back with its current deadline instead of being
+    marked away. Each present beacon has one heap entry, so hundreds of beacons cost O(log n) per expiry and nothing
+    per advertisement.
+
+    Sensors must implement `check_away` and `publish_state` and have `present`, `last_seen` and `away_timeout`.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []
+        self._tracked = set()
+        self._counter = itertools.count()
+        self._lock = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._tracked)
+
+    def track(self, sensor):
+        """Watch `sensor` for its departure. Call when it becomes present."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='rpi2mqtt-away', daemon=True)
+                self._thread.start()
+            if sensor in self._tracked:
+                return
+            self._tracked.add(sensor)
+            heapq.heappush(self._heap, (sensor.last_seen + sensor.away_timeout, next(self._counter), sensor))
+            self._lock.notify()
+
+    def _next_expired(self):
+        """Block until a tracked sensor's deadline passed and return it."""
+        with self._lock:
+            while True:
+                self._lock.wait_for(lambda: self._heap)
+                deadline, _, sensor = self._heap[0]
+                now = self.clock()
+                if deadline > now:
+                    self._lock.wait(deadline - now)
+                    continue
+                heapq.heappop(self._heap)
+                expires = sensor.last_seen + sensor.away_timeout
+                if expires > now:
+                    # seen since the entry was pushed
+                    heapq.heappush(self._heap, (expires, next(self._counter), sensor))
+                    continue
+                self._tracked.discard(sensor)
+                return sensor
+
+    def _run(self):
+        while True:
+            sensor = self._next_expired()
+            try:
+                if sensor.check_away():
+                    sensor.publish_state(force=True, priority=True)
+                elif sensor.present == 'ON':
+                    # an advertisement arrived after the deadline was checked
+                    self.track(sensor)
+            except Exception:
+                logging.exception('Unable to publish departure of {}.'.format(sensor.name))
+
+
+away = AwayDetector()
@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from rpi2mqtt.mqtt import MQTT as mqtt
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+class Discovery():
+    """Publishes Home Assistant discovery configs only when their content changed.
+
+    Sensors add their configs while they're set up and `flush` publishes the changed ones as a single burst. Hashes
+    of the configs the broker acknowledged are saved to `path`, so restarting with an unchanged config.yaml publishes
+    nothing. Every config is published again when Home Assistant announces itself 'online' on `birth_topic`, e.g.
+    after it restarted against a broker that lost its retained messages.
+
+    Attributes:
+        path (str): File storing the hash of every published config, keyed by topic.
+        force (bool): Publish every config regardless of the saved hashes.
+        published (dict): Topic to hash of the last published config.
+        pending (OrderedDict): Topic to (payload, hash) of configs waiting for `flush`. Removals have an empty payload
+            and no hash.
+        configs (dict): Topic to payload of every config added, including unchanged ones.
+        birth_topic (str): Home Assistant's status topic.
+    """
+    DEFAULT_PATH = '~/.rpi2mqtt/discovery.json'
+    BIRTH_TOPIC = 'homeassistant/status'
+
+    path = None
+    force = False
+    published = {}
+    pending = OrderedDict()
+    configs = {}
+    birth_topic = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def setup(cls, path=None, force=False, birth_topic=BIRTH_TOPIC):
+        cls.path = os.path.expanduser(path or Discovery.DEFAULT_PATH)
+        cls.force = force
+        cls.birth_topic = birth_topic
+        if birth_topic:
+            mqtt.subscribe(birth_topic, cls.on_birth)
+        try:
+            with open(cls.path, 'r') as f:
+                cls.published = json.load(f)
+        except (IOError, ValueError):
+            logging.info('No discovery cache found at {}. Publishing all discovery configs.'.format(cls.path))
+            cls.published = {}
+
+    @staticmethod
+    def digest(payload):
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def add(cls, topic, payload):
+        """Queue a discovery config for the next `flush` unless it was already published with the same content."""
+        cls.configs[topic] = payload
+        digest = Discovery.digest(payload)
+        if cls.force or cls.published.get(topic) != digest:
+            with cls._lock:
+                cls.pending[topic] = (payload, digest)
+        else:
+            logging.debug('Discovery config {} is unchanged.'.format(topic))
+
+    @classmethod
+    def flush(cls, timeout=30):
+        """Publish all pending configs back to back with qos 1. Saves the hashes of the configs the broker
+        acknowledged within `timeout` seconds, the others are published again on the next start."""
+        if not cls.pending:
+            logging.info('All discovery configs are up to date.')
+            return
+
+        with cls._lock:
+            pending, cls.pending = cls.pending, OrderedDict()
+        sent = []
+        # not through the outbox, its qos only confirms a message left the queue
+        for topic, (payload, digest) in pending.items():
+            logging.debug('Publishing discovery config {}.'.format(topic))
+            sent.append((topic, digest, mqtt.client.publish(topic, payload, qos=1, retain=True)))
+        logging.info('Published {} discovery configs.'.format(len(sent)))
+
+        deadline = time.monotonic() + timeout
+        acknowledged = 0
+        for topic, digest, info in sent:
+            if Discovery.acknowledged(info, max(0.0, deadline - time.monotonic())):
+                if digest is None:
+                    cls.published.pop(topic, None)
+                else:
+                    cls.published[topic] = digest
+                acknowledged += 1
+        if acknowledged < len(sent):
+            logging.warning('{} of {} discovery configs were not acknowledged. They will be published again on the '
+                            'next start.'.format(len(sent) - acknowledged, len(sent)))
+        if acknowledged:
+            cls.save()
+
+    @staticmethod
+    def acknowledged(info, timeout):
+        try:
+            info.wait_for_publish(timeout)
+            return info.is_published()
+        except (RuntimeError, ValueError) as e:
+            # e.g. not connected
+            logging.debug('Discovery config was not published: {}'.format(e))
+            return False
+
+    @classmethod
+    def remove(cls, topic):
+        """Queue deleting a config published by an earlier version from Home Assistant, i.e. clearing its retained
+        message. Only done if it was published according to the saved hashes, or with `force`."""
+        cls.configs.pop(topic, None)
+        if cls.force or topic in cls.published:
+            with cls._lock:
+                cls.pending[topic] = ('', None)
+
+    @classmethod
+    def republish(cls):
+        """Publish every config again regardless of the saved hashes."""
+        logging.info('Republishing {} discovery configs.'.format(len(cls.configs)))
+        with cls._lock:
+            for topic, payload in list(cls.configs.items()):
+                cls.pending[topic] = (payload, Discovery.digest(payload))
+        cls.flush()
+
+    @classmethod
+    def on_birth(cls, client, userdata, message):
+        # a retained 'online' is delivered on every subscribe, it doesn't mean Home Assistant restarted
+        if message.retain or message.payload.decode() != 'online':
+            return
+        # flush waits for acknowledgements, which arrive on the network thread running this callback
+        threading.Thread(target=cls.republish, name='rpi2mqtt-discovery', daemon=True).start()
+
+    @classmethod
+    def save(cls):
+        if not cls.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(cls.path), exist_ok=True)
+            with open(cls.path, 'w') as f:
+                json.dump(cls.published, f, indent=2, sort_keys=True)
+        except IOError:
+            logging.exception('Unable to save discovery cache {}.'.format(cls.path))
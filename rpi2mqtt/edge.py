@@ -0,0 +1,80 @@
+from datetime import datetime
+from rpi2mqtt.gpio import GPIO
+import logging
+import threading
+import time
+
+
+class EdgeDetector(object):
+    """Publish GPIO input changes as soon as they settle instead of waiting for the next poll.
+
+    The GPIO backend runs edge callbacks on its own thread. Every edge (re)starts the sensor's debounce window and a single
+    worker thread publishes the sensor once no further edge arrived within it. Sensors must implement
+    `publish_state`. Sensors caching input levels can implement `edge()`, which is called on every edge.
+    """
+
+    def __init__(self):
+        self._deadlines = {}
+        self._edges = {}
+        self._changes = {}
+        self._lock = threading.Condition()
+        self._thread = None
+
+    def watch(self, sensor, pins, debounce):
+        """Publish `sensor` whenever one of `pins` changes and stays stable for `debounce` milliseconds."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='rpi2mqtt-edges', daemon=True)
+            self._thread.start()
+
+        for pin in pins:
+            GPIO.watch(pin, lambda pin: self.edge(sensor, debounce))
+        logging.debug('Watching GPIO{} of {} for edges with {}ms debounce.'.format(pins, sensor.name, debounce))
+
+    def unwatch(self, pins):
+        for pin in pins:
+            GPIO.unwatch(pin)
+
+    def edge(self, sensor, debounce):
+        if hasattr(sensor, 'edge'):
+            sensor.edge()
+        with self._lock:
+            # the first edge of a bounce is when the input actually changed
+            if sensor not in self._deadlines:
+                self._edges[sensor] = time.time()
+            self._deadlines[sensor] = time.monotonic() + debounce / 1000.0
+            self._lock.notify()
+
+    def changed_at(self, sensor, state):
+        """ISO timestamp of the last change of `sensor` to `state`. Polled changes without an edge use the current
+        time."""
+        with self._lock:
+            last_state, timestamp = self._changes.get(sensor, (None, None))
+            edge = self._edges.pop(sensor, None)
+            if state != last_state:
+                timestamp = datetime.fromtimestamp(edge or time.time()).isoformat()
+                self._changes[sensor] = (state, timestamp)
+            return timestamp
+
+    def _due(self):
+        now = time.monotonic()
+        return [sensor for sensor, deadline in self._deadlines.items() if deadline <= now]
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._lock.wait_for(lambda: self._deadlines)
+                due = self._due()
+                if not due:
+                    self._lock.wait(min(self._deadlines.values()) - time.monotonic())
+                    continue
+                for sensor in due:
+                    del self._deadlines[sensor]
+
+            for sensor in due:
+                try:
+                    sensor.publish_state(priority=True)
+                except Exception:
+                    logging.exception('Unable to publish edge of {}.'.format(sensor.name))
+
+
+edges = EdgeDetector()
@@ -0,0 +1,210 @@
+"""Payload encoders turning sensor readings into MQTT payloads.
+
+JSON is the default and what Home Assistant's value templates read. It's encoded with the standard library unless
+`use_orjson` is set (`pip install orjson`). CBOR (`pip install cbor2`) and MessagePack (`pip install msgpack`) are
+opt-in per sensor for bandwidth constrained links, their consumers have to decode them, Home Assistant can't.
+"""
+import json
+import logging
+import re
+
+# payload keys read by Home Assistant templates, e.g. `value_json.temperature` or `value_json['28-0316a2795c47']`
+TEMPLATE_KEY = re.compile(r"""value_json(?:\.(\w+)|\[\s*['"]([^'"]+)['"]\s*\])""")
+
+
+def template_keys(discovery_config, state_topic):
+    """Payload keys the templates of a discovery config read from `state_topic`.
+
+    Every `<name>_template` pairs with `<name>_topic`, `value_template` with `state_topic`.
+    """
+    keys = []
+    for option, template in discovery_config.items():
+        if not option.endswith('_template') or not isinstance(template, str):
+            continue
+        prefix = option[:-len('template')]
+        topic = discovery_config.get('state_topic' if prefix == 'value_' else prefix + 'topic')
+        if topic == state_topic:
+            keys.extend(attribute or item for attribute, item in TEMPLATE_KEY.findall(template))
+    return keys
+
+
+def round_floats(data, precision):
+    if isinstance(data, float):
+        return round(data, precision)
+    if isinstance(data, dict):
+        return {key: round_floats(value, precision) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [round_floats(value, precision) for value in data]
+    return data
+
+
+class PayloadEncoder(object):
+    """Encodes readings of a sensor.
+
+    Args:
+        precision (int): Round floats to this many decimals. None keeps them as they are.
+        fields (list): Only publish these fields of a reading, in this order.
+        exclude (list): Drop these fields of a reading, e.g. HestiaPi's nested `bme280` reading.
+
+    Attributes:
+        binary (bool): Payloads are bytes rather than text.
+    """
+    name = None
+    binary = False
+
+    def __init__(self, precision=None, fields=None, exclude=None):
+        self.precision = precision
+        # computed once instead of per reading
+        self.fields = tuple(fields) if fields else None
+        self.exclude = frozenset(exclude or ())
+
+    @classmethod
+    def from_config(cls, sensor_config, default=None):
+        """Encoder of a sensor entry in config.yaml, e.g. `encoding: cbor` or `encoding: {format: json, precision:
+        1}`. Falls back to the top level `encoding` section. Returns None for the default JSON encoder."""
+        config = sensor_config.get('encoding', default)
+        if not config:
+            return None
+        if isinstance(config, str):
+            config = {'format': config}
+        name = config.get('format', 'json')
+        if name not in ENCODERS:
+            raise ValueError('Unknown payload encoding {}. Use one of {}.'.format(name, sorted(ENCODERS)))
+        options = {key: value for key, value in config.items() if key != 'format'}
+        encoder = ENCODERS[name](**options)
+        if encoder.binary:
+            logging.warning('{} publishes {} payloads. Home Assistant value templates can\'t read them.'.format(
+                sensor_config.get('name'), name))
+        return encoder
+
+    def dropped(self, keys):
+        """The `keys` that `fields` or `exclude` leave out of a reading."""
+        if self.fields is not None:
+            return [key for key in keys if key not in self.fields]
+        return [key for key in keys if key in self.exclude]
+
+    def check_templates(self, name, state_topic, discovery_configs):
+        """Warn about payload keys Home Assistant templates read from `state_topic` but `fields` or `exclude` drop.
+
+        Args:
+            discovery_configs: Discovery configs as JSON, e.g. `Discovery.configs.values()`.
+
+        Returns:
+            list: The dropped keys.
+        """
+        if self.fields is None and not self.exclude:
+            return []
+        keys = []
+        for payload in discovery_configs:
+            keys.extend(template_keys(json.loads(payload), state_topic))
+        dropped = sorted(set(self.dropped(keys)))
+        if dropped:
+            logging.warning('{} drops {} from its payloads. Home Assistant templates read them and will show '
+                            'unknown.'.format(name, ', '.join(dropped)))
+        return dropped
+
+    def prepare(self, data):
+        if isinstance(data, dict):
+            if self.fields is not None:
+                data = {key: data[key] for key in self.fields if key in data}
+            elif self.exclude:
+                data = {key: value for key, value in data.items() if key not in self.exclude}
+        if self.precision is not None:
+            data = round_floats(data, self.precision)
+        return data
+
+    def encode(self, data):
+        return self.dumps(self.prepare(data))
+
+    def dumps(self, data):
+        raise NotImplementedError
+
+    def loads(self, payload):
+        raise NotImplementedError
+
+
+class JSONEncoder(PayloadEncoder):
+    """JSON through the standard library, or orjson if `use_orjson` is set and it's installed.
+
+    Args:
+        compact (bool): Leave out the spaces after separators.
+        use_orjson (bool): Encode with orjson. Its output is always compact and publishes NaN and infinity as null.
+    """
+    name = 'json'
+
+    def __init__(self, compact=False, use_orjson=False, **kwargs):
+        super(JSONEncoder, self).__init__(**kwargs)
+        self.orjson = None
+        if use_orjson:
+            try:
+                import orjson
+                self.orjson = orjson
+            except ImportError:
+                logging.warning('orjson is not installed. Encoding JSON with the standard library.')
+        # json.dumps builds a new encoder for every call with non default arguments
+        self._encoder = json.JSONEncoder(separators=(',', ':') if compact else None)
+
+    def dumps(self, data):
+        if self.orjson is not None:
+            try:
+                return self.orjson.dumps(data).decode('utf-8')
+            except TypeError:
+                # e.g. non string keys, the standard library converts them
+                pass
+        return self._encoder.encode(data)
+
+    def loads(self, payload):
+        return json.loads(payload)
+
+
+class CBOREncoder(PayloadEncoder):
+    """CBOR (RFC 8949) through cbor2.
+
+    Args:
+        canonical (bool): Encode floats in the smallest size that represents them exactly. Also sorts keys.
+    """
+    name = 'cbor'
+    binary = True
+
+    def __init__(self, canonical=False, **kwargs):
+        import cbor2
+        super(CBOREncoder, self).__init__(**kwargs)
+        self.cbor2 = cbor2
+        self.canonical = canonical
+
+    def dumps(self, data):
+        return self.cbor2.dumps(data, canonical=self.canonical)
+
+    def loads(self, payload):
+        return self.cbor2.loads(payload)
+
+
+class MsgPackEncoder(PayloadEncoder):
+    """MessagePack through msgpack.
+
+    Args:
+        single_float (bool): Encode floats as 32 bit floats, 5 instead of 9 bytes with about 7 significant digits.
+    """
+    name = 'msgpack'
+    binary = True
+
+    def __init__(self, single_float=False, **kwargs):
+        import msgpack
+        super(MsgPackEncoder, self).__init__(**kwargs)
+        self.msgpack = msgpack
+        self.single_float = single_float
+
+    def dumps(self, data):
+        # a shared Packer isn't thread safe, edge and command threads publish too
+        return self.msgpack.packb(data, use_bin_type=True, use_single_float=self.single_float)
+
+    def loads(self, payload):
+        return self.msgpack.unpackb(payload, raw=False)
+
+
+ENCODERS = {'json': JSONEncoder,
+            'cbor': CBOREncoder,
+            'msgpack': MsgPackEncoder}
+
+# used by sensors without an `encoding`
+DEFAULT = JSONEncoder()
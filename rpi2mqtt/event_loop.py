@@ -1,4 +1,3 @@
-# import asyncio
 import logging
 import traceback
 import argparse
@@ -6,17 +5,12 @@ import subprocess
 import sys
 
 from rpi2mqtt.config import Config
-from rpi2mqtt.binary import *
-from rpi2mqtt.temperature import *
-from rpi2mqtt.ibeacon import Scanner
-from rpi2mqtt.switch import Switch
-from rpi2mqtt.thermostat import HestiaPi
-import time
-
-try:
-    from beacontools import BeaconScanner, IBeaconFilter
-except:
-    print("Unable to load beacontools")
+from rpi2mqtt.discovery import Discovery
+from rpi2mqtt.gpio import GPIO
+from rpi2mqtt.scheduler import Scheduler
+from rpi2mqtt.reader import SensorReader
+from rpi2mqtt.registry import Registry
+from rpi2mqtt.report import ReportPolicy
 
 
 # setup CLI parser
@@ -31,12 +25,25 @@ parser.add_argument('--generate-config',
                 help="Generate config.yaml template.",
                 action='store_true')
 
+parser.add_argument('--rediscover',
+                help='Publish all Home Assistant discovery configs even if they did not change.',
+                action='store_true')
+
+parser.add_argument('--asyncio',
+                help='Run sensors and MQTT on an asyncio event loop.',
+                action='store_true')
+
 parser.add_argument('--install-service',
                 help='Install rpi2mqtt as systemd service.',
                 action='store_true')
 
 
 def main():
+    if sys.argv[1:2] == ['bench']:
+        from rpi2mqtt import bench
+        bench.main(sys.argv[2:])
+        return
+
     config = None
     args = parser.parse_args() 
 
@@ -63,54 +70,125 @@ def main():
 
     # start MQTT client
     from rpi2mqtt.mqtt import MQTT
+
+    if args.asyncio or config.get('runtime') == 'asyncio':
+        from rpi2mqtt import aio
+        aio.run(config, args)
+        return
+
     MQTT.setup()
+    scheduler = Scheduler()
+    reader = SensorReader(scheduler, config.get('read_workers', 4), config.get('read_timeouts'))
+    setup_services(config, args, reader, scheduler)
+    sensors = setup_sensors(config, args)
+    for sensor, s in sensors:
+        reader.add(sensor.name, s, sensor.type, *read_schedule(config, sensor))
+    scanner = start_scanner(sensors)
+
+    try:
+        scheduler.run()
+    except:
+        traceback.print_exc()
+        reader.shutdown()
+        MQTT.client.loop_stop()
+        close_services(config)
 
+        if scanner:
+            scanner.stop()
+
+
+def setup_services(config, args, reader, scheduler=None):
+    """Set up discovery, GPIO and the optional services of config.yaml. Modules of services that aren't configured
+    (and the standard library modules they need, e.g. http.server for metrics) are never imported."""
+    Discovery.setup(config.get('discovery_cache'), force=args.rediscover,
+                    birth_topic=config.get('discovery_birth_topic', Discovery.BIRTH_TOPIC))
+    GPIO.setup(config.get('gpio'))
+    if config.get('history'):
+        from rpi2mqtt.history import History
+        History.setup(config.get('history'))
+    if config.get('metrics'):
+        from rpi2mqtt.metrics import Metrics
+        Metrics.setup(config.get('metrics'), reader, scheduler)
+    if config.get('profiling') is not False:
+        # SIGUSR2 profiles unless `profiling: false`
+        from rpi2mqtt.profiling import Profiler
+        Profiler.setup(config.get('profiling'))
+
+
+def close_services(config):
+    GPIO.close()
+    if config.get('history'):
+        from rpi2mqtt.history import History
+        History.close()
+    if config.get('metrics'):
+        from rpi2mqtt.metrics import Metrics
+        Metrics.close()
+
+
+def setup_sensors(config, args):
+    """Create the sensors in config.yaml and publish their discovery configs.
+
+    Returns:
+        list: (sensor config, sensor) tuples.
+    """
     sensor_list = []
     if len(config.sensors) >0:
         for sensor in config.sensors:
-            s = None
-            if sensor.type == 'dht22':
-                s = DHT(sensor.pin, sensor.topic, sensor.name, 'sensor', sensor.type)
-            elif sensor.type == 'ibeacon':
-                s = Scanner(sensor.name, sensor.topic, sensor.uuid, sensor.away_timeout)
-            elif sensor.type == 'switch':
-                s = Switch(sensor.name, sensor.pin, sensor.topic)
-            elif sensor.type == 'reed':
-                s = ReedSwitch(sensor.name, sensor.pin, sensor.topic, sensor.normally_open, sensor.get('device_type'))
-            elif sensor.type == 'bme280':
-                s = BME280(sensor.name, sensor.topic)
-            elif sensor.type == 'hestiapi':
-                s = HestiaPi(sensor.name, sensor.topic, sensor.heat_setpoint, sensor.cool_setpoint, dry_run=args.dry_run)
-            elif sensor.type == 'onewire':
-                s = OneWire(sensor.name, sensor.topic)
-            else:
+            s = Registry.create(sensor, args)
+            if s is None:
                 logging.warn('Sensor {} found in config, but was not setup.'.format(sensor.name))
-            if s:
-                sensor_list.append(s)
-
-        try:
-            scanner = BeaconScanner(sensor_list[1].process_ble_update) # TODO update to search sensor list and setup scanner accordingly.
-            scanner.start()
-        except:
-            logging.error("Beacon scanner did not start")
+                continue
+            s.report = ReportPolicy.from_config(sensor, config.get('heartbeat'))
+            if sensor.get('sample_interval'):
+                from rpi2mqtt.aggregate import WindowAggregator
+                s.aggregate = WindowAggregator()
+            if sensor.get('encoding') or config.get('encoding'):
+                from rpi2mqtt.encoding import PayloadEncoder
+                encoder = PayloadEncoder.from_config(sensor, config.get('encoding'))
+                if encoder:
+                    s.encoder = encoder
+                    encoder.check_templates(sensor.name, s.topic, Discovery.configs.values())
+            if config.get('history') and sensor.get('history', True):
+                from rpi2mqtt.history import History
+                History.register(s.topic, sensor.name, s.encoder)
+            sensor_list.append((sensor, s))
+
+        Discovery.flush()
+        if config.get('history'):
+            # readings missed before a restart
+            from rpi2mqtt.history import History
+            History.backfill()
     else:
         logging.warn("No sensors defined in {}".format(args.config))
-
+    return sensor_list
+
+
+def read_schedule(config, sensor):
+    """Interval, offset, jitter, read timeout and sample interval of a sensor entry in config.yaml."""
+    return (sensor.get('interval', config.polling_interval),
+            sensor.get('offset', 0),
+            sensor.get('jitter', 0),
+            sensor.get('read_timeout'),
+            sensor.get('sample_interval'))
+
+
+def start_scanner(sensors):
+    """Start a single BLE scanner routing advertisements to every iBeacon sensor."""
+    beacons = [s for _, s in sensors if hasattr(s, 'process_ble_update')]
+    if not beacons:
+        # don't load beacontools and bluetooth without a BLE sensor
+        return None
+    from rpi2mqtt.ble import BeaconDispatcher
+    dispatcher = BeaconDispatcher()
+    for s in beacons:
+        dispatcher.register(s)
     try:
-        while True:
-
-            for sensor in sensor_list:
-                sensor.callback()
-
-            time.sleep(config.polling_interval)
-            MQTT.ping_subscriptions()
-
+        from beacontools import BeaconScanner
+        scanner = BeaconScanner(dispatcher.dispatch)
+        scanner.start()
+        return scanner
     except:
-        traceback.print_exc()
-        MQTT.client.loop_stop()
-
-        if scanner:
-            scanner.stop()
+        logging.error("Beacon scanner did not start")
 
 
 def install_service(username, _path, config_path):
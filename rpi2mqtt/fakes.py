@@ -0,0 +1,191 @@
+"""In-process stand-ins for the Raspberry Pi hardware and the paho MQTT client, used by `rpi2mqtt bench`.
+
+`install()` registers fake `RPi.GPIO`, `smbus2`, `bme280` and `Adafruit_DHT` modules. It must run before any
+sensor module is imported. `FakeClient` replaces the paho client and counts what would have been sent.
+"""
+from types import ModuleType, SimpleNamespace
+import datetime
+import os
+import random
+import sys
+import threading
+
+
+class FakeGPIO(ModuleType):
+    """RPi.GPIO with inputs following `levels` and outputs written to it."""
+    BCM = 11
+    BOARD = 10
+    IN = 1
+    OUT = 0
+    HIGH = 1
+    LOW = 0
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        super(FakeGPIO, self).__init__('RPi.GPIO')
+        self.levels = {}
+        self.callbacks = {}
+        self.reads = 0
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, channel, direction, pull_up_down=None, initial=None):
+        for pin in channel if isinstance(channel, (list, tuple)) else [channel]:
+            self.levels.setdefault(pin, initial or 0)
+
+    def input(self, channel):
+        self.reads += 1
+        return self.levels.get(channel, 0)
+
+    def output(self, channel, state):
+        for pin in channel if isinstance(channel, (list, tuple)) else [channel]:
+            self.levels[pin] = state
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        self.callbacks[channel] = callback
+
+    def remove_event_detect(self, channel):
+        self.callbacks.pop(channel, None)
+
+    def cleanup(self, channel=None):
+        pass
+
+    def toggle(self, channel):
+        """Flip an input and run its edge callback, like a switch changing."""
+        self.levels[channel] = 1 - self.levels.get(channel, 0)
+        callback = self.callbacks.get(channel)
+        if callback:
+            callback(channel)
+
+
+class FakeSMBus(object):
+
+    def __init__(self, port=1):
+        self.port = port
+
+    def close(self):
+        pass
+
+
+def fake_bme280():
+    module = ModuleType('bme280')
+
+    def load_calibration_params(bus, address):
+        return SimpleNamespace(address=address)
+
+    def sample(bus, address, calibration_params):
+        return SimpleNamespace(id='fake', timestamp=datetime.datetime.now(),
+                               temperature=21.0 + random.random(),
+                               pressure=1013.0 + random.random(),
+                               humidity=45.0 + random.random())
+
+    module.load_calibration_params = load_calibration_params
+    module.sample = sample
+    return module
+
+
+def fake_dht():
+    module = ModuleType('Adafruit_DHT')
+    module.read_retry = lambda sensor, pin: (45.0 + random.random(), 21.0 + random.random())
+    return module
+
+
+def install():
+    """Register the fake hardware modules. Returns the FakeGPIO module."""
+    gpio = FakeGPIO()
+    rpi = ModuleType('RPi')
+    rpi.GPIO = gpio
+    smbus2 = ModuleType('smbus2')
+    smbus2.SMBus = FakeSMBus
+    sys.modules.update({'RPi': rpi,
+                        'RPi.GPIO': gpio,
+                        'smbus2': smbus2,
+                        'bme280': fake_bme280(),
+                        'Adafruit_DHT': fake_dht()})
+    return gpio
+
+
+def w1_tree(base_dir, devices, temperature_attribute=False):
+    """Create a fake `/sys/bus/w1/devices` tree with `devices` DS18B20 probes under `base_dir`."""
+    for i in range(devices):
+        directory = os.path.join(base_dir, '28-{:012x}'.format(i))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'w1_slave'), 'w') as f:
+            f.write('72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n72 01 4b 46 7f ff 0e 10 57 t=23125\n')
+        if temperature_attribute:
+            with open(os.path.join(directory, 'temperature'), 'w') as f:
+                f.write('23125\n')
+    master = os.path.join(base_dir, 'w1_bus_master1')
+    os.makedirs(master, exist_ok=True)
+    open(os.path.join(master, 'therm_bulk_read'), 'w').close()
+    return base_dir
+
+
+class FakeMessageInfo(object):
+
+    def __init__(self, mid):
+        self.mid = mid
+        self.rc = 0
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+    def is_published(self):
+        return True
+
+
+class FakeClient(object):
+    """paho Client stand-in acknowledging every publish and subscribe without a network.
+
+    Attributes:
+        messages (int): PUBLISH packets sent.
+        bytes (int): Size of those packets on the wire.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self._mid = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def packet_size(topic, payload, qos=0):
+        """Size of an MQTT 3.1.1 PUBLISH packet."""
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        remaining = 2 + len(topic.encode('utf-8')) + len(payload or b'') + (2 if qos else 0)
+        length = 1
+        while remaining >= 128 ** length:
+            length += 1
+        return 1 + length + remaining
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        with self._lock:
+            self.messages += 1
+            self.bytes += FakeClient.packet_size(topic, payload, qos)
+            self._mid += 1
+            return FakeMessageInfo(self._mid)
+
+    def subscribe(self, topic, qos=0):
+        # never acknowledged, MQTT.on_subscribe isn't needed for benchmarks
+        with self._lock:
+            self._mid += 1
+            return 0, self._mid
+
+    def message_callback_add(self, topic, callback):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
@@ -0,0 +1,426 @@
+"""GPIO backends. Sensors use the `GPIO` front end and never import a GPIO library themselves.
+
+Select a backend in the `gpio` section of config.yaml:
+
+* `rpi` (default): RPi.GPIO.
+* `gpiod`: the Linux GPIO character device through libgpiod >= 2. Inputs set up together are requested as one line
+  request and read with a single ioctl, so a multi-pin switch or the four HVAC pins are sampled atomically. Inputs
+  with the same pull are merged into one request, e.g. a panel of reed switches.
+* `simulated`: pins in memory, for running without hardware.
+
+Pins are BCM numbers, levels are 0 or 1. Like RPi.GPIO, backends raise RuntimeError when writing a pin that isn't
+set up as an output.
+"""
+import logging
+import select
+import threading
+import time
+
+PULL_UP = 'up'
+PULL_DOWN = 'down'
+
+
+class Backend(object):
+
+    def setup_input(self, pins, pull=None):
+        raise NotImplementedError
+
+    def setup_output(self, pins, initial=0):
+        raise NotImplementedError
+
+    def read(self, pin):
+        return self.read_many([pin])[0]
+
+    def read_many(self, pins):
+        """Levels of `pins` as a tuple in the same order."""
+        raise NotImplementedError
+
+    def write(self, pins, level):
+        raise NotImplementedError
+
+    def watch(self, pin, callback):
+        """Call `callback(pin)` from a backend thread on every edge of input `pin`."""
+        raise NotImplementedError
+
+    def unwatch(self, pin):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class RPiBackend(Backend):
+    """RPi.GPIO. Reads one pin per call, `read_many` reads them one after another."""
+
+    def __init__(self):
+        import RPi.GPIO
+        self.gpio = RPi.GPIO
+        self.gpio.setmode(self.gpio.BCM)
+        self.pulls = {PULL_UP: self.gpio.PUD_UP, PULL_DOWN: self.gpio.PUD_DOWN, None: self.gpio.PUD_OFF}
+
+    def setup_input(self, pins, pull=None):
+        for pin in pins:
+            self.gpio.setup(pin, self.gpio.IN, pull_up_down=self.pulls[pull])
+
+    def setup_output(self, pins, initial=0):
+        self.gpio.setup(list(pins), self.gpio.OUT, initial=self.gpio.HIGH if initial else self.gpio.LOW)
+
+    def read(self, pin):
+        return self.gpio.input(pin)
+
+    def read_many(self, pins):
+        return tuple(self.gpio.input(pin) for pin in pins)
+
+    def write(self, pins, level):
+        self.gpio.output(list(pins), self.gpio.HIGH if level else self.gpio.LOW)
+
+    def watch(self, pin, callback):
+        self.gpio.add_event_detect(pin, self.gpio.BOTH, callback=lambda channel: callback(pin))
+
+    def unwatch(self, pin):
+        self.gpio.remove_event_detect(pin)
+
+
+class SimulatedBackend(Backend):
+    """Pins in memory. Inputs start at the level of their pull and change with `set_input`, which runs edge callbacks
+    like a real input changing.
+
+    Attributes:
+        levels (dict): Pin to level.
+        calls (int): read_many calls, i.e. what would have been syscalls on the character device.
+    """
+
+    def __init__(self):
+        self.levels = {}
+        self.outputs = set()
+        self.callbacks = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def setup_input(self, pins, pull=None):
+        with self._lock:
+            for pin in pins:
+                self.outputs.discard(pin)
+                self.levels.setdefault(pin, 1 if pull == PULL_UP else 0)
+
+    def setup_output(self, pins, initial=0):
+        with self._lock:
+            for pin in pins:
+                self.outputs.add(pin)
+                self.levels[pin] = 1 if initial else 0
+
+    def read_many(self, pins):
+        with self._lock:
+            self.calls += 1
+            return tuple(self.levels.get(pin, 0) for pin in pins)
+
+    def write(self, pins, level):
+        with self._lock:
+            for pin in pins:
+                if pin not in self.outputs:
+                    raise RuntimeError('GPIO{} is not set up as an output.'.format(pin))
+            for pin in pins:
+                self.levels[pin] = 1 if level else 0
+
+    def set_input(self, pin, level):
+        with self._lock:
+            changed = self.levels.get(pin, 0) != level
+            self.levels[pin] = level
+            callback = self.callbacks.get(pin)
+        if changed and callback:
+            callback(pin)
+
+    def toggle(self, pin):
+        self.set_input(pin, 1 - self.levels.get(pin, 0))
+
+    def watch(self, pin, callback):
+        self.callbacks[pin] = callback
+
+    def unwatch(self, pin):
+        self.callbacks.pop(pin, None)
+
+
+class GpiodBackend(Backend):
+    """Linux GPIO character device through the libgpiod >= 2 Python bindings.
+
+    A line can only belong to one request. Setting up lines again releases the requests they were part of and
+    requests the remaining lines of those again.
+
+    Args:
+        chip (str): GPIO chip device. The 40 pin header is gpiochip0, or gpiochip4 on a Raspberry Pi 5 with older
+            kernels.
+    """
+    CONSUMER = 'rpi2mqtt'
+
+    def __init__(self, chip='/dev/gpiochip0'):
+        import gpiod
+        from gpiod.line import Bias, Direction, Edge, Value
+        self.gpiod = gpiod
+        self.Direction = Direction
+        self.Edge = Edge
+        self.Value = Value
+        self.biases = {PULL_UP: Bias.PULL_UP, PULL_DOWN: Bias.PULL_DOWN, None: Bias.DISABLED}
+        self.chip = chip
+        self._requests = {}
+        self._settings = {}
+        self._pulls = {}
+        self._callbacks = {}
+        self._lock = threading.Condition()
+        self._thread = None
+
+    def _input_settings(self, pin):
+        edge = self.Edge.BOTH if pin in self._callbacks else self.Edge.NONE
+        return self.gpiod.LineSettings(direction=self.Direction.INPUT, bias=self.biases[self._pulls[pin]],
+                                       edge_detection=edge)
+
+    def _request_lines(self, pins):
+        request = self.gpiod.request_lines(self.chip, consumer=GpiodBackend.CONSUMER,
+                                           config={pin: self._settings[pin] for pin in pins})
+        for pin in pins:
+            self._requests[pin] = request
+        logging.debug('Requested GPIO{} from {}.'.format(sorted(pins), self.chip))
+
+    def _request(self, pins):
+        released = []
+        for pin in pins:
+            request = self._requests.pop(pin, None)
+            if request is not None and not any(request is r for r in released):
+                released.append(request)
+        for request in released:
+            leftover = [pin for pin in request.offsets if pin not in pins]
+            outputs = [pin for pin in leftover if pin not in self._pulls]
+            if outputs:
+                # requesting outputs again drives their initial value, keep what they're driving now
+                for pin, value in zip(outputs, request.get_values(outputs)):
+                    self._settings[pin].output_value = value
+            request.release()
+            if leftover:
+                self._request_lines(leftover)
+        self._request_lines(pins)
+
+    def _reconfigure(self, pin):
+        request = self._requests[pin]
+        request.reconfigure_lines({offset: self._settings[offset] for offset in request.offsets})
+
+    def setup_input(self, pins, pull=None):
+        with self._lock:
+            # merge with the inputs of the same pull so they're read together
+            pins = list(pins) + [pin for pin, p in self._pulls.items() if p == pull and pin not in pins]
+            for pin in pins:
+                self._pulls[pin] = pull
+                self._settings[pin] = self._input_settings(pin)
+            self._request(pins)
+
+    def setup_output(self, pins, initial=0):
+        value = self.Value.ACTIVE if initial else self.Value.INACTIVE
+        with self._lock:
+            for pin in pins:
+                self._pulls.pop(pin, None)
+                self._callbacks.pop(pin, None)
+                self._settings[pin] = self.gpiod.LineSettings(direction=self.Direction.OUTPUT, output_value=value)
+            self._request(list(pins))
+
+    def _by_request(self, pins):
+        requests = []
+        for pin in pins:
+            request = self._requests.get(pin)
+            if request is None:
+                raise RuntimeError('GPIO{} is not set up.'.format(pin))
+            for r, offsets in requests:
+                if r is request:
+                    offsets.append(pin)
+                    break
+            else:
+                requests.append((request, [pin]))
+        return requests
+
+    def read_many(self, pins):
+        levels = {}
+        with self._lock:
+            # one ioctl per line request
+            for request, offsets in self._by_request(pins):
+                levels.update(zip(offsets, request.get_values(offsets)))
+        return tuple(1 if levels[pin] == self.Value.ACTIVE else 0 for pin in pins)
+
+    def write(self, pins, level):
+        value = self.Value.ACTIVE if level else self.Value.INACTIVE
+        with self._lock:
+            for pin in pins:
+                if pin in self._pulls or pin not in self._settings:
+                    raise RuntimeError('GPIO{} is not set up as an output.'.format(pin))
+            for request, offsets in self._by_request(pins):
+                request.set_values({pin: value for pin in offsets})
+
+    def watch(self, pin, callback):
+        with self._lock:
+            if pin not in self._pulls:
+                raise RuntimeError('GPIO{} is not set up as an input.'.format(pin))
+            self._callbacks[pin] = callback
+            self._settings[pin] = self._input_settings(pin)
+            self._reconfigure(pin)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='rpi2mqtt-gpiod', daemon=True)
+                self._thread.start()
+            self._lock.notify()
+
+    def unwatch(self, pin):
+        with self._lock:
+            if self._callbacks.pop(pin, None) is None:
+                return
+            self._settings[pin] = self._input_settings(pin)
+            self._reconfigure(pin)
+
+    def _watched(self):
+        with self._lock:
+            self._lock.wait_for(lambda: self._callbacks)
+            requests = []
+            for pin in self._callbacks:
+                if not any(self._requests[pin] is r for r in requests):
+                    requests.append(self._requests[pin])
+            return requests
+
+    def _run(self):
+        while True:
+            requests = {request.fd: request for request in self._watched()}
+            try:
+                # wake up now and then to pick up requests made since
+                ready, _, _ = select.select(list(requests), [], [], 1.0)
+            except (OSError, ValueError):
+                # a request was released while waiting
+                continue
+            for fd in ready:
+                request = requests[fd]
+                try:
+                    events = request.read_edge_events()
+                except Exception:
+                    # released meanwhile
+                    continue
+                for event in events:
+                    callback = self._callbacks.get(event.line_offset)
+                    if callback:
+                        try:
+                            callback(event.line_offset)
+                        except Exception:
+                            logging.exception('Edge callback of GPIO{} failed.'.format(event.line_offset))
+
+    def close(self):
+        with self._lock:
+            released = []
+            for request in self._requests.values():
+                if not any(request is r for r in released):
+                    released.append(request)
+                    request.release()
+            self._requests = {}
+
+
+class PinBank(object):
+    """Inputs of several sensors read together, e.g. a panel of reed switches.
+
+    The first read after the levels are `max_age` seconds old reads every pin of the bank with a single `read_many`,
+    i.e. a single ioctl on the gpiod backend. Sensors polled on the same schedule read it within the same tick and
+    reuse those levels.
+
+    Attributes:
+        pins (list): Pins of the bank in read order.
+        max_age (float): Seconds the levels of the last read are reused.
+    """
+    DEFAULT_MAX_AGE = 0.1
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE):
+        self.pins = []
+        self.max_age = max_age
+        self._levels = {}
+        self._read_time = None
+        self._lock = threading.Lock()
+
+    def add(self, pin):
+        with self._lock:
+            if pin not in self.pins:
+                self.pins.append(pin)
+                self._read_time = None
+
+    def invalidate(self):
+        """Read the pins again on the next `read`, e.g. after an edge."""
+        with self._lock:
+            self._read_time = None
+
+    def read(self, pin):
+        with self._lock:
+            now = time.monotonic()
+            if self._read_time is None or now - self._read_time > self.max_age:
+                self._levels = dict(zip(self.pins, GPIO.read_many(self.pins)))
+                self._read_time = now
+            return self._levels[pin]
+
+
+class GPIO():
+    """GPIO front end delegating to the configured backend. Uses RPi.GPIO unless `setup` selected another one.
+
+    Attributes:
+        backend (Backend): Backend in use. Created on first use.
+    """
+    BACKENDS = {'rpi': RPiBackend,
+                'gpiod': GpiodBackend,
+                'simulated': SimulatedBackend}
+
+    backend = None
+
+    @classmethod
+    def setup(cls, config=None):
+        """Select the backend of the `gpio` section of config.yaml, e.g. `{'backend': 'gpiod', 'chip': ...}` or just
+        the backend name."""
+        if isinstance(config, str):
+            config = {'backend': config}
+        config = config or {}
+        name = config.get('backend', 'rpi')
+        if name not in GPIO.BACKENDS:
+            raise ValueError('Unknown GPIO backend {}. Use one of {}.'.format(name, sorted(GPIO.BACKENDS)))
+        options = {key: value for key, value in config.items() if key != 'backend'}
+        if cls.backend is not None:
+            cls.backend.close()
+        cls.backend = GPIO.BACKENDS[name](**options)
+        logging.info('Using {} GPIO backend.'.format(name))
+        return cls.backend
+
+    @classmethod
+    def get(cls):
+        if cls.backend is None:
+            cls.backend = RPiBackend()
+        return cls.backend
+
+    @staticmethod
+    def pins(pins):
+        return pins if isinstance(pins, (list, tuple)) else [pins]
+
+    @classmethod
+    def setup_input(cls, pins, pull=None):
+        cls.get().setup_input(GPIO.pins(pins), pull)
+
+    @classmethod
+    def setup_output(cls, pins, initial=0):
+        cls.get().setup_output(GPIO.pins(pins), initial)
+
+    @classmethod
+    def read(cls, pin):
+        return cls.get().read(pin)
+
+    @classmethod
+    def read_many(cls, pins):
+        return cls.get().read_many(list(GPIO.pins(pins)))
+
+    @classmethod
+    def write(cls, pins, level):
+        cls.get().write(GPIO.pins(pins), level)
+
+    @classmethod
+    def watch(cls, pin, callback):
+        cls.get().watch(pin, callback)
+
+    @classmethod
+    def unwatch(cls, pin):
+        cls.get().unwatch(pin)
+
+    @classmethod
+    def close(cls):
+        if cls.backend is not None:
+            cls.backend.close()
@@ -0,0 +1,257 @@
+"""Local history of readings that never reached the broker, backfilled once the connection returns.
+
+Each sensor gets a fixed size ring of timestamped payloads of any length in a memory-mapped file. Writing a reading is a memcpy
+into the page cache, the kernel writes dirty pages back in batches, so an outage doesn't mean a write to the SD card
+per reading. The file survives restarts, readings missed before a crash are backfilled after it.
+"""
+from rpi2mqtt import encoding
+from rpi2mqtt.mqtt import MQTT as mqtt
+from paho.mqtt.client import MQTT_ERR_SUCCESS
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+
+class RingStore(object):
+    """Ring of variable length (timestamp, payload) records in a memory-mapped file.
+
+    Records are written back to back and wrap around the end of the data area. The header keeps the byte offset of the
+    next record to write and of the oldest record not backfilled yet, everything in between is pending. Offsets only
+    grow, they're taken modulo `size` when accessing the file. Once the ring is full the oldest pending records are
+    overwritten.
+
+    Attributes:
+        path (str): Backing file.
+        size (int): Bytes of the data area. A record takes its payload plus a 12 byte header.
+        overwritten (int): Pending records lost to a full ring since the store was opened.
+    """
+    MAGIC = b'R2MH'
+    VERSION = 2
+    DEFAULT_SIZE = 1024 * 1024
+    # magic, version, data size, write offset, backfill offset, pending records
+    HEADER = struct.Struct('<4sHQQQQ')
+    # timestamp, payload length
+    RECORD = struct.Struct('<dI')
+
+    def __init__(self, path, size=DEFAULT_SIZE):
+        if size <= RingStore.RECORD.size:
+            raise ValueError('size must be larger than {} bytes.'.format(RingStore.RECORD.size))
+        self.path = path
+        self.size = size
+        self.overwritten = 0
+        self._lock = threading.Lock()
+        length = RingStore.HEADER.size + size
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != length:
+                os.ftruncate(fd, length)
+            self._mmap = mmap.mmap(fd, length)
+        finally:
+            # the mapping keeps the file open
+            os.close(fd)
+
+        magic, version, data_size, self.written, self.backfilled, self.records = RingStore.HEADER.unpack_from(
+            self._mmap, 0)
+        if (magic, version, data_size) != (RingStore.MAGIC, RingStore.VERSION, size) or not self._valid():
+            if magic == RingStore.MAGIC:
+                logging.warning('History {} has a different layout. Discarding it.'.format(path))
+            self.written = self.backfilled = self.records = 0
+            self._write_header()
+
+    def __len__(self):
+        return self.records
+
+    def _write_header(self):
+        RingStore.HEADER.pack_into(self._mmap, 0, RingStore.MAGIC, RingStore.VERSION, self.size, self.written,
+                                   self.backfilled, self.records)
+
+    def _read(self, offset, length):
+        start = RingStore.HEADER.size + offset % self.size
+        first = min(length, RingStore.HEADER.size + self.size - start)
+        data = self._mmap[start:start + first]
+        if first < length:
+            data += self._mmap[RingStore.HEADER.size:RingStore.HEADER.size + length - first]
+        return data
+
+    def _write(self, offset, data):
+        start = RingStore.HEADER.size + offset % self.size
+        first = min(len(data), RingStore.HEADER.size + self.size - start)
+        self._mmap[start:start + first] = data[:first]
+        if first < len(data):
+            self._mmap[RingStore.HEADER.size:RingStore.HEADER.size + len(data) - first] = data[first:]
+
+    def _record_length(self, offset):
+        _, length = RingStore.RECORD.unpack(self._read(offset, RingStore.RECORD.size))
+        return RingStore.RECORD.size + length
+
+    def _valid(self):
+        """Whether the pending records fill exactly the bytes between the backfill and write offsets."""
+        if not 0 <= self.written - self.backfilled <= self.size:
+            return False
+        offset = self.backfilled
+        for _ in range(self.records):
+            if self.written - offset < RingStore.RECORD.size:
+                return False
+            offset += self._record_length(offset)
+        return offset == self.written
+
+    def _drop_oldest(self):
+        self.backfilled += self._record_length(self.backfilled)
+        self.records -= 1
+
+    def append(self, timestamp, payload):
+        """Store a reading. Returns False if the payload is larger than the whole ring."""
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        record = RingStore.RECORD.pack(timestamp, len(payload)) + payload
+        if len(record) > self.size:
+            logging.warning('{} byte payload exceeds the {} byte history {}.'.format(
+                len(payload), self.size, self.path))
+            return False
+
+        with self._lock:
+            if self.written + len(record) - self.backfilled > self.size:
+                while self.written + len(record) - self.backfilled > self.size:
+                    self._drop_oldest()
+                    self.overwritten += 1
+                # moved past the records about to be overwritten before touching them, a crash meanwhile doesn't
+                # leave a header pointing at half overwritten records
+                self._write_header()
+            self._write(self.written, record)
+            self.written += len(record)
+            self.records += 1
+            self._write_header()
+        return True
+
+    def pending(self, limit):
+        """Up to `limit` of the oldest pending records and the offset to `ack` once they were backfilled."""
+        with self._lock:
+            records = []
+            offset = self.backfilled
+            while len(records) < limit and offset < self.written:
+                timestamp, length = RingStore.RECORD.unpack(self._read(offset, RingStore.RECORD.size))
+                records.append((timestamp, self._read(offset + RingStore.RECORD.size, length)))
+                offset += RingStore.RECORD.size + length
+            return records, offset
+
+    def ack(self, offset):
+        with self._lock:
+            # records overwritten meanwhile already moved the mark past offset
+            while self.backfilled < min(offset, self.written):
+                self._drop_oldest()
+            self._write_header()
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        self.flush()
+        self._mmap.close()
+
+
+class History():
+    """Stores readings the outbox lost while the broker was unreachable and backfills them after reconnecting.
+
+    Only readings lost while disconnected are stored. While connected a conflated reading was replaced by a newer one
+    that is sent, it isn't missing from the broker.
+
+    Backfilled readings are published to `{topic}/history` as arrays of `{"timestamp": ..., "state": ...}` in the
+    sensor's payload encoding, `batch_size` readings per message and one message every `batch_interval` seconds. They're not retained, Home
+    Assistant keeps showing the live state topic.
+
+    Attributes:
+        stores (dict): State topic to RingStore.
+        encoders (dict): State topic to the PayloadEncoder of its readings.
+        config (DotMap): `history` section of config.yaml. History is disabled without one.
+    """
+    DEFAULT_PATH = '~/.rpi2mqtt/history'
+
+    config = None
+    path = None
+    stores = {}
+    encoders = {}
+    _backfill = None
+    _backfill_lock = threading.Lock()
+
+    @classmethod
+    def setup(cls, config=None):
+        cls.config = config
+        if not config:
+            return
+        cls.path = os.path.expanduser(config.get('path', History.DEFAULT_PATH))
+        os.makedirs(cls.path, exist_ok=True)
+        mqtt.outbox.on_lost = cls.record
+        mqtt.connect_listeners.append(cls.backfill)
+
+    @classmethod
+    def register(cls, topic, name, encoder=encoding.DEFAULT):
+        """Keep a history of the readings published to `topic` by sensor `name` with `encoder`."""
+        if not cls.config:
+            return
+        cls.encoders[topic] = encoder
+        filename = os.path.join(cls.path, '{}.ring'.format(re.sub(r'[^\w.-]', '_', name)))
+        cls.stores[topic] = RingStore(filename, cls.config.get('size', RingStore.DEFAULT_SIZE))
+        logging.debug('Keeping history of {} in {} ({} pending).'.format(topic, filename, len(cls.stores[topic])))
+
+    @classmethod
+    def record(cls, topic, payload, timestamp):
+        if mqtt.connected:
+            # conflated by a newer reading or dropped while the broker keeps up, not lost to an outage
+            return
+        store = cls.stores.get(topic)
+        if store is not None:
+            store.append(timestamp, payload)
+
+    @classmethod
+    def backfill(cls):
+        """Start backfilling pending readings unless it's already running."""
+        with cls._backfill_lock:
+            if not any(len(store) for store in cls.stores.values()):
+                return
+            if cls._backfill is None or not cls._backfill.is_alive():
+                cls._backfill = threading.Thread(target=cls._run, name='rpi2mqtt-backfill', daemon=True)
+                cls._backfill.start()
+
+    @classmethod
+    def close(cls):
+        for store in cls.stores.values():
+            store.close()
+        cls.stores = {}
+
+    @staticmethod
+    def batch_payload(records, encoder=encoding.DEFAULT):
+        batch = []
+        for timestamp, payload in records:
+            try:
+                state = encoder.loads(payload)
+            except Exception:
+                # recorded before the sensor's encoding changed
+                state = payload.decode('utf-8', 'replace')
+            batch.append({'timestamp': timestamp, 'state': state})
+        return encoder.dumps(batch)
+
+    @classmethod
+    def _run(cls):
+        batch_size = cls.config.get('batch_size', 50)
+        batch_interval = cls.config.get('batch_interval', 1)
+        for topic, store in list(cls.stores.items()):
+            while len(store) and mqtt.connected:
+                records, offset = store.pending(batch_size)
+                payload = History.batch_payload(records, cls.encoders.get(topic, encoding.DEFAULT))
+                info = mqtt.client.publish('{}/history'.format(topic), payload, qos=1)
+                if info.rc != MQTT_ERR_SUCCESS:
+                    logging.warning('Backfill of {} interrupted. Resuming after reconnecting.'.format(topic))
+                    return
+                info.wait_for_publish(timeout=30)
+                if not info.is_published():
+                    logging.warning('Backfill of {} timed out. Resuming after reconnecting.'.format(topic))
+                    return
+                store.ack(offset)
+                logging.info('Backfilled {} readings of {}, {} pending.'.format(len(records), topic, len(store)))
+                time.sleep(batch_interval)
+            store.flush()
@@ -1,19 +1,47 @@
 from rpi2mqtt.base import Sensor
+from rpi2mqtt.ble import away
 import json
-from datetime import datetime, timedelta
+import threading
+import time
 
 
 class Scanner(Sensor):
+    """Presence of an iBeacon.
 
-    def __init__(self, name, topic, beacon_uuid, away_timeout=10):
+    Advertisements are routed here by `BeaconDispatcher`. Presence changes are published right away, departures by
+    `AwayDetector` as soon as `away_timeout` expired. RSSI is smoothed with an exponentially weighted moving average and RSSI-only changes are published at most every
+    `rssi_interval` seconds.
+
+    Attributes:
+        beacon_uuid (str): iBeacon uuid.
+        major (int): iBeacon major. None matches any.
+        minor (int): iBeacon minor. None matches any.
+        rssi_alpha (float): Smoothing factor of the RSSI average. Higher values follow new advertisements closer.
+        rssi_interval (float): Minimum seconds between publishes of RSSI changes.
+    """
+
+    def __init__(self, name, topic, beacon_uuid, away_timeout=10, major=None, minor=None, rssi_alpha=0.3,
+                 rssi_interval=60):
         super(Scanner, self).__init__(name, None, topic, 'presence', 'ibeacon')
         self.present = 'OFF'
         self.rssi = None
         self.beacon_uuid = beacon_uuid
+        self.major = major
+        self.minor = minor
         self.away_timeout = away_timeout
-        self.last_seen = datetime.now()
+        self.rssi_alpha = rssi_alpha
+        self.rssi_interval = rssi_interval
+        self.last_seen = time.monotonic()
+        self._published_rssi = None
+        self._published_at = None
+        self._lock = threading.Lock()
         self.setup()
 
+    @classmethod
+    def from_config(cls, sensor, args):
+        return cls(sensor.name, sensor.topic, sensor.uuid, sensor.away_timeout, sensor.get('major'), sensor.get('minor'),
+                   sensor.get('rssi_alpha', 0.3), sensor.get('rssi_interval', 60))
+
     @property
     def homeassistant_mqtt_config(self):
         config = super(Scanner, self).homeassistant_mqtt_config
@@ -47,24 +75,43 @@ class Scanner(Sensor):
         # mqtt.publish('homeassistant/binary_sensor/{}_{}/config'.format(self.name, 'presence'), config)
 
     def process_ble_update(self, bt_addr, rssi, packet, additional_info):
-        new_state = self.present
-        if self.beacon_uuid == additional_info['uuid']:
-            new_state = 'ON'
-        self.rssi = rssi
-        self.last_seen = datetime.now()
+        """Handle an advertisement of this beacon. Runs on the BLE scanner's thread."""
+        now = time.monotonic()
+        with self._lock:
+            self.last_seen = now
+            if self.rssi is None:
+                self.rssi = float(rssi)
+            else:
+                self.rssi += self.rssi_alpha * (rssi - self.rssi)
+            arrived = self.present != 'ON'
+            self.present = 'ON'
 
-        if new_state != self.present:
-            self.present = new_state
-            self.callback()
+        if arrived:
+            away.track(self)
+            self.publish_state(force=True, priority=True)
+        elif self._published_at is None or now - self._published_at >= self.rssi_interval:
+            if round(self.rssi) != self._published_rssi:
+                self.publish_state()
 
-    def state(self):
-        if self.present == 'ON' and self.last_seen + timedelta(seconds=self.away_timeout) < datetime.now():
-            self.present = 'OFF'
+    def publish_state(self, force=False, priority=False):
+        self._published_at = time.monotonic()
+        self._published_rssi = None if self.rssi is None else round(self.rssi)
+        super(Scanner, self).publish_state(force, priority)
+
+    def check_away(self):
+        """Mark the beacon away if it wasn't seen for `away_timeout` seconds. Returns True if it just left."""
+        with self._lock:
+            if self.present == 'ON' and self.last_seen + self.away_timeout <= time.monotonic():
+                self.present = 'OFF'
+                return True
+        return False
 
+    def state(self):
+        self.check_away()
         return self.present
 
-    def payload(self):
-        return json.dumps({'presence': self.present, 'rssi': self.rssi})
+    def data(self):
+        return {'presence': self.state(), 'rssi': self._published_rssi}
 
     # def callback(self):
     #     mqtt.publish(self.topic, self.payload())
\ No newline at end of file
@@ -0,0 +1,263 @@
+"""Prometheus text format metrics endpoint. Enable with a `metrics` section in config.yaml.
+
+Most metrics are read from counters rpi2mqtt keeps anyway (SensorReader.stats, the outbox stats, Job.last_lag) when
+the endpoint is scraped. Histograms are only created once the endpoint is enabled, until then the hot paths only
+check for None.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from rpi2mqtt.mqtt import MQTT as mqtt
+import bisect
+import logging
+import os
+import resource
+import threading
+import time
+
+
+class Histogram(object):
+    """Cumulative histogram with fixed buckets.
+
+    Not locked, every histogram must only be observed by one thread at a time, e.g. under the outbox lock or by the
+    single running read of a sensor.
+    """
+    # seconds, from a GPIO read to a DHT22 retrying for its full deadline
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """(upper bound, cumulative count) per bucket, '+Inf' last."""
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Family(object):
+    """Lines of one metric family."""
+
+    def __init__(self, name, metric_type, help_text):
+        self.name = name
+        self.lines = ['# HELP {} {}'.format(name, help_text), '# TYPE {} {}'.format(name, metric_type)]
+
+    @staticmethod
+    def labels(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(key, escape(value)) for key, value in labels.items()) + '}'
+
+    def add(self, value, labels=None, suffix=''):
+        if value is None:
+            return
+        self.lines.append('{}{}{} {}'.format(self.name, suffix, Family.labels(labels), float(value)))
+
+    def add_histogram(self, histogram, labels=None):
+        labels = labels or {}
+        for bound, count in histogram.samples():
+            self.add(count, dict(labels, le=bound), '_bucket')
+        self.add(histogram.sum, labels, '_sum')
+        self.add(histogram.count, labels, '_count')
+
+
+def process_stats():
+    """Resident memory in bytes and CPU seconds of this process."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        rss = None
+    return rss, usage.ru_utime + usage.ru_stime
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = Metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', Metrics.CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # client_address is empty on the Unix socket
+        logging.debug('Metrics: ' + format % args)
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        return request, ('', 0)
+
+
+class Metrics():
+    """Serves runtime metrics of the sensor reader, MQTT outbox, scheduler and process.
+
+    Attributes:
+        config (DotMap): `metrics` section of config.yaml. Metrics are disabled without one.
+        reader (SensorReader): Reader whose sensors are reported.
+        iteration (Histogram): Duration of scheduler iterations running at least one job. Threaded runtime only.
+        lag (Histogram): Seconds jobs started after their deadline.
+    """
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+    # seconds, a scheduler iteration only hands reads to the pool
+    LOOP_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+    config = None
+    enabled = False
+    reader = None
+    iteration = None
+    lag = None
+    server = None
+    started = time.time()
+
+    @classmethod
+    def setup(cls, config, reader, scheduler=None):
+        """Instrument `reader`, the outbox and `scheduler` and start serving. Call before sensors are added."""
+        cls.config = config
+        if not config:
+            return
+        cls.enabled = True
+        cls.reader = reader
+        reader.histograms = True
+        mqtt.outbox.histogram = Histogram()
+        cls.lag = Histogram(Metrics.LOOP_BUCKETS)
+        reader.lag_histogram = cls.lag
+        if scheduler is not None:
+            cls.iteration = Histogram(Metrics.LOOP_BUCKETS)
+            scheduler.iteration_histogram = cls.iteration
+            scheduler.lag_histogram = cls.lag
+        cls.server = cls.serve(config)
+
+    @classmethod
+    def serve(cls, config):
+        path = config.get('socket')
+        if path:
+            if os.path.exists(path):
+                # left behind by a previous run
+                os.unlink(path)
+            server = UnixHTTPServer(path, MetricsHandler)
+            logging.info('Serving metrics on unix socket {}.'.format(path))
+        else:
+            host = config.get('host', '127.0.0.1')
+            port = config.get('port', 9108)
+            server = ThreadingHTTPServer((host, port), MetricsHandler)
+            server.daemon_threads = True
+            logging.info('Serving metrics on http://{}:{}/metrics.'.format(host, port))
+        threading.Thread(target=server.serve_forever, name='rpi2mqtt-metrics', daemon=True).start()
+        return server
+
+    @classmethod
+    def close(cls):
+        if cls.server is not None:
+            cls.server.shutdown()
+            cls.server.server_close()
+            if cls.config.get('socket'):
+                os.unlink(cls.config.get('socket'))
+            cls.server = None
+
+    @classmethod
+    def families(cls):
+        families = []
+        if cls.reader is not None:
+            families.extend(cls.sensor_families(cls.reader))
+        if mqtt.outbox is not None:
+            families.extend(cls.publish_families())
+        families.extend(cls.loop_families())
+        families.extend(cls.process_families())
+        return families
+
+    @staticmethod
+    def sensor_families(reader):
+        latency = Family('rpi2mqtt_sensor_read_seconds', 'histogram', 'Sensor read latency.')
+        failures = Family('rpi2mqtt_sensor_read_failures_total', 'counter', 'Sensor reads raising an error.')
+        timeouts = Family('rpi2mqtt_sensor_read_timeouts_total', 'counter', 'Sensor reads missing their deadline.')
+        stale = Family('rpi2mqtt_sensor_stale', 'gauge', '1 while the sensor is marked offline.')
+        for name, stats in list(reader.stats.items()):
+            labels = {'sensor': name}
+            if stats.histogram is not None:
+                latency.add_histogram(stats.histogram, labels)
+            failures.add(stats.failures, labels)
+            timeouts.add(stats.timeouts, labels)
+            stale.add(name in reader.stale, labels)
+        return [latency, failures, timeouts, stale]
+
+    @staticmethod
+    def publish_families():
+        stats = mqtt.stats()
+        latency = Family('rpi2mqtt_publish_latency_seconds', 'histogram',
+                         'Seconds from queueing a message to handing it to the MQTT client.')
+        if mqtt.outbox.histogram is not None:
+            latency.add_histogram(mqtt.outbox.histogram)
+        depth = Family('rpi2mqtt_outbox_depth', 'gauge', 'Messages queued for the broker.')
+        depth.add(stats['depth'] - stats['priority_depth'], {'lane': 'telemetry'})
+        depth.add(stats['priority_depth'], {'lane': 'priority'})
+        messages = Family('rpi2mqtt_outbox_messages_total', 'counter', 'Messages leaving the outbox by outcome.')
+        for outcome in ('sent', 'retried', 'conflated', 'dropped', 'failed'):
+            messages.add(stats[outcome], {'outcome': outcome})
+        connected = Family('rpi2mqtt_mqtt_connected', 'gauge', '1 while connected to the broker.')
+        connected.add(mqtt.connected)
+        subscriptions = Family('rpi2mqtt_mqtt_subscriptions', 'gauge', 'Subscribed command topics.')
+        topics = list((mqtt.subscribed_topics or {}).values())
+        subscriptions.add(sum(1 for s in topics if s.acked), {'state': 'acked'})
+        subscriptions.add(sum(1 for s in topics if not s.acked), {'state': 'pending'})
+        return [latency, depth, messages, connected, subscriptions]
+
+    @classmethod
+    def loop_families(cls):
+        families = []
+        if cls.iteration is not None:
+            iteration = Family('rpi2mqtt_loop_iteration_seconds', 'histogram',
+                               'Duration of scheduler iterations running at least one job.')
+            iteration.add_histogram(cls.iteration)
+            families.append(iteration)
+        if cls.lag is not None:
+            lag = Family('rpi2mqtt_loop_lag_seconds', 'histogram', 'Seconds jobs started after their deadline.')
+            lag.add_histogram(cls.lag)
+            families.append(lag)
+        if cls.reader is not None:
+            last_lag = Family('rpi2mqtt_job_lag_seconds', 'gauge', 'Lag of the last run of a job.')
+            for name, job in list(cls.reader.jobs.items()):
+                last_lag.add(job.last_lag, {'job': name})
+            families.append(last_lag)
+        return families
+
+    @classmethod
+    def process_families(cls):
+        rss, cpu = process_stats()
+        memory = Family('process_resident_memory_bytes', 'gauge', 'Resident memory size in bytes.')
+        memory.add(rss)
+        cpu_seconds = Family('process_cpu_seconds_total', 'counter', 'User and system CPU time in seconds.')
+        cpu_seconds.add(cpu)
+        start = Family('process_start_time_seconds', 'gauge', 'Start time of the process since the epoch.')
+        start.add(cls.started)
+        threads = Family('rpi2mqtt_threads', 'gauge', 'Running threads.')
+        threads.add(threading.active_count())
+        return [memory, cpu_seconds, start, threads]
+
+    @classmethod
+    def render(cls):
+        lines = []
+        for family in cls.families():
+            lines.extend(family.lines)
+        return '\n'.join(lines) + '\n'
@@ -1,11 +1,14 @@
-import paho.mqtt.publish as _mqtt
 # import paho.mqtt.subscribe as mqtt_sub
-from paho.mqtt.client import Client
+from paho.mqtt.client import Client, MQTT_ERR_SUCCESS, error_string, connack_string
 from rpi2mqtt.config import Config
+from rpi2mqtt.outbox import Outbox, RetryPolicy
+from rpi2mqtt.profiling import span
 # import traceback
 import logging
 # import sys
-import pendulum
+import socket
+import threading
+import time
 
 
 # logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
@@ -15,47 +18,109 @@ def on_message(mqttc, obj, msg):
     logging.info("Recieved: " + msg.topic + " " + str(msg.qos) + " " + str(msg.payload))
 
 
-def on_subscribe(mqttc, obj, mid, granted_qos):
-    logging.info("Subscribed to " + str(mid) + " " + str(granted_qos))
+class MQTTPublishException(Exception):
+    pass
 
 
 class Subscription():
     def __init__(self, topic, callback):
         self.topic = topic
         self.callback = callback
-        self.last_ping = pendulum.now()
+        # set once the broker acknowledged the subscription
+        self.acked = False
+        self.mid = None
 
 
 class MQTT():
     
     client = None
     subscribed_topics = None
+    pending_subscriptions = None
+    subscription_lock = threading.Lock()
     config = None
+    connected = False
+    qos = 0
+    subscribe_qos = 1
+    outbox = None
+    retry_policy = None
+    publisher = None
+    loop_helper = None
+    # device availability, 'offline' through the last will once the connection drops without a clean disconnect
+    status_topic = None
+    # called without arguments after every successful (re)connect
+    connect_listeners = []
 
     @classmethod
-    def publish(cls, topic, payload, cnt=1):
+    def publish(cls, topic, payload, priority=False):
+        """Queue a retained message for the publisher thread. Returns immediately.
+
+        Args:
+            topic (str): Topic to publish to.
+            payload (str): Message payload.
+            priority (bool): Send ahead of queued telemetry. Messages to subscribed command topics always are.
+        """
+        logging.info("Queueing message to topic {}: | message: {}".format(topic, payload))
+        cls.outbox.put(topic, payload, priority or topic in cls.subscribed_topics)
+
+    @classmethod
+    def stats(cls):
+        """Outbound queue depth, drops and send latency."""
+        return cls.outbox.stats()
+
+    @classmethod
+    def _send(cls, message):
+        message.attempts += 1
+        logging.debug("Publishing to topic {}: | attempt: {} | message: {}".format(message.topic, message.attempts, message.payload))
+        info = cls.client.publish(message.topic, message.payload, qos=cls.qos, retain=True)
+        if info.rc != MQTT_ERR_SUCCESS:
+            raise MQTTPublishException(error_string(info.rc))
+
+    @classmethod
+    def deliver(cls, message):
+        """Send a message taken off the outbox. Returns seconds to back off before sending again if it failed."""
         try:
-            logging.info("Pushlishing to topic {}: | attempt: {} | message: {}".format(topic, cnt, payload))
-            if cnt <= cls.config.mqtt.retries:
-                if payload == 'pong':
-                    cls.subscribed_topics[topic].last_ping = pendulum.now()
-
-                _mqtt.single(topic, payload, 
-                            hostname=cls.config.mqtt.host, 
-                            port=cls.config.mqtt.port,
-                            auth={'username': cls.config.mqtt.username, 'password': cls.config.mqtt.password},
-                            tls={'ca_certs': cls.config.mqtt.ca_cert},
-                            retain=True)
+            with span('publish', message.topic):
+                cls._send(message)
+            cls.outbox.sent_ok(message)
         except Exception as e:
-            logging.exception("Error publishing message.", e)
-            cnt += 1
-            cls.publish(topic, payload, cnt)
+            if cls.retry_policy.should_retry(message):
+                delay = cls.retry_policy.delay(message)
+                logging.warning("Error publishing to {} ({}). Retrying in {}s.".format(message.topic, e, delay))
+                cls.outbox.requeue(message)
+                return delay
+            else:
+                logging.error("Giving up publishing to {} after {} attempts.".format(message.topic, message.attempts))
+                cls.outbox.give_up(message)
 
     @classmethod
-    def setup(cls):
-        cls.client = Client()
-        cls.subscribed_topics = {}
+    def _publisher(cls):
+        """Drain the outbox over the persistent connection, backing off between failed attempts."""
+        while True:
+            delay = cls.deliver(cls.outbox.get())
+            if delay:
+                time.sleep(delay)
+
+    @classmethod
+    def setup(cls, loop=None):
+        """Connect to the broker.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): Run the client's network I/O on this loop instead of paho's thread. The
+                caller is responsible for draining the outbox, see `rpi2mqtt.aio`.
+        """
         cls.config = Config.get_instance()
+        # a clean session, a persistent one would have the broker queue commands during an outage and run them late.
+        # on_connect restores the subscriptions instead.
+        cls.client = Client(client_id=cls.config.mqtt.get('client_id', 'rpi2mqtt-{}'.format(socket.gethostname())),
+                            clean_session=True)
+        cls.subscribed_topics = {}
+        cls.pending_subscriptions = {}
+        cls.qos = cls.config.mqtt.get('qos', 0)
+        cls.subscribe_qos = cls.config.mqtt.get('subscribe_qos', 1)
+        cls.outbox = Outbox(cls.config.mqtt.get('queue_size', 1000))
+        cls.retry_policy = RetryPolicy(cls.config.mqtt.get('retries', 3),
+                                       cls.config.mqtt.get('retry_backoff', 0.5),
+                                       cls.config.mqtt.get('retry_backoff_max', 30))
         cls.client.tls_set(ca_certs=cls.config.mqtt.ca_cert) #, certfile=None, keyfile=None, cert_reqs=cert_required, tls_version=tlsVersion)
 
         # if args.insecure:
@@ -64,47 +129,117 @@ class MQTT():
         if cls.config.mqtt.username or cls.config.mqtt.password:
             cls.client.username_pw_set(cls.config.mqtt.username, cls.config.mqtt.password)
 
+        # paho's network thread reconnects on its own once the first connect succeeds.
+        cls.client.reconnect_delay_set(min_delay=1, max_delay=cls.config.mqtt.get('reconnect_max_delay', 120))
+        cls.status_topic = cls.config.mqtt.get('status_topic', 'rpi2mqtt/{}/status'.format(socket.gethostname()))
+        # must be set before connecting, the broker publishes it if we vanish e.g. on a crash or power loss
+        cls.client.will_set(cls.status_topic, 'offline', qos=1, retain=True)
+        cls.client.on_connect = cls.on_connect
+        cls.client.on_disconnect = cls.on_disconnect
+        cls.client.on_subscribe = cls.on_subscribe
+        cls.client.on_message = on_message
+
+        if loop:
+            from rpi2mqtt.aio import AsyncioHelper
+            cls.loop_helper = AsyncioHelper(loop, cls.client)
+
         logging.info("Connecting to " + cls.config.mqtt.host + " port:" + str(cls.config.mqtt.port))
-        cls.client.connect(cls.config.mqtt.host, cls.config.mqtt.port, 60)
+        cls.client.connect(cls.config.mqtt.host, cls.config.mqtt.port, cls.config.mqtt.get('keepalive', 60))
         logging.info("Successfully connected to {} port:{}".format(cls.config.mqtt.host, str(cls.config.mqtt.port)))
 
+        if loop:
+            return
+
         cls.client.loop_start()
 
-        cls.client.on_subscribe = on_subscribe
-        cls.client.on_message = on_message
+        cls.publisher = threading.Thread(target=cls._publisher, name='rpi2mqtt-publisher', daemon=True)
+        cls.publisher.start()
+
+    @classmethod
+    def on_connect(cls, client, userdata, flags, rc):
+        if rc == 0:
+            cls.connected = True
+            session_present = bool(flags.get('session present'))
+            logging.info("Connected to MQTT broker {} (session present: {})".format(cls.config.mqtt.host, session_present))
+            # replaces the retained last will
+            client.publish(cls.status_topic, 'online', qos=1, retain=True)
+            cls.resubscribe(session_present)
+            for listener in cls.connect_listeners:
+                listener()
+        else:
+            logging.error("MQTT broker refused connection: {}".format(connack_string(rc)))
 
+    @classmethod
+    def on_disconnect(cls, client, userdata, rc):
+        cls.connected = False
+        if rc != 0:
+            logging.warning("Lost connection to MQTT broker ({}). Reconnecting...".format(error_string(rc)))
 
 
     @classmethod
     def subscribe(cls, topic, callback):
         logging.info("Subscribing to topic %s", topic)
-        res = cls.client.subscribe(topic)
-        logging.info('Subscription result = {}'.format(res))
-        cls.client.message_callback_add(topic, callback)
-        cls.subscribed_topics[topic] = Subscription(topic, callback)
+        if cls.loop_helper is not None:
+            # the asyncio loop reads the socket, commands must not block it
+            cls.client.message_callback_add(topic, cls.loop_helper.dispatch(callback))
+        else:
+            cls.client.message_callback_add(topic, callback)
+        subscription = Subscription(topic, callback)
+        # resubscribe iterates the subscriptions on paho's network thread
+        with cls.subscription_lock:
+            cls.subscribed_topics[topic] = subscription
+        return cls._subscribe(subscription)
+
+    @classmethod
+    def _subscribe(cls, subscription):
+        # held until the mid is stored so the SUBACK can't be handled first
+        with cls.subscription_lock:
+            subscription.acked = False
+            res = cls.client.subscribe(subscription.topic, cls.subscribe_qos)
+            logging.info('Subscription result = {}'.format(res))
+            rc, mid = res
+            if rc == MQTT_ERR_SUCCESS:
+                subscription.mid = mid
+                cls.pending_subscriptions[mid] = subscription
         return res
 
     @classmethod
-    def ping_subscriptions(cls):
-        for topic, sub in cls.subscribed_topics.items():
-            logging.debug("Checing subcription status on topic {}".format(topic))
-            response = MQTT.publish(topic, "ping")
-            last_seen = pendulum.now() - cls.subscribed_topics[topic].last_ping
-            if last_seen and last_seen.seconds > cls.config.polling_interval * 2:
-                logging.warn("Not subscribed to topic {}. Resubscribing...".format(topic))
-                MQTT.subscribe(topic, sub.callback)
+    def resubscribe(cls, session_present=False):
+        """Restore subscriptions after (re)connecting. With a persisted session only unacknowledged ones are sent."""
+        with cls.subscription_lock:
+            subscriptions = list(cls.subscribed_topics.values())
+        for subscription in subscriptions:
+            if not session_present or not subscription.acked:
+                logging.info("Resubscribing to topic {}".format(subscription.topic))
+                cls._subscribe(subscription)
+
+    @classmethod
+    def on_subscribe(cls, client, userdata, mid, granted_qos):
+        with cls.subscription_lock:
+            subscription = cls.pending_subscriptions.pop(mid, None)
+        if subscription is None:
+            return
+        if 0x80 in granted_qos:
+            logging.error("Broker rejected subscription to topic {}.".format(subscription.topic))
+        else:
+            subscription.acked = True
+            logging.info("Subscribed to topic {} with qos {}".format(subscription.topic, granted_qos))
 
     @staticmethod
-    def pongable(func):
-        # def decorator_wrapper(func):
+    def command(func):
+        """Decorator for command topic callbacks.
+
+        Ignores empty messages and the retained 'ping'/'pong' probes left behind by older versions, which are cleared
+        from the broker.
+        """
         def wrapper(self, client, userdata, message):
-            logging.debug('Received message {} on topic {}'.format(message.payload.decode(), message.topic))
             payload = message.payload.decode()
-            if payload == 'ping':
-                MQTT.publish(message.topic, "pong") 
+            logging.debug('Received message {} on topic {}'.format(payload, message.topic))
+            if payload in ('ping', 'pong'):
+                if message.retain:
+                    MQTT.publish(message.topic, '')
                 return
-            elif payload == 'pong':
+            elif payload == '':
                 return
             return func(self, client, userdata, message)
         return wrapper
-        # return decorator_wrapper
\ No newline at end of file
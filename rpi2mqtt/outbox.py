@@ -0,0 +1,183 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class Message(object):
+    __slots__ = ('topic', 'payload', 'priority', 'enqueued', 'timestamp', 'attempts')
+
+    def __init__(self, topic, payload, priority=False):
+        self.topic = topic
+        self.payload = payload
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        # wall clock time of the payload, updated when a newer payload replaces it
+        self.timestamp = time.time()
+        self.attempts = 0
+
+
+class RetryPolicy(object):
+    """Exponential backoff between publish attempts.
+
+    Attributes:
+        retries (int): Attempts before a message is dropped.
+        backoff (float): Seconds to wait after the first failed attempt. Doubles every attempt.
+        max_backoff (float): Upper bound of the wait in seconds.
+    """
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def should_retry(self, message):
+        return message.attempts < self.retries
+
+    def delay(self, message):
+        return min(self.max_backoff, self.backoff * 2 ** max(message.attempts - 1, 0))
+
+
+class Outbox(object):
+    """Bounded queue of outbound MQTT messages.
+
+    Messages are conflated per topic, i.e. publishing to a topic that is still queued replaces the queued payload so
+    only the latest state is sent. A topic is queued at most once across both lanes, a priority message replacing
+    queued telemetry moves it to the priority lane. Priority messages (command acks) are always sent before
+    telemetry. When the queue is full the oldest telemetry message is dropped.
+
+    Attributes:
+        maxsize (int): Maximum number of queued topics.
+        dropped (int): Messages dropped because the queue was full.
+        conflated (int): Messages replaced by a newer payload for the same topic.
+        sent (int): Messages handed to the MQTT client.
+        failed (int): Messages dropped after exhausting retries.
+        retried (int): Failed attempts put back for another try.
+        histogram (Histogram): Send latency histogram, only kept while metrics are enabled.
+        on_lost (callable): Called with (topic, payload, timestamp) of every payload that was conflated, dropped or
+            given up, i.e. never reached the broker.
+    """
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._priority = OrderedDict()
+        self._telemetry = OrderedDict()
+        self._lock = threading.Condition()
+        self._inflight = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.histogram = None
+        self.last_latency = None
+        self.max_latency = 0.0
+        self._total_latency = 0.0
+        # called after every put, e.g. to wake up an asyncio consumer
+        self.listener = None
+        self.on_lost = None
+
+    def __len__(self):
+        return len(self._priority) + len(self._telemetry)
+
+    def _lane(self, priority):
+        return self._priority if priority else self._telemetry
+
+    def put(self, topic, payload, priority=False):
+        lost = None
+        with self._lock:
+            queued = self._queued(topic)
+            if queued:
+                lost = (queued.topic, queued.payload, queued.timestamp)
+                queued.payload = payload
+                queued.timestamp = time.time()
+                self.conflated += 1
+                if priority and not queued.priority:
+                    # the newer payload goes out ahead of telemetry now
+                    del self._telemetry[topic]
+                    queued.priority = True
+                    self._priority[topic] = queued
+            else:
+                if len(self) >= self.maxsize:
+                    # telemetry is dropped first, commands only if nothing else is queued
+                    lost = self._drop_oldest()
+                self._lane(priority)[topic] = Message(topic, payload, priority)
+            self._lock.notify_all()
+        if lost:
+            self._lost(*lost)
+        if self.listener:
+            self.listener()
+
+    def _queued(self, topic):
+        return self._priority.get(topic) or self._telemetry.get(topic)
+
+    def _drop_oldest(self):
+        lane = self._telemetry or self._priority
+        _, message = lane.popitem(last=False)
+        self.dropped += 1
+        return message.topic, message.payload, message.timestamp
+
+    def _lost(self, topic, payload, timestamp):
+        if self.on_lost:
+            self.on_lost(topic, payload, timestamp)
+
+    def get(self, timeout=None):
+        """Take the next message off the queue. Returns None if nothing was queued before `timeout`."""
+        with self._lock:
+            if not self._lock.wait_for(lambda: len(self) > 0, timeout):
+                return None
+            lane = self._priority or self._telemetry
+            _, message = lane.popitem(last=False)
+            self._inflight += 1
+            return message
+
+    def requeue(self, message):
+        """Put a failed message back at the head of its lane unless a newer payload was queued meanwhile."""
+        with self._lock:
+            self.retried += 1
+            superseded = self._queued(message.topic) is not None
+            if superseded:
+                self.conflated += 1
+            else:
+                lane = self._lane(message.priority)
+                lane[message.topic] = message
+                lane.move_to_end(message.topic, last=False)
+            self._done()
+        if superseded:
+            self._lost(message.topic, message.payload, message.timestamp)
+
+    def sent_ok(self, message):
+        with self._lock:
+            latency = time.monotonic() - message.enqueued
+            self.sent += 1
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self._total_latency += latency
+            if self.histogram is not None:
+                self.histogram.observe(latency)
+            self._done()
+
+    def give_up(self, message):
+        with self._lock:
+            self.failed += 1
+            self._done()
+        self._lost(message.topic, message.payload, message.timestamp)
+
+    def _done(self):
+        self._inflight -= 1
+        self._lock.notify_all()
+
+    def join(self, timeout=None):
+        """Block until every queued message was sent or dropped."""
+        with self._lock:
+            return self._lock.wait_for(lambda: len(self) == 0 and self._inflight == 0, timeout)
+
+    def stats(self):
+        with self._lock:
+            return {'depth': len(self),
+                    'priority_depth': len(self._priority),
+                    'dropped': self.dropped,
+                    'conflated': self.conflated,
+                    'sent': self.sent,
+                    'failed': self.failed,
+                    'retried': self.retried,
+                    'last_latency': self.last_latency,
+                    'avg_latency': self._total_latency / self.sent if self.sent else None,
+                    'max_latency': self.max_latency}
@@ -0,0 +1,325 @@
+"""On-demand profiling of the running process.
+
+Send SIGUSR2 (`systemctl kill -s USR2 rpi2mqtt`) or publish to the `profiling.topic` command topic to profile for
+`duration` seconds. A second SIGUSR2 stops early. Profiles are written to `path`:
+
+* `sample` (default): samples the stacks of every thread every `interval` seconds and writes them as collapsed stacks
+  (`<name>.collapsed`), the input of flamegraph.pl and speedscope. Stacks are prefixed with the thread name and the
+  spans they ran in, e.g. `rpi2mqtt-reader_0;read:hestia;hestiapi.callback:hestia;...`.
+* `cprofile`: deterministic profile written as pstats (`<name>.pstats`, view with `python -m pstats` or snakeviz).
+  Python >= 3.12 profiles every thread, older versions only profile code running inside spans.
+
+Hot paths are wrapped in `span`s, which only check whether a profile is running while none is. rpi2mqtt.mqtt uses
+spans, so MQTT is imported where it's needed, and so are cProfile and pstats to keep importing spans cheap.
+"""
+from datetime import datetime
+import functools
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+
+class Session(object):
+    """A single bounded profile. Subclasses implement `run` and `write`."""
+    EXTENSION = None
+
+    def __init__(self, duration, filename):
+        self.duration = duration
+        self.filename = filename
+        self.spans = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def enter(self, tag):
+        self.spans.setdefault(threading.get_ident(), []).append(tag)
+
+    def exit(self):
+        stack = self.spans.get(threading.get_ident())
+        if stack:
+            stack.pop()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='rpi2mqtt-profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        try:
+            self.run()
+            self.write()
+        except Exception:
+            logging.exception('Profiling failed.')
+        finally:
+            Profiler.finished(self)
+
+
+class SamplingSession(Session):
+    """Counts the collapsed stacks of all threads every `interval` seconds.
+
+    Attributes:
+        stacks (dict): Collapsed stack to number of samples.
+        samples (int): Sampling rounds taken.
+    """
+    EXTENSION = 'collapsed'
+
+    def __init__(self, duration, filename, interval=0.005):
+        super(SamplingSession, self).__init__(duration, filename)
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+
+    @staticmethod
+    def frame_name(frame):
+        code = frame.f_code
+        return '{}:{}'.format(os.path.basename(code.co_filename), code.co_name)
+
+    def sample(self, own_ident):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(SamplingSession.frame_name(frame))
+                frame = frame.f_back
+            frames.reverse()
+            # separators must not appear inside a frame
+            stack = [names.get(ident, str(ident))] + list(self.spans.get(ident, ())) + frames
+            key = ';'.join(part.replace(';', ':').replace(' ', '_') for part in stack)
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def run(self):
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + self.duration
+        while not self.stopped.wait(self.interval) and time.monotonic() < deadline:
+            self.sample(own_ident)
+
+    def write(self):
+        with open(self.filename, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('{} {}\n'.format(stack, count))
+
+
+class CProfileSession(Session):
+    """cProfile of every thread on Python >= 3.12, of the code inside spans on older versions.
+
+    Before 3.12 cProfile only sees the thread enabling it, so every thread gets its own profiler, enabled for its
+    outermost span and merged when the session ends.
+    """
+    EXTENSION = 'pstats'
+    ALL_THREADS = sys.version_info >= (3, 12)
+
+    def __init__(self, duration, filename):
+        import cProfile
+        super(CProfileSession, self).__init__(duration, filename)
+        self.cProfile = cProfile
+        self.profile = cProfile.Profile() if CProfileSession.ALL_THREADS else None
+        self.profiles = {}
+        self.enabled = set()
+        self._lock = threading.Lock()
+
+    def enter(self, tag):
+        super(CProfileSession, self).enter(tag)
+        ident = threading.get_ident()
+        if self.profile is not None or len(self.spans[ident]) > 1 or self.stopped.is_set():
+            return
+        with self._lock:
+            profile = self.profiles.setdefault(ident, self.cProfile.Profile())
+            self.enabled.add(ident)
+        profile.enable()
+
+    def exit(self):
+        super(CProfileSession, self).exit()
+        ident = threading.get_ident()
+        if ident in self.enabled and not self.spans.get(ident):
+            self.profiles[ident].disable()
+            with self._lock:
+                self.enabled.discard(ident)
+
+    def run(self):
+        if self.profile is not None:
+            self.profile.enable()
+        try:
+            self.stopped.wait(self.duration)
+        finally:
+            if self.profile is not None:
+                self.profile.disable()
+        self.stopped.set()
+
+    def write(self):
+        if self.profile is not None:
+            self.profile.dump_stats(self.filename)
+            return
+        with self._lock:
+            # spans still running are left out
+            profiles = [p for ident, p in self.profiles.items() if ident not in self.enabled]
+        if not profiles:
+            logging.warning('No spans ran while profiling, nothing to write.')
+            return
+        import pstats
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(self.filename)
+
+
+class span(object):
+    """Tags code in profiles, e.g. `with span('read', name):`. Only checks for a running profile while none is."""
+    __slots__ = ('kind', 'name', 'session')
+
+    def __init__(self, kind, name=None):
+        self.kind = kind
+        self.name = name
+        self.session = None
+
+    def __enter__(self):
+        session = Profiler.session
+        if session is not None:
+            session.enter(self.kind if self.name is None else '{}:{}'.format(self.kind, self.name))
+            self.session = session
+        return self
+
+    def __exit__(self, *exc):
+        if self.session is not None:
+            self.session.exit()
+            self.session = None
+
+
+def traced(kind):
+    """Decorator running a sensor method in a `span(kind, self.name)`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with span(kind, getattr(self, 'name', None)):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Profiler():
+    """Starts bounded profiling sessions on SIGUSR2 or MQTT commands.
+
+    The command topic takes `sample`, `cprofile`, `stop` or JSON like `{"mode": "cprofile", "duration": 60}`. The
+    file written is reported on `<topic>/state`.
+
+    Attributes:
+        config (DotMap): `profiling` section of config.yaml. `profiling: false` disables the signal handler.
+        session (Session): Running profile or None.
+    """
+    DEFAULT_PATH = '~/.rpi2mqtt/profiles'
+    SESSIONS = {'sample': SamplingSession,
+                'cprofile': CProfileSession}
+
+    config = None
+    session = None
+    topic = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def setup(cls, config=None):
+        if config is False:
+            return
+        cls.config = config or {}
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR2, cls.on_signal)
+        cls.topic = cls.config.get('topic')
+        if cls.topic:
+            from rpi2mqtt.mqtt import MQTT as mqtt
+            mqtt.subscribe(cls.topic, functools.partial(mqtt.command(Profiler.command), cls))
+
+    @classmethod
+    def start(cls, mode=None, duration=None):
+        """Start profiling unless a profile is already running. Returns the session or None."""
+        config = cls.config or {}
+        mode = mode or config.get('mode', 'sample')
+        if mode not in Profiler.SESSIONS:
+            logging.error('Unknown profiling mode {}. Use one of {}.'.format(mode, sorted(Profiler.SESSIONS)))
+            return None
+        try:
+            duration = float(duration or config.get('duration', 30))
+        except (TypeError, ValueError):
+            duration = None
+        if duration is None or not duration > 0:
+            logging.error('Invalid profiling duration. Use a positive number of seconds.')
+            return None
+        duration = min(duration, config.get('max_duration', 300))
+        path = os.path.expanduser(config.get('path', Profiler.DEFAULT_PATH))
+
+        with cls._lock:
+            if cls.session is not None:
+                logging.warning('Profiling is already running.')
+                return None
+            try:
+                os.makedirs(path, exist_ok=True)
+            except OSError as e:
+                logging.error('Unable to create profile directory {}: {}'.format(path, e))
+                return None
+            session_class = Profiler.SESSIONS[mode]
+            filename = os.path.join(path, 'profile-{}.{}'.format(datetime.now().strftime('%Y%m%d-%H%M%S'),
+                                                                 session_class.EXTENSION))
+            if mode == 'sample':
+                session = session_class(duration, filename, config.get('interval', 0.005))
+            else:
+                session = session_class(duration, filename)
+            cls.session = session
+        logging.warning('Profiling ({}) for {}s.'.format(mode, duration))
+        session.start()
+        return session
+
+    @classmethod
+    def stop(cls):
+        session = cls.session
+        if session is not None:
+            session.stop()
+
+    @classmethod
+    def finished(cls, session):
+        with cls._lock:
+            if cls.session is session:
+                cls.session = None
+        exists = os.path.exists(session.filename)
+        if exists:
+            logging.warning('Profile written to {}.'.format(session.filename))
+        if cls.topic:
+            from rpi2mqtt.mqtt import MQTT as mqtt
+            mqtt.publish('{}/state'.format(cls.topic), json.dumps({'file': session.filename if exists else None,
+                                                                   'duration': session.duration}))
+
+    @classmethod
+    def on_signal(cls, signum, frame):
+        # the handler interrupts the main thread, which may hold _lock or a logging lock, so start() and stop() run
+        # on their own thread
+        threading.Thread(target=cls.toggle, name='rpi2mqtt-profiler-signal', daemon=True).start()
+
+    @classmethod
+    def toggle(cls):
+        """Stop the running profile or start one with the configured mode and duration."""
+        if cls.session is not None:
+            cls.stop()
+        else:
+            cls.start()
+
+    @staticmethod
+    def command(cls, client, userdata, message):
+        # runs on the MQTT network thread, an exception would end it
+        try:
+            payload = message.payload.decode()
+            if payload == 'stop':
+                cls.stop()
+                return
+            try:
+                options = json.loads(payload)
+            except ValueError:
+                options = {'mode': payload}
+            if not isinstance(options, dict):
+                options = {'mode': str(options)}
+            cls.start(options.get('mode'), options.get('duration'))
+        except Exception:
+            logging.exception('Unable to process profiling command {}.'.format(message.payload))
@@ -0,0 +1,169 @@
+from concurrent.futures import ThreadPoolExecutor
+from rpi2mqtt.mqtt import MQTT as mqtt
+from rpi2mqtt.profiling import span
+import logging
+import threading
+import time
+
+
+class ReadStats(object):
+    """Read latency statistics of a single sensor. Latencies are in seconds."""
+
+    def __init__(self, histogram=None):
+        self.histogram = histogram
+        self.count = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.last = None
+        self.max = 0.0
+        self.total = 0.0
+
+    @property
+    def mean(self):
+        if self.count:
+            return self.total / self.count
+
+    def record(self, latency):
+        self.count += 1
+        self.last = latency
+        self.max = max(self.max, latency)
+        self.total += latency
+        if self.histogram is not None:
+            self.histogram.observe(latency)
+
+    def as_dict(self):
+        return {'count': self.count,
+                'failures': self.failures,
+                'timeouts': self.timeouts,
+                'last': self.last,
+                'mean': self.mean,
+                'max': self.max}
+
+
+class SensorReader(object):
+    """Run sensor callbacks on a worker pool so a slow or hung sensor doesn't delay the others.
+
+    A read that misses its deadline marks the sensor stale by publishing 'offline' to its availability topic. The
+    deadline counts from when the read started running, a read queued behind hung reads of other sensors isn't marked
+    stale for waiting. The sensor is not polled again until the hung read returns, at which point it's marked 'online'
+    again.
+
+    Attributes:
+        scheduler (Scheduler): Scheduler used to check read deadlines.
+        timeouts (dict): Read deadline in seconds per sensor type.
+        stats (dict): ReadStats per sensor name.
+        jobs (dict): Periodic read Job per sensor name.
+        histograms (bool): Keep a latency histogram per sensor. Set by Metrics.setup.
+        lag_histogram (Histogram): Lag of the asyncio runtime's reads. Set by Metrics.setup.
+        stale (set): Names of sensors whose last read missed its deadline.
+    """
+    DEFAULT_TIMEOUT = 10
+    DEFAULT_TIMEOUTS = {
+        'dht22': 30,
+        'onewire': 15,
+        'hestiapi': 15,
+    }
+
+    def __init__(self, scheduler, workers=4, timeouts=None):
+        self.scheduler = scheduler
+        self.timeouts = dict(SensorReader.DEFAULT_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rpi2mqtt-reader')
+        self.stats = {}
+        self.jobs = {}
+        self.histograms = False
+        self.lag_histogram = None
+        self.stale = set()
+        self._pending = {}
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def timeout(self, sensor_type, timeout=None):
+        return timeout or self.timeouts.get(sensor_type, SensorReader.DEFAULT_TIMEOUT)
+
+    def remaining(self, name, timeout):
+        """Seconds until the running read of `name` misses its deadline, 0 once it did. A read still waiting for a
+        worker gets the full `timeout`."""
+        started = self._started.get(name)
+        if started is None:
+            return timeout
+        return max(0.0, started + timeout - time.monotonic())
+
+    def register(self, name):
+        histogram = None
+        if self.histograms:
+            # metrics are optional, don't load http.server without them
+            from rpi2mqtt.metrics import Histogram
+            histogram = Histogram()
+        self.stats[name] = ReadStats(histogram)
+        # sensors are announced 'online' after their first successful read
+        self.stale.add(name)
+
+    def add(self, name, sensor, sensor_type, interval, offset=0, jitter=0, timeout=None, sample_interval=None):
+        """Schedule periodic reads of `sensor` through the worker pool.
+
+        With a `sample_interval` the sensor is also sampled at that rate and publishes the aggregate of its samples
+        every `interval` seconds. Samples are tracked as sensor '<name>_sample'.
+        """
+        self.register(name)
+        timeout = self.timeout(sensor_type, timeout)
+        if sample_interval:
+            sample_name = '{}_sample'.format(name)
+            self.register(sample_name)
+            self.jobs[sample_name] = self.scheduler.add(
+                sample_name, lambda: self.submit(sample_name, sensor, timeout, sensor.sample), sample_interval, offset,
+                jitter)
+        self.jobs[name] = self.scheduler.add(name, lambda: self.submit(name, sensor, timeout), interval, offset, jitter)
+        return self.jobs[name]
+
+    def submit(self, name, sensor, timeout, call=None):
+        with self._lock:
+            future = self._pending.get(name)
+            if future and not future.done():
+                logging.warning('Skipping read of {}. Previous read is still running.'.format(name))
+                return
+            future = self.pool.submit(self.read, name, sensor, call)
+            self._pending[name] = future
+        self.scheduler.call_later(timeout, '{}_deadline'.format(name), lambda: self._check_deadline(name, sensor, future, timeout))
+        return future
+
+    def read(self, name, sensor, call=None):
+        """Run the sensor's callback (or `call`) and record its latency. Marks stale sensors online again."""
+        start = self._started[name] = time.monotonic()
+        try:
+            with span('read', name):
+                (call or sensor.callback)()
+        except Exception:
+            self.stats[name].failures += 1
+            logging.exception('Error reading sensor {}.'.format(name))
+            return
+        finally:
+            self._started.pop(name, None)
+            self.stats[name].record(time.monotonic() - start)
+
+        with self._lock:
+            recovered = name in self.stale
+            self.stale.discard(name)
+        if recovered:
+            logging.info('Sensor {} is online.'.format(name))
+            mqtt.publish(sensor.availability_topic, 'online')
+
+    def _check_deadline(self, name, sensor, future, timeout):
+        if future.done():
+            return
+        remaining = self.remaining(name, timeout)
+        if remaining:
+            self.scheduler.call_later(remaining, '{}_deadline'.format(name),
+                                      lambda: self._check_deadline(name, sensor, future, timeout))
+        else:
+            self.mark_stale(name, sensor, timeout)
+
+    def mark_stale(self, name, sensor, timeout):
+        with self._lock:
+            self.stats[name].timeouts += 1
+            self.stale.add(name)
+        logging.warning('Sensor {} did not respond within {}s. Marking it stale.'.format(name, timeout))
+        mqtt.publish(sensor.availability_topic, 'offline')
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
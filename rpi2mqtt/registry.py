@@ -0,0 +1,81 @@
+"""Sensor types available in config.yaml.
+
+Types map to classes by import path, so a driver module (and the hardware libraries it needs) is only imported once a
+configured sensor uses it. A node with only reed switches never loads Adafruit_DHT, smbus2 or beacontools.
+
+Packages add sensor types through the `rpi2mqtt.sensors` entry point group, e.g. in setup.py:
+
+    entry_points={'rpi2mqtt.sensors': ['sht31 = rpi2mqtt_sht31:SHT31']}
+
+Sensor classes are created with `from_config(sensor, args)`.
+"""
+import importlib
+import logging
+
+
+class Registry():
+    """Sensor type to sensor class registry.
+
+    Attributes:
+        types (dict): Sensor type to 'module:Class' import path or already imported class.
+        ENTRY_POINT_GROUP (str): Entry point group searched for types that aren't built in.
+    """
+    ENTRY_POINT_GROUP = 'rpi2mqtt.sensors'
+
+    types = {
+        'dht22': 'rpi2mqtt.temperature:DHT',
+        'bme280': 'rpi2mqtt.temperature:BME280',
+        'onewire': 'rpi2mqtt.temperature:OneWire',
+        'ibeacon': 'rpi2mqtt.ibeacon:Scanner',
+        'switch': 'rpi2mqtt.switch:Switch',
+        'reed': 'rpi2mqtt.binary:ReedSwitch',
+        'hestiapi': 'rpi2mqtt.thermostat:HestiaPi',
+    }
+    _entry_points_loaded = False
+
+    @classmethod
+    def register(cls, sensor_type, target):
+        """Register a sensor class or its 'module:Class' import path as `sensor_type`."""
+        cls.types[sensor_type] = target
+
+    @classmethod
+    def load(cls, sensor_type):
+        """Import and return the class of `sensor_type`. Returns None for unknown types."""
+        if sensor_type not in cls.types and not cls._entry_points_loaded:
+            # scanning installed packages is slow, only do it for types that aren't built in
+            cls.load_entry_points()
+
+        target = cls.types.get(sensor_type)
+        if isinstance(target, str):
+            module, _, name = target.partition(':')
+            target = getattr(importlib.import_module(module), name)
+            cls.types[sensor_type] = target
+        return target
+
+    @classmethod
+    def load_entry_points(cls):
+        cls._entry_points_loaded = True
+        try:
+            # slow to import, only needed for types that aren't built in
+            from importlib.metadata import entry_points
+        except ImportError:
+            # Python < 3.8
+            return
+
+        eps = entry_points()
+        if hasattr(eps, 'select'):
+            eps = eps.select(group=Registry.ENTRY_POINT_GROUP)
+        else:
+            eps = eps.get(Registry.ENTRY_POINT_GROUP, [])
+        for ep in eps:
+            # built in types win, a plugin can't silently replace them
+            cls.types.setdefault(ep.name, ep.value)
+            logging.debug('Found sensor type {} in {}.'.format(ep.name, ep.value))
+
+    @classmethod
+    def create(cls, sensor, args):
+        """Create the sensor of a config.yaml entry. Returns None if its type is unknown."""
+        sensor_class = cls.load(sensor.type)
+        if sensor_class is None:
+            return None
+        return sensor_class.from_config(sensor, args)
@@ -0,0 +1,97 @@
+import threading
+import time
+
+
+def flatten(data, prefix=''):
+    """Flatten nested dicts into a single dict with dotted keys, e.g. {'bme280': {'temperature': 70}} becomes
+    {'bme280.temperature': 70}."""
+    flat = {}
+    for key, value in data.items():
+        key = '{}{}'.format(prefix, key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, key + '.'))
+        else:
+            flat[key] = value
+    return flat
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class ReportPolicy(object):
+    """Report-by-exception rules of a single sensor.
+
+    A reading is published when any field changed by more than its deadband since the last published reading, or
+    when nothing was published for `heartbeat` seconds. Fields without a deadband are published on any change.
+
+    Attributes:
+        deadbands (dict): Field name (or dotted path of nested fields) to deadband. Numbers are absolute deadbands,
+            strings ending in '%' are relative to the last published value, e.g. {'temperature': 0.5, 'humidity': '2%'}.
+        heartbeat (float): Maximum seconds between publishes. None disables the heartbeat.
+        ignore (set): Fields that never trigger a publish on their own. Ignoring a field ignores all fields nested in
+            it, e.g. 'window' ignores the statistics of sampled sensors.
+    """
+    IGNORE = ('timestamp', 'id', 'window')
+
+    def __init__(self, deadbands=None, heartbeat=None, ignore=IGNORE):
+        self.deadbands = {}
+        for field, deadband in (deadbands or {}).items():
+            self.deadbands[field] = ReportPolicy.parse_deadband(deadband)
+        self.heartbeat = heartbeat
+        self.ignore = set(ignore)
+        self.last = None
+        self.last_time = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, sensor_config, heartbeat=None):
+        """Build the policy for a sensor entry in config.yaml. Returns None if the sensor publishes every reading."""
+        deadbands = sensor_config.get('deadband')
+        heartbeat = sensor_config.get('heartbeat', heartbeat)
+        if deadbands or heartbeat:
+            return cls(deadbands, heartbeat, sensor_config.get('ignore', cls.IGNORE))
+
+    @staticmethod
+    def parse_deadband(deadband):
+        """Return (value, relative) for a deadband config value."""
+        if isinstance(deadband, str) and deadband.endswith('%'):
+            return float(deadband[:-1]) / 100.0, True
+        return float(deadband), False
+
+    def _deadband(self, key):
+        return self.deadbands.get(key) or self.deadbands.get(key.rsplit('.', 1)[-1])
+
+    def _ignored(self, key):
+        return key in self.ignore or key.rsplit('.', 1)[-1] in self.ignore or key.split('.', 1)[0] in self.ignore
+
+    def changed(self, flat):
+        if self.last is None or flat.keys() != self.last.keys():
+            return True
+
+        for key, value in flat.items():
+            if self._ignored(key):
+                continue
+            last = self.last[key]
+            deadband = self._deadband(key)
+            if deadband and _is_number(value) and _is_number(last):
+                threshold, relative = deadband
+                if relative:
+                    threshold *= abs(last)
+                if abs(value - last) > threshold:
+                    return True
+            elif value != last:
+                return True
+        return False
+
+    def should_publish(self, data, force=False):
+        """Check `data` against the last published reading. Remembers `data` as published if it returns True."""
+        flat = flatten(data)
+        now = time.monotonic()
+        with self._lock:
+            expired = self.heartbeat and self.last_time is not None and now - self.last_time >= self.heartbeat
+            if force or expired or self.changed(flat):
+                self.last = flat
+                self.last_time = now
+                return True
+        return False
@@ -0,0 +1,110 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+
+class Job(object):
+    """Periodic callback.
+
+    Deadlines are computed from the job's start time, i.e. the n-th run is due at `start + offset + n * interval`,
+    so slow callbacks don't make the schedule drift.
+
+    Attributes:
+        name (str): Job name used in logs.
+        callback (callable): Function to run.
+        interval (float): Seconds between runs. None runs the job once.
+        offset (float): Seconds to delay the first run.
+        jitter (float): Up to this many seconds are randomly added to every run.
+    """
+    def __init__(self, name, callback, interval, offset=0, jitter=0):
+        self.name = name
+        self.callback = callback
+        self.interval = float(interval) if interval is not None else None
+        self.offset = float(offset)
+        self.jitter = float(jitter)
+        self.start = None
+        self.runs = 0
+        self.deadline = None
+        self.last_lag = 0.0
+
+    def schedule(self, now):
+        """Compute the next deadline after `now`, skipping runs that were missed entirely."""
+        if self.start is None:
+            self.start = now
+        elif self.interval is None:
+            return None
+        else:
+            missed = int((now - self.start - self.offset) // self.interval)
+            self.runs = max(self.runs + 1, missed + 1)
+        self.deadline = self.start + self.offset + self.runs * (self.interval or 0)
+        if self.jitter:
+            self.deadline += random.uniform(0, self.jitter)
+        return self.deadline
+
+
+class Scheduler(object):
+    """Timer heap running every job at its own interval against a monotonic clock.
+
+    Attributes:
+        iteration_histogram (Histogram): Duration of iterations running at least one job. Set by Metrics.setup.
+        lag_histogram (Histogram): Job lag. Set by Metrics.setup.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.iteration_histogram = None
+        self.lag_histogram = None
+        self._heap = []
+        self._counter = itertools.count()
+        self._stopped = threading.Event()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, name, callback, interval, offset=0, jitter=0):
+        job = Job(name, callback, interval, offset, jitter)
+        self._push(job)
+        logging.debug('Scheduled {} every {}s (offset {}s, jitter {}s).'.format(name, interval, offset, jitter))
+        return job
+
+    def call_later(self, delay, name, callback):
+        """Run `callback` once after `delay` seconds."""
+        return self.add(name, callback, None, offset=delay)
+
+    def _push(self, job):
+        deadline = job.schedule(self.clock())
+        if deadline is not None:
+            heapq.heappush(self._heap, (deadline, next(self._counter), job))
+
+    def run_pending(self):
+        """Run every job that is due and reschedule it. Returns seconds until the next deadline."""
+        start = self.clock()
+        ran = False
+        while self._heap and self._heap[0][0] <= self.clock():
+            deadline, _, job = heapq.heappop(self._heap)
+            job.last_lag = self.clock() - deadline
+            ran = True
+            if self.lag_histogram is not None:
+                self.lag_histogram.observe(job.last_lag)
+            try:
+                job.callback()
+            except Exception:
+                logging.exception('Job {} failed.'.format(job.name))
+            self._push(job)
+
+        if ran and self.iteration_histogram is not None:
+            self.iteration_histogram.observe(self.clock() - start)
+        if self._heap:
+            return max(0.0, self._heap[0][0] - self.clock())
+
+    def run(self):
+        """Run jobs until `stop` is called."""
+        while not self._stopped.is_set():
+            timeout = self.run_pending()
+            self._stopped.wait(timeout)
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,214 @@
+"""Streaming statistics over a fixed window of timestamped samples. Updates of large windows are O(1)."""
+from collections import deque
+import time
+
+
+class RingBuffer(object):
+    """Fixed capacity FIFO. Appending to a full buffer overwrites the oldest item."""
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('Capacity must be at least 1.')
+        self.capacity = capacity
+        self._items = [None] * capacity
+        self._start = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for i in range(self._len):
+            yield self._items[(self._start + i) % self.capacity]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('RingBuffer index out of range')
+        return self._items[(self._start + index) % self.capacity]
+
+    @property
+    def full(self):
+        return self._len == self.capacity
+
+    def append(self, item):
+        """Append `item`. Returns the evicted item, or None if the buffer wasn't full."""
+        evicted = None
+        if self.full:
+            evicted = self._items[self._start]
+            self._items[self._start] = item
+            self._start = (self._start + 1) % self.capacity
+        else:
+            self._items[(self._start + self._len) % self.capacity] = item
+            self._len += 1
+        return evicted
+
+    def clear(self):
+        self._items = [None] * self.capacity
+        self._start = 0
+        self._len = 0
+
+
+class StreamingStats(object):
+    """Mean, EWMA, least-squares slope, min and max of the last `capacity` samples.
+
+    Windows of `INCREMENTAL_CAPACITY` or more samples update sums incrementally as samples enter and leave the window.
+    Timestamps are stored relative to an origin that is moved to the oldest sample every `capacity` evictions, when
+    the sums are also recomputed to shed accumulated rounding errors. That keeps updates O(1) amortized. Smaller
+    windows, like HestiaPi's 4 readings, only keep the samples and compute the statistics when they're read, which is
+    cheaper than maintaining sums and min/max deques on every append.
+
+    Attributes:
+        capacity (int): Number of samples in the window.
+        alpha (float): EWMA smoothing factor. Higher values follow new samples more closely.
+        ewma (float): Exponentially weighted moving average of all samples since the last clear.
+    """
+    # smallest window kept incrementally, see `rpi2mqtt bench rate_of_change`
+    INCREMENTAL_CAPACITY = 16
+
+    def __init__(self, capacity, alpha=0.3, clock=time.monotonic):
+        if capacity < 1:
+            raise ValueError('Capacity must be at least 1.')
+        self.capacity = capacity
+        self.alpha = alpha
+        self.clock = clock
+        self.incremental = capacity >= StreamingStats.INCREMENTAL_CAPACITY
+        self._samples = RingBuffer(capacity) if self.incremental else deque(maxlen=capacity)
+        self.clear()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def clear(self):
+        self._samples.clear()
+        self.ewma = None
+        if not self.incremental:
+            return
+        self._origin = None
+        self._evictions = 0
+        self._seq = 0
+        self._minima = deque()
+        self._maxima = deque()
+        self._n = 0
+        self._sum_v = 0.0
+        self._sum_t = 0.0
+        self._sum_tt = 0.0
+        self._sum_tv = 0.0
+
+    def values(self):
+        return [sample[1] for sample in self._samples]
+
+    def append(self, value, timestamp=None):
+        """Add a sample taken at `timestamp` seconds (defaults to `clock()`)."""
+        if timestamp is None:
+            timestamp = self.clock()
+        self.ewma = value if self.ewma is None else self.alpha * value + (1 - self.alpha) * self.ewma
+        if not self.incremental:
+            self._samples.append((timestamp, value))
+            return
+
+        if self._origin is None:
+            self._origin = timestamp
+        t = timestamp - self._origin
+
+        evicted = self._samples.append((t, value, self._seq))
+        self._add(t, value)
+        if evicted is not None:
+            self._remove(evicted[0], evicted[1])
+            self._evictions += 1
+            if self._evictions >= self.capacity:
+                self._rebase()
+
+        # monotonic deques, front is the min/max of the window
+        while self._minima and self._minima[-1][1] >= value:
+            self._minima.pop()
+        self._minima.append((self._seq, value))
+        while self._maxima and self._maxima[-1][1] <= value:
+            self._maxima.pop()
+        self._maxima.append((self._seq, value))
+        oldest = self._samples[0][2]
+        while self._minima[0][0] < oldest:
+            self._minima.popleft()
+        while self._maxima[0][0] < oldest:
+            self._maxima.popleft()
+        self._seq += 1
+
+    def _add(self, t, value):
+        self._n += 1
+        self._sum_v += value
+        self._sum_t += t
+        self._sum_tt += t * t
+        self._sum_tv += t * value
+
+    def _remove(self, t, value):
+        self._n -= 1
+        self._sum_v -= value
+        self._sum_t -= t
+        self._sum_tt -= t * t
+        self._sum_tv -= t * value
+
+    def _rebase(self):
+        shift = self._samples[0][0]
+        self._origin += shift
+        samples = [(t - shift, value, seq) for t, value, seq in self._samples]
+        self._samples.clear()
+        self._n = 0
+        self._sum_v = self._sum_t = self._sum_tt = self._sum_tv = 0.0
+        for sample in samples:
+            self._samples.append(sample)
+            self._add(sample[0], sample[1])
+        self._evictions = 0
+
+    @property
+    def mean(self):
+        if not self.incremental:
+            if self._samples:
+                return sum(value for _, value in self._samples) / len(self._samples)
+            return None
+        if self._n:
+            return self._sum_v / self._n
+
+    @property
+    def slope(self):
+        """Least-squares slope in value units per second. None until two samples with distinct timestamps exist."""
+        if not self.incremental:
+            return self._window_slope()
+        if self._n < 2:
+            return None
+        denominator = self._n * self._sum_tt - self._sum_t * self._sum_t
+        if denominator <= 0:
+            return None
+        return (self._n * self._sum_tv - self._sum_t * self._sum_v) / denominator
+
+    def _window_slope(self):
+        n = len(self._samples)
+        if n < 2:
+            return None
+        # relative to the oldest sample, like the incremental sums after a rebase
+        origin = self._samples[0][0]
+        sum_t = sum_v = sum_tt = sum_tv = 0.0
+        for t, value in self._samples:
+            t -= origin
+            sum_t += t
+            sum_v += value
+            sum_tt += t * t
+            sum_tv += t * value
+        denominator = n * sum_tt - sum_t * sum_t
+        if denominator <= 0:
+            return None
+        return (n * sum_tv - sum_t * sum_v) / denominator
+
+    @property
+    def min(self):
+        if not self.incremental:
+            return min(self.values()) if self._samples else None
+        if self._minima:
+            return self._minima[0][1]
+
+    @property
+    def max(self):
+        if not self.incremental:
+            return max(self.values()) if self._samples else None
+        if self._maxima:
+            return self._maxima[0][1]
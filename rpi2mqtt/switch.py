@@ -1,8 +1,9 @@
 from rpi2mqtt.base import Sensor
 from rpi2mqtt.mqtt import MQTT as mqtt
+from rpi2mqtt.edge import edges
+from rpi2mqtt.gpio import GPIO
 import json
 from datetime import datetime, timedelta
-import RPi.GPIO as g
 import logging
 
 
@@ -25,36 +26,34 @@ class BasicSwitch(Sensor):
         :return: None
         """
         # setup GPIO
-        g.setmode(g.BCM)
         if not type(self.pin) == list:
             self.pin = [self.pin]
 
-        for pin in self.pin:
-            g.setup(pin, g.IN)
+        GPIO.setup_input(self.pin)
         
         if not lazy_setup:
             self.setup_output()
 
     def setup_output(self):
         logging.info("Setting pins {} to ouptut.".format(self.pin))
-        g.setup(self.pin, g.OUT, initial=g.LOW)
+        GPIO.setup_output(self.pin, initial=0)
 
     def on(self):
         try:
-            g.output(self.pin, g.HIGH)
+            GPIO.write(self.pin, 1)
         except RuntimeError as e:
             logging.info("Switch output not configured yet. Setting up pins {}".format(self.pin))
             self.setup_output()
-            g.output(self.pin, g.HIGH)
+            GPIO.write(self.pin, 1)
         self.power_state = 'ON'
 
     def off(self):
         try:
-            g.output(self.pin, g.LOW)
+            GPIO.write(self.pin, 0)
         except RuntimeError as e:
             logging.info("Switch output not configured yet. Setting up pins {}".format(self.pin))
             self.setup_output()
-            g.output(self.pin, g.LOW)
+            GPIO.write(self.pin, 0)
         self.power_state = 'OFF'
 
     def toggle(self):
@@ -65,7 +64,7 @@ class BasicSwitch(Sensor):
 
     def state(self):
         # read output pin state
-        pin_state = g.input(self.pin)
+        pin_state = sum(GPIO.read_many(self.pin))
 
         # convert to home assistant on/off state defaults
         # https://www.home-assistant.io/integrations/switch.mqtt/#state_on
@@ -78,8 +77,8 @@ class BasicSwitch(Sensor):
 
         return self.power_state
 
-    def payload(self):
-        return json.dumps({'power_state': self.state()})
+    def data(self):
+        return {'power_state': self.state()}
 
     def publish_mqtt_discovery(self):
         pass
@@ -88,13 +87,23 @@ class BasicSwitch(Sensor):
 
 
 class Switch(Sensor):
+    """GPIO switch controlled through its MQTT command topic.
 
-    def __init__(self, name, pin, topic, device_class='switch', device_type='generic_switch'):
+    In event mode input changes are published as soon as they settle for `debounce` milliseconds, until the pins are
+    switched to outputs by the first command.
+    """
+
+    def __init__(self, name, pin, topic, device_class='switch', device_type='generic_switch', mode='poll', debounce=50):
         super(Switch, self).__init__(name, pin, topic, device_class, device_type)
         self.power_state = 'OFF'
         self.last_seen = datetime.now()
+        self.event_mode = mode == 'event'
+        self.debounce = debounce
         self.setup()
 
+    @classmethod
+    def from_config(cls, sensor, args):
+        return cls(sensor.name, sensor.pin, sensor.topic, mode=sensor.get('mode', 'poll'), debounce=sensor.get('debounce', 50))
 
     @property
     def homeassistant_mqtt_config(self):
@@ -110,12 +119,13 @@ class Switch(Sensor):
         :return: None
         """
         # setup GPIO
-        g.setmode(g.BCM)
         if not type(self.pin) == list:
             self.pin = [self.pin]
 
-        for pin in self.pin:
-            g.setup(pin, g.IN)
+        GPIO.setup_input(self.pin)
+
+        if self.event_mode:
+            edges.watch(self, self.pin, self.debounce)
 
         # for pin in self.pin:
         if not lazy_setup:
@@ -124,24 +134,28 @@ class Switch(Sensor):
 
     def setup_output(self):
         logging.debug("Setting pins {} to ouptut.".format(self.pin))
-        g.setup(self.pin, g.OUT, initial=g.LOW)
+        if self.event_mode:
+            # edge detection only works on inputs
+            edges.unwatch(self.pin)
+            self.event_mode = False
+        GPIO.setup_output(self.pin, initial=0)
 
     def on(self):
         try:
-            g.output(self.pin, g.HIGH)
+            GPIO.write(self.pin, 1)
         except RuntimeError as e:
             logging.info("Switch output not configured yet. Setting up pins {}".format(self.pin))
             self.setup_output()
-            g.output(self.pin, g.HIGH)
+            GPIO.write(self.pin, 1)
         self.power_state = 'ON'
 
     def off(self):
         try:
-            g.output(self.pin, g.LOW)
+            GPIO.write(self.pin, 0)
         except RuntimeError as e:
             logging.info("Switch output not configured yet. Setting up pins {}".format(self.pin))
             self.setup_output()
-            g.output(self.pin, g.LOW)
+            GPIO.write(self.pin, 0)
         self.power_state = 'OFF'
 
     def toggle(self):
@@ -153,9 +167,8 @@ class Switch(Sensor):
     def state(self):
         # read output pin state
         # TODO refactor switch into single pin & multi pin classes
-        pin_state = 0
-        for _pin in self.pin:
-            pin_state += g.input(_pin)
+        # all pins in one read
+        pin_state = sum(GPIO.read_many(self.pin))
 
         # convert to home assistant on/off state defaults
         # https://www.home-assistant.io/integrations/switch.mqtt/#state_on
@@ -168,12 +181,15 @@ class Switch(Sensor):
 
         return self.power_state
 
-    def payload(self):
-        return json.dumps({'power_state': self.state()})
+    def data(self):
+        data = {'power_state': self.state()}
+        if self.event_mode:
+            data['timestamp'] = edges.changed_at(self, data['power_state'])
+        return data
 
     # def callback(self, *args):
     #     mqtt.publish(self.topic, self.payload())
-    @mqtt.pongable
+    @mqtt.command
     def mqtt_callback(self, client, userdata, message):
         try:
             # print(message)
@@ -187,6 +203,6 @@ class Switch(Sensor):
         except Exception as e:
             logging.error('Unable to proces message.', e)
 
-        mqtt.publish(self.topic, self.payload())
+        self.publish_state(force=True, priority=True)
 
     
\ No newline at end of file
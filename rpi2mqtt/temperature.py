@@ -1,35 +1,38 @@
 # coding=utf-8
-import Adafruit_DHT as dht
 import json
 from rpi2mqtt.mqtt import MQTT as mqtt
 from rpi2mqtt.base import Sensor, SensorGroup, sensor
+from rpi2mqtt.discovery import Discovery
 import logging
 import os
 import glob
-import smbus2
-import bme280
-import re
+from concurrent.futures import ThreadPoolExecutor
+# Sensor drivers (Adafruit_DHT, smbus2, bme280) are imported by the sensors using them, so a node without a DHT or
+# BME280 never loads them.
 
 
-class DHT(object):
+class DHT(Sensor):
+    """DHT22 temperature and humidity sensor, published as two Home Assistant entities sharing one state topic."""
 
     def __init__(self, pin, topic, name, device_class, dht_type):
         self.type = dht_type
-        self.pin = pin
-        self.topic = topic
-        self.name = name
-        self.device_class = device_class
+        super(DHT, self).__init__(name, pin, topic, device_class, 'DHT 22')
         self.setup()
 
+    @classmethod
+    def from_config(cls, sensor, args):
+        return cls(sensor.pin, sensor.topic, sensor.name, 'sensor', sensor.type)
+
     def read(self, scale='F'):
+        import Adafruit_DHT as dht
         self.humidity, self.temperature = dht.read_retry(22, self.pin)
         #print humidity
         #print temperature
 
         if scale == 'F':
-            return json.dumps({'humidity': self._humidity, 'temperature': self.temperature_F})
+            return {'humidity': self._humidity, 'temperature': self.temperature_F}
         else:
-            return json.dumps({'humidity': self._humidity, 'temperature': self.temperature})
+            return {'humidity': self._humidity, 'temperature': self.temperature}
 
     @property
     def temperature_F(self):
@@ -53,12 +56,16 @@ class DHT(object):
             pass
 
     def setup(self):
+        # Adafruit_DHT needs no setup
+        pass
+
+    def publish_mqtt_discovery(self):
         # config = json.dumps({'name': self.name, 'device_class': self.device_class})
 
         device_config = {'name': "Laundry Room Climate",
                          'identifiers': self.name,
                          'sw_version': 'rpi2mqtt',
-                         'model': "DHT 22",
+                         'model': self.device_model,
                          'manufacturer': 'Generic'}
 
         config = json.dumps({'name': self.name + '_temperature',
@@ -68,9 +75,11 @@ class DHT(object):
                              'unique_id': self.name + '_temperature_rpi2mqtt',
                              'state_topic': self.topic,
                              "json_attributes_topic": self.topic,
+                             'availability': self.availability,
+                             'availability_mode': 'all',
                              'device': device_config})
 
-        mqtt.publish('homeassistant/sensor/{}_{}/config'.format(self.name, 'temp'), config)
+        Discovery.add('homeassistant/sensor/{}_{}/config'.format(self.name, 'temp'), config)
 
         config = json.dumps({'name': self.name + '_humidity',
                              'device_class': 'humidity',
@@ -79,21 +88,18 @@ class DHT(object):
                              'value_template': "{{ value_json.humidity }}",
                              'unique_id': self.name + '_humidity_rpi2mqtt',
                              'state_topic': self.topic,
+                             'availability': self.availability,
+                             'availability_mode': 'all',
                              'device': device_config})
 
-        mqtt.publish('homeassistant/sensor/{}_{}/config'.format(self.name, 'humidity'), config)
+        Discovery.add('homeassistant/sensor/{}_{}/config'.format(self.name, 'humidity'), config)
 
     def state(self):
         return self.read()
 
-    def payload(self):
-        # return json.dumps({'state': self.state()})
-        # return json.dumps(self.state())
+    def data(self):
         return self.state()
 
-    def callback(self, **kwargs):
-        mqtt.publish(self.topic, self.payload())
-
 
 class GenericTemperature(Sensor):
     @property
@@ -139,7 +145,10 @@ class GenericPressure(Sensor):
 class BME280(SensorGroup):
 
     def __init__(self, name, topic, **kwargs):
+        import smbus2
+        import bme280
         super(BME280, self).__init__(name, None, topic, 'temperature/humidity/pressure', 'BME280', **kwargs)
+        self.driver = bme280
         self.port = 1
         self.address = 0x76
         self.bus = smbus2.SMBus(self.port)
@@ -158,6 +167,10 @@ class BME280(SensorGroup):
         # TODO sensors with multiple reading types can be supported with publishing one message
         # but each reading type must be setup seperately with different names and value_json attributes.
     
+    @classmethod
+    def from_config(cls, sensor, args):
+        return cls(sensor.name, sensor.topic, max_age=sensor.get('max_age'))
+
     # @sensor
     def setup_temperature(self):
         sensor = GenericTemperature(self.name, None, self.topic, 'temperature', self.device_type)
@@ -173,8 +186,8 @@ class BME280(SensorGroup):
         sensor = GenericPressure(self.name, None, self.topic, 'pressure', self.device_type)
         self.sensors.append(sensor)
 
-    def state(self):
-        data = bme280.sample(self.bus, self.address, self.calibration_params)
+    def read(self):
+        data = self.driver.sample(self.bus, self.address, self.calibration_params)
         return {'id': str(data.id),
             'timestamp': str(data.timestamp),
             'temperature': data.temperature * 1.8 + 32,
@@ -182,45 +195,157 @@ class BME280(SensorGroup):
             'humidity': data.humidity,
             }
 
-    def payload(self):
-        return json.dumps(self.state())
+    def data(self):
+        return self.state()
+
+    def callback(self, **kwargs):
+        self.state(force=True)
+        super(BME280, self).callback(**kwargs)
+
+
+class OneWireProbe(GenericTemperature):
+    """Home Assistant entity of a single device on a one wire bus. Its reading is part of the bus' payload."""
+
+    def __init__(self, name, topic, w1_id):
+        self.w1_id = w1_id
+        super(OneWireProbe, self).__init__('{}_{}'.format(name, w1_id), None, topic, 'temperature', 'One wire')
+
+    @property
+    def homeassistant_mqtt_config(self):
+        config = super(OneWireProbe, self).homeassistant_mqtt_config
+        config['value_template'] = "{{{{ value_json['{}'] }}}}".format(self.w1_id)
+        return config
 
 
 class OneWire(Sensor):
-    """Must enable one wire interface on Raspberry Pi and load modprobe w1-gpio and w1-therm drivers."""
+    """Must enable one wire interface on Raspberry Pi and load modprobe w1-gpio and w1-therm drivers.
+
+    Every device on the bus is read and published as its own Home Assistant entity. The payload holds each device's
+    temperature keyed by its id. Earlier versions also published the bus as an entity showing the first device's
+    temperature, i.e. that device twice. It's removed from Home Assistant unless `legacy_entity` keeps it, with the
+    first device's temperature as 'state' in the payload. Conversions are started bus wide
+    through `therm_bulk_read` when the kernel supports it and the devices are read concurrently, so a bus with many
+    probes takes about as long as one with a single probe.
+
+    Device files are opened once and re-read with `pread`. The kernel's `temperature` attribute is read when it exists
+    (Linux 5.10+), otherwise `w1_slave`. Reads failing the CRC check are retried immediately up to `RETRIES` times.
+
+    Attributes:
+        base_dir (str): sysfs devices directory. Point it at a fake tree for testing.
+        legacy_entity (bool): Keep publishing the bus as an entity of its own.
+    """
     BASE_DIR = '/sys/bus/w1/devices/'
-    # These tow lines mount the device:
-    os.system('modprobe w1-gpio')
-    os.system('modprobe w1-therm')
+    MAX_WORKERS = 8
+    RETRIES = 2
 
-    TEMP_REGEX = re.compile('.*? t=(\d*)')
-
-    def __init__(self, name, topic, **kwargs):
+    def __init__(self, name, topic, base_dir=None, legacy_entity=False, **kwargs):
+        self.base_dir = base_dir or OneWire.BASE_DIR
+        self.legacy_entity = legacy_entity
         self.devices = {}
+        self.fds = {}
+        self.probes = []
+        self.temperatures = {}
         self.temperature = None
-        self.setup()
+        self.pool = None
         super(OneWire, self).__init__(name, None, topic, 'temperature', 'One wire', **kwargs)
+        self.setup()
+
+    @classmethod
+    def from_config(cls, sensor, args):
+        return cls(sensor.name, sensor.topic, base_dir=sensor.get('base_dir'),
+                   legacy_entity=sensor.get('legacy_entity', False))
+
+    def publish_mqtt_discovery(self):
+        if self.legacy_entity:
+            super(OneWire, self).publish_mqtt_discovery()
+        else:
+            Discovery.remove(self.homeassistant_mqtt_config_topic)
+
+    @staticmethod
+    def load_drivers():
+        # mount the one wire bus and thermometers
+        os.system('modprobe w1-gpio')
+        os.system('modprobe w1-therm')
 
     def setup(self):
-        for device in glob.glob( OneWire.BASE_DIR + '**/w1_slave'):
+        if self.base_dir == OneWire.BASE_DIR:
+            self.load_drivers()
+        for device in sorted(glob.glob(os.path.join(self.base_dir, '**/w1_slave'))):
             w1_id = device.split('/')[-2]
+            temperature = os.path.join(os.path.dirname(device), 'temperature')
+            if os.path.exists(temperature):
+                device = temperature
             self.devices[w1_id] = device
+            self.fds[w1_id] = os.open(device, os.O_RDONLY)
+            self.probes.append(OneWireProbe(self.name, self.topic, w1_id))
+        self.pool = ThreadPoolExecutor(max_workers=min(OneWire.MAX_WORKERS, max(1, len(self.devices))),
+                                       thread_name_prefix='rpi2mqtt-w1')
+        logging.debug('Found one wire devices {}.'.format(list(self.devices)))
         return True
 
+    def trigger_bulk_read(self):
+        """Start a temperature conversion on every device of every bus at once. Returns False if unsupported."""
+        triggered = False
+        for bulk_read in glob.glob(os.path.join(self.base_dir, 'w1_bus_master*/therm_bulk_read')):
+            try:
+                with open(bulk_read, 'w') as f:
+                    f.write('trigger\n')
+                triggered = True
+            except (IOError, OSError) as e:
+                logging.debug('Unable to trigger bulk read {}: {}'.format(bulk_read, e))
+        return triggered
+
+    def read_device(self, w1_id):
+        """Temperature in °C of device `w1_id`, or None if it couldn't be read."""
+        fd = self.fds[w1_id]
+        temperature_attribute = self.devices[w1_id].endswith('temperature')
+        for attempt in range(OneWire.RETRIES + 1):
+            try:
+                # sysfs regenerates the attribute on every read from offset 0, which starts a new conversion unless
+                # a bulk read is pending
+                text = os.pread(fd, 256, 0).decode('ascii', 'replace')
+            except OSError as e:
+                # the temperature attribute fails the read on a CRC error
+                logging.debug('Read of one wire device {} failed: {}'.format(w1_id, e))
+                continue
+            if temperature_attribute:
+                temperature = OneWire.parse_temperature(text)
+            else:
+                temperature = OneWire.parse_one_wire_file(w1_id, text)
+            if temperature is not None:
+                return temperature
+        logging.warning('Unable to read one wire device {} after {} attempts.'.format(w1_id, OneWire.RETRIES + 1))
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+        self.pool.shutdown(wait=False)
+
     def state(self):
-        for device, filename in self.devices.items():
-            with open(filename, 'r') as f:
-                self.temperature = OneWire.parse_one_wire_file(device, f.read())
+        self.trigger_bulk_read()
+        self.temperatures = dict(zip(self.fds, self.pool.map(self.read_device, self.fds)))
+        self.temperature = next(iter(self.temperatures.values()), None)
+        return self.temperature_F
+
+    def data(self):
+        state = self.state()
+        data = {'state': state} if self.legacy_entity else {}
+        for w1_id, temperature in self.temperatures.items():
+            data[w1_id] = OneWire.fahrenheit(temperature)
+        return data
 
-            return self.temperature_F
-    
-    @property
-    def temperature_F(self):
+    @staticmethod
+    def fahrenheit(temperature):
         try:
-            return round(self.temperature * 1.8 + 32.0, 1)
+            return round(temperature * 1.8 + 32.0, 1)
         except:
             pass
 
+    @property
+    def temperature_F(self):
+        return OneWire.fahrenheit(self.temperature)
+
     @property
     def temperature_C(self):
         try:
@@ -228,10 +353,27 @@ class OneWire(Sensor):
         except:
             pass
 
+    @staticmethod
+    def parse_temperature(text):
+        """°C from the `temperature` attribute, which holds millidegrees."""
+        try:
+            return int(text) / 1000.0
+        except ValueError:
+            return None
+
     @staticmethod
     def parse_one_wire_file(device, text):
-        match = OneWire.TEMP_REGEX.search(text)
-        if text:
-            return float(match.groups()[0]) / 1000.0
-        else:
-            logging.warn('Unable to parse temperature for one wire device {}.'.format(device))
+        """°C from a `w1_slave` file, or None if its CRC check failed.
+
+        The file holds two lines of scratchpad bytes, the first ending in the CRC result and the second in the reading:
+        `72 01 4b 46 7f ff 0e 10 57 : crc=57 YES` and `72 01 4b 46 7f ff 0e 10 57 t=23125`.
+        """
+        crc, _, reading = text.partition('\n')
+        if not crc.rstrip().endswith('YES'):
+            logging.debug('CRC check failed for one wire device {}.'.format(device))
+            return None
+        _, found, value = reading.partition('t=')
+        try:
+            return int(value) / 1000.0 if found else None
+        except ValueError:
+            return None
@@ -1,12 +1,14 @@
 from rpi2mqtt.switch import BasicSwitch
 from rpi2mqtt.base import Sensor
+from rpi2mqtt.config import Config
 from rpi2mqtt.mqtt import MQTT
 from rpi2mqtt.temperature import BME280
-import RPi.GPIO as GPIO
+from rpi2mqtt.gpio import GPIO
+from rpi2mqtt.profiling import traced
 import pendulum
 import logging
 import json
-import rpi2mqtt.math as math
+from rpi2mqtt.stats import StreamingStats
 
 
 class HVAC(object):
@@ -42,6 +44,11 @@ class HVAC(object):
     OFF = 'off'
 
 
+# one bit per heat pump pin so the active pins can be decoded with a single table lookup
+HVAC.PIN_BITS = {pin: 1 << i for i, pin in enumerate(HVAC.HEAT_PUMP.values())}
+HVAC.MODES_BY_MASK = {sum(HVAC.PIN_BITS[pin] for pin in pins): mode for mode, pins in HVAC.HEAT_PUMP_MODES.items()}
+
+
 class HvacException(Exception):
     pass
 
@@ -69,22 +76,35 @@ class HestiaPi(Sensor):
         self.bme280 = None
         # container to holder mode switches. Do not use directly.
         self._modes = {}
-        # container to store temperature history
-        self.temperature_history = []
-        # Minimum temperature rate of change over 4 measurements
-        self.minimum_temp_rate_of_change = .05
+        # last 4 temperature readings while the system is active. 4 is ~20 minutes.
+        self.temperature_history = StreamingStats(4)
+        # seconds between readings in the history, i.e. the polling interval
+        self.interval = kwargs.get('interval') or 300
+        # Minimum temperature rate of change in degrees per reading over the history
+        self.min_rate_of_change = kwargs.get('min_rate_of_change') or .05
         # super(HestiaPi, self).__init__(name, None, topic, 'climate', 'HestiaPi')
         # put thermostat into test mode. i.e. don't trigger HVAC commands
         self.dry_run = kwargs.get('dry_run')
         # save boost state
         self._boosting_heat = HVAC.OFF
         self._boosting_start_time = None
+        # seconds a BME280 reading is reused within a control cycle
+        self.max_age = kwargs.get('max_age')
+        # HVAC pin states as a bitmask. Read once per tick, see read_pins().
+        self._pin_mask = None
 
         self.setup()
 
+    @classmethod
+    def from_config(cls, sensor, args):
+        config = Config.get_instance() or {}
+        return cls(sensor.name, sensor.topic, sensor.heat_setpoint, sensor.cool_setpoint, dry_run=args.dry_run,
+                   max_age=sensor.get('max_age'), interval=sensor.get('interval', config.get('polling_interval')),
+                   min_rate_of_change=sensor.get('min_rate_of_change'))
+
     def setup(self):
         logging.debug('Setting up HestiaPi')
-        self.bme280 = BME280(self.name, self.topic)
+        self.bme280 = BME280(self.name, self.topic, max_age=self.max_age)
 
         for mode, pins in HVAC.HEAT_PUMP_MODES.items():
             switch = BasicSwitch(self.name, pins, '{}_{}'.format(self.topic, mode), mode)
@@ -92,15 +112,13 @@ class HestiaPi(Sensor):
             self._modes[mode] = switch
 
         # setup GPIO inputs on HVAC pins
-        GPIO.setmode(GPIO.BCM)
-        for capability, pin in HVAC.HEAT_PUMP.items():
-            GPIO.setup(pin, GPIO.IN)
+        GPIO.setup_input(list(HVAC.PIN_BITS))
 
         # Subscribe to MQTT command topics
-        mqtt.subscribe(self.mode_command_topic, self.mqtt_set_mode_callback)
-        mqtt.subscribe(self.temperature_set_point_command_topic, self.mqtt_set_temperature_set_point_callback)
-        mqtt.subscribe(self.fan_command_topic, self.mqtt_set_fan_state_callback)
-        mqtt.subscribe(self.aux_command_topic, self.mqtt_set_aux_mode_callback)
+        MQTT.subscribe(self.mode_command_topic, self.mqtt_set_mode_callback)
+        MQTT.subscribe(self.temperature_set_point_command_topic, self.mqtt_set_temperature_set_point_callback)
+        MQTT.subscribe(self.fan_command_topic, self.mqtt_set_fan_state_callback)
+        MQTT.subscribe(self.aux_command_topic, self.mqtt_set_aux_mode_callback)
 
     @property
     def mode_command_topic(self):
@@ -128,6 +146,8 @@ class HestiaPi(Sensor):
                 'name': '{}_{}'.format(self.name, self.device_class),
                 'unique_id': '{}_{}_{}_rpi2mqtt'.format(self.name, self.device_model, self.device_class),
                 "json_attributes_topic": self.topic,
+                'availability': self.availability,
+                'availability_mode': 'all',
                 'device': self.device_config,
                 'min_temp': 65,
                 'max_temp': 80,
@@ -159,6 +179,7 @@ class HestiaPi(Sensor):
                 if mode not in [HVAC.FAN, HVAC.BOOST]:
                     self.active_start_time = pendulum.now()
                 self._modes[mode].on()
+                self.invalidate_pins()
 
                 # confirm mode change
                 if mode == self.hvac_state: # TODO if boosting then only check boosting pin is active
@@ -168,9 +189,10 @@ class HestiaPi(Sensor):
 
             elif state == HVAC.OFF:
                 self._modes[mode].off()
+                self.invalidate_pins()
                 if mode not in [HVAC.FAN, HVAC.BOOST]:
                     self.active_start_time = None
-                    self.temperature_history = []
+                    self.temperature_history.clear()
 
                 # confirm mode change
                 if 'off' == self.hvac_state:
@@ -226,21 +248,34 @@ class HestiaPi(Sensor):
         elif self.mode == HVAC.COOL:
             return self.set_point_cool
 
+    def read_pins(self):
+        """Read all HVAC pins into a bitmask. See HVAC.PIN_BITS."""
+        mask = 0
+        # one read of all pins, they're sampled together on backends supporting it
+        for level, bit in zip(GPIO.read_many(list(HVAC.PIN_BITS)), HVAC.PIN_BITS.values()):
+            if level:
+                mask |= bit
+        self._pin_mask = mask
+        logging.debug('HVAC state is "{}". Active GPIO pin mask = {:04b}'.format(HVAC.MODES_BY_MASK.get(mask), mask))
+        return mask
+
+    def invalidate_pins(self):
+        """Force the next hvac_state lookup to read the pins again.
+
+        Called at the start of every tick (callback or MQTT command) and whenever an HVAC output is driven.
+        """
+        self._pin_mask = None
+
+    @property
+    def pin_mask(self):
+        if self._pin_mask is None:
+            return self.read_pins()
+        return self._pin_mask
+
     @property
     def hvac_state(self):
         """Current HVAC mode based on active GPIO pins."""
-        active_pins = []
-        # read pin state
-        for capability, pin in HVAC.HEAT_PUMP.items():
-            if GPIO.input(pin):
-                active_pins.append(pin)
-        active_pins = set(active_pins)
-
-        # search heat pump modes for a match
-        for mode, p in HVAC.HEAT_PUMP_MODES.items():
-            if active_pins == set(p):
-                logging.debug('HVAC state is "{}". Active GPIO pins = {}'.format(mode, active_pins))
-                return mode
+        return HVAC.MODES_BY_MASK.get(self.pin_mask)
 
     @property
     def fan_state(self):
@@ -272,17 +307,27 @@ class HestiaPi(Sensor):
          # if system is active log temperature changes for analysis
         if self.active:
             self.temperature_history.append(self.temperature)
-            logging.debug('Temperature history = {}'.format(self.temperature_history))
-            if len(self.temperature_history) > 3: # how many readings should we keep track of. 4 is ~20 minutes.
-                self.temperature_history.pop(0)
+            logging.debug('Temperature history = {}'.format(self.temperature_history.values()))
 
     @property
     def temperature_rate_of_change(self):
-        if len(self.temperature_history) > 1:
-            roc = math.rate_of_change(self.temperature_history)
+        """Least-squares temperature slope over the history in degrees per minute."""
+        slope = self.temperature_history.slope
+        if slope is not None:
+            roc = slope * 60
             logging.debug('Temperature rate of change is {}.'.format(roc))
             return roc
 
+    @property
+    def minimum_temp_rate_of_change(self):
+        """`min_rate_of_change` in degrees per minute."""
+        return self.min_rate_of_change * 60 / self.interval
+
+    def needs_heat_boost(self, rate_of_change):
+        """Whether heat warms slower than `minimum_temp_rate_of_change`. Neither a missing rate nor a rate of exactly 0
+        boosts, like before the history kept its slope."""
+        return self.mode == HVAC.HEAT and bool(rate_of_change) and rate_of_change <= self.minimum_temp_rate_of_change
+
     def state(self):
         data = self.bme280.state()
         return {
@@ -298,14 +343,18 @@ class HestiaPi(Sensor):
             'cool_setpoint': self.set_point_cool,
             'set_point': self.set_point,
             'current_temperature': self.current_temperature,
-            'humidity': self.bme280.state()['humidity'],
-            'pressure': self.bme280.state()['pressure'],
+            'humidity': data['humidity'],
+            'pressure': data['pressure'],
         }
 
-    def payload(self):
-        return json.dumps(self.state())
+    def data(self):
+        return self.state()
 
+    @traced('hestiapi.callback')
     def callback(self, **kwargs):
+        # take one fresh reading, the rest of the cycle uses the snapshot
+        self.bme280.state(force=True)
+        self.invalidate_pins()
         # system active, should we turn it off?
         logging.info('Checking temperature...temp = {}, heat_setpoint = {}, cool_setpoint = {}, set_point_tolerance = {}'.format(self.temperature, self.set_point_heat, self.set_point_cool, self.set_point_tolerance))
         self.append_tempearture_history()
@@ -326,8 +375,9 @@ class HestiaPi(Sensor):
                 self.off()
 
             # should system boost heating with aux heat?
-            logging.debug("Checking temperature rate of change...current rate = {}, min rate = {}".format(self.temperature_rate_of_change, self.minimum_temp_rate_of_change))
-            if self.mode == HVAC.HEAT and self.temperature_rate_of_change and self.temperature_rate_of_change <= self.minimum_temp_rate_of_change:
+            rate_of_change = self.temperature_rate_of_change
+            logging.debug("Checking temperature rate of change...current rate = {}, min rate = {}".format(rate_of_change, self.minimum_temp_rate_of_change))
+            if self.needs_heat_boost(rate_of_change):
                 self.boost_heat(HVAC.ON)
 
         else:
@@ -341,7 +391,7 @@ class HestiaPi(Sensor):
                 self.on()
             # system is inactive, should we turn it on?
         # logging.info('HVAC is {}. Mode is {}. Temperature is {}.'.format(self.active, self.mode, self.temperature))
-        mqtt.publish(self.topic, self.payload())
+        self.publish_state()
 
     # def mode_is_changeable(self):
     #     """Can thermostat active mode be chagned?"""
@@ -384,7 +434,7 @@ class HestiaPi(Sensor):
     def off(self):
         if self._can_change_hvac_state():
             self.set_state(self.mode, HVAC.OFF)
-            self.temperature_history = []
+            self.temperature_history.clear()
         else:
             logging.warn("Did not deactivate {}.".format(self.mode))
 
@@ -430,18 +480,12 @@ class HestiaPi(Sensor):
             raise HvacException('{} is not a valid boost value. allowed values are [[{},{}]'.format(boost, HVAC.ON, HVAC.OFF))
         # self._boosting_heat = boost
     
-    def mqtt_ping(self, topic, callback):
-        logging.debug("Checing subcription status on topic {}".format(topic))
-        response = mqtt.publish(topic, "ping")
-        if response != 'pong':
-            logging.warn("Not subscribed to topic {}. Resubscribing...".format(topic))
-            mqtt.subscribe(topic, callback)
-
     """
     MQTT subscription callbacks
     """
-    @MQTT.pongable
+    @MQTT.command
     def mqtt_set_temperature_set_point_callback(self, client, userdata, message):
+        self.invalidate_pins()
         try:
             payload = message.payload.decode()
             logging.info("Received temperature set point update request: {}".format(message.payload))
@@ -453,10 +497,11 @@ class HestiaPi(Sensor):
         except Exception as e:
             logging.error('Unable to proces message.', e)
 
-        MQTT.publish(self.topic, self.payload())
+        self.publish_state(force=True, priority=True)
 
-    @MQTT.pongable
+    @MQTT.command
     def mqtt_set_fan_state_callback(self, client, userdata, message):
+        self.invalidate_pins()
         try:
             payload = message.payload.decode().lower()
             logging.info("Received fand mode update request: {}".format(payload))
@@ -464,10 +509,11 @@ class HestiaPi(Sensor):
         except Exception as e:
             logging.error('Unable to proces message.', e)
 
-        MQTT.publish(self.topic, self.payload())
+        self.publish_state(force=True, priority=True)
 
-    @MQTT.pongable
+    @MQTT.command
     def mqtt_set_mode_callback(self, client, userdata, message):
+        self.invalidate_pins()
         try:
             payload = message.payload.decode().lower()
             logging.info("Received HVAC mode update request: {}".format(payload))
@@ -475,10 +521,11 @@ class HestiaPi(Sensor):
         except Exception as e:
             logging.error('Unable to proces message.', e)
 
-        MQTT.publish(self.topic, self.payload())
+        self.publish_state(force=True, priority=True)
 
-    @MQTT.pongable
+    @MQTT.command
     def mqtt_set_aux_mode_callback(self, client, userdata, message):
+        self.invalidate_pins()
         try:
             payload = message.payload.decode().lower()
             logging.info("Received aux mode update request: {}".format(payload))
@@ -486,7 +533,7 @@ class HestiaPi(Sensor):
         except Exception as e:
             logging.error('Unable to proces message.', e)
 
-        MQTT.publish(self.topic, self.payload())
+        self.publish_state(force=True, priority=True)
 
 
 
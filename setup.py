@@ -80,6 +80,12 @@ setup(
         'pendulum==2.1.1', 
         'poetry',
     ],
+    extras_require={
+        'batch': ['numpy>=1.20'],
+        'orjson': ['orjson'],
+        'cbor': ['cbor2'],
+        'msgpack': ['msgpack'],
+    },
     entry_points={
         'console_scripts': ['rpi2mqtt=rpi2mqtt.event_loop:main']
     }
@@ -0,0 +1,27 @@
+"""Tests run against the in-process fakes of `rpi2mqtt.fakes`, no Raspberry Pi or broker needed."""
+from rpi2mqtt import fakes
+import pytest
+
+# before any sensor module imports RPi.GPIO, smbus2 or bme280
+fakes.install()
+
+
+@pytest.fixture
+def mqtt():
+    """MQTT with a FakeClient and a fresh outbox. Nothing is sent until the test drains the outbox."""
+    from rpi2mqtt.bench import fake_mqtt
+    from rpi2mqtt.mqtt import MQTT
+
+    fake_mqtt()
+    yield MQTT
+    MQTT.connected = False
+
+
+@pytest.fixture
+def gpio():
+    """Simulated GPIO backend."""
+    from rpi2mqtt.gpio import GPIO
+
+    backend = GPIO.setup('simulated')
+    yield backend
+    GPIO.backend = None
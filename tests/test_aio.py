@@ -0,0 +1,45 @@
+from rpi2mqtt.aio import AsyncioHelper
+from rpi2mqtt.fakes import FakeClient
+from types import SimpleNamespace
+import asyncio
+import threading
+import time
+
+
+def test_commands_run_off_the_loop_in_order():
+    calls = []
+
+    def command(client, userdata, message):
+        # blocking GPIO or I2C work
+        time.sleep(0.05)
+        calls.append((message.payload, threading.current_thread().name))
+
+    async def main():
+        helper = AsyncioHelper(asyncio.get_running_loop(), FakeClient())
+        callback = helper.dispatch(command)
+        start = time.monotonic()
+        callback(None, None, SimpleNamespace(topic='a/set', payload='ON'))
+        callback(None, None, SimpleNamespace(topic='a/set', payload='OFF'))
+        # the loop isn't blocked while the commands run
+        assert time.monotonic() - start < 0.05
+        while len(calls) < 2:
+            await asyncio.sleep(0.01)
+        helper.commands.shutdown()
+
+    asyncio.run(main())
+    assert [payload for payload, _ in calls] == ['ON', 'OFF']
+    assert all(name.startswith('rpi2mqtt-commands') for _, name in calls)
+
+
+def test_failed_command_is_logged(caplog):
+    def command(client, userdata, message):
+        raise ValueError('invalid')
+
+    async def main():
+        helper = AsyncioHelper(asyncio.get_running_loop(), FakeClient())
+        helper.dispatch(command)(None, None, SimpleNamespace(topic='a/set', payload='x'))
+        await asyncio.sleep(0.1)
+        helper.commands.shutdown()
+
+    asyncio.run(main())
+    assert 'Command on a/set failed.' in caplog.text
@@ -0,0 +1,81 @@
+from rpi2mqtt import batch
+import math
+import numpy as np
+import pytest
+
+
+@pytest.fixture(params=[True, False], ids=['numpy', 'python'])
+def use_numpy(request):
+    return request.param
+
+
+def nan_to_none(rows):
+    return [[None if math.isnan(v) else v for v in row] for row in rows]
+
+
+def test_rates_of_change(use_numpy):
+    values = [[0, 1, 2, 3], [10, 8, 6, 4]]
+    assert list(batch.rates_of_change(values, use_numpy=use_numpy)) == pytest.approx([1, -2])
+    timestamps = [0, 60, 120, 180]
+    assert list(batch.rates_of_change(values, timestamps, use_numpy=use_numpy)) == pytest.approx([1 / 60, -2 / 60])
+
+
+@pytest.mark.parametrize('array', [list, np.array], ids=['lists', 'array'])
+def test_rates_of_change_per_series_timestamps(use_numpy, array):
+    values = array([[0.0, 1.0, 2.0], [0.0, 2.0, 4.0]])
+    timestamps = array([[0.0, 1.0, 2.0], [0.0, 10.0, 20.0]])
+    assert list(batch.rates_of_change(values, timestamps, use_numpy=use_numpy)) == pytest.approx([1, 0.2])
+
+
+def test_rates_of_change_shared_array_timestamps(use_numpy):
+    values = np.array([[0.0, 3.0, 6.0]])
+    assert list(batch.rates_of_change(values, np.array([0.0, 1.0, 2.0]), use_numpy=use_numpy)) == pytest.approx([3])
+
+
+def test_rates_of_change_missing(use_numpy):
+    nan = float('nan')
+    values = [[0, nan, 2, 3], [nan, nan, nan, 1]]
+    if not use_numpy:
+        values = nan_to_none(values)
+    slopes = batch.rates_of_change(values, use_numpy=use_numpy)
+    assert slopes[0] == pytest.approx(1)
+    assert math.isnan(slopes[1])
+
+
+def test_rolling_mean(use_numpy):
+    nan = float('nan')
+    means = batch.rolling_mean([[1, 2, 3, nan, 5, 6, 7]], 2, use_numpy=use_numpy)
+    expected = [nan, 1.5, 2.5, nan, nan, 5.5, 6.5]
+    assert list(means[0]) == pytest.approx(expected, nan_ok=True)
+
+
+def test_outlier_mask(use_numpy):
+    series = [20.0, 20.1, 19.9, 20.0, 20.1, 19.9, 35.0, 20.0]
+    mask = batch.outlier_mask([series], window=6, use_numpy=use_numpy)
+    assert list(mask[0]) == [False] * 6 + [True, False]
+
+
+def test_outlier_mask_skips_missing(use_numpy):
+    nan = float('nan')
+    series = [20.0, nan, 19.9, 20.0, 35.0, 20.0]
+    mask = batch.outlier_mask([series], window=3, use_numpy=use_numpy)
+    assert not any(mask[0][:5])
+
+
+def test_outlier_mask_far_from_zero(use_numpy):
+    # readings far from zero that vary by far less than their magnitude, over a long history
+    base = 1e6
+    series = [base + 0.01 * (i % 2) for i in range(1000)] + [base + 0.005, base + 1.0]
+    mask = batch.outlier_mask([series], window=12, use_numpy=use_numpy)
+    assert not any(mask[0][:1001])
+    assert mask[0][1001]
+
+
+def test_numpy_matches_python():
+    rng = np.random.default_rng(1)
+    values = 1e5 + rng.normal(0, 0.5, size=(4, 200))
+    values[:, ::37] += 20
+    expected = batch.outlier_mask(values.tolist(), use_numpy=False)
+    assert batch.outlier_mask(values, use_numpy=True).tolist() == expected
+    assert list(batch.rates_of_change(values, use_numpy=True)) == pytest.approx(
+        batch.rates_of_change(values.tolist(), use_numpy=False))
@@ -0,0 +1,52 @@
+from rpi2mqtt.binary import ReedSwitch
+from rpi2mqtt.gpio import PULL_UP
+import json
+import pytest
+import time
+
+
+@pytest.fixture
+def panel(gpio, mqtt):
+    switches = [ReedSwitch('door_{}'.format(pin), pin, 'rpi2mqtt/door_{}'.format(pin), True) for pin in (5, 6, 13)]
+    yield switches
+    ReedSwitch.banks.clear()
+
+
+def test_normally_open_switch_reads_on(panel):
+    assert [switch.state() for switch in panel] == ['ON', 'ON', 'ON']
+
+
+def test_panel_is_read_once_per_tick(panel, gpio):
+    panel[0].bank.invalidate()
+    calls = gpio.calls
+    for switch in panel:
+        switch.state()
+    assert gpio.calls == calls + 1
+    assert len(ReedSwitch.banks) == 1
+    assert ReedSwitch.banks[PULL_UP].pins == [5, 6, 13]
+
+
+def test_levels_are_read_again_once_stale(panel, gpio):
+    panel[0].state()
+    gpio.set_input(6, 0)
+    assert panel[1].state() == 'ON'
+    time.sleep(panel[0].bank.max_age * 1.5)
+    assert panel[1].state() == 'OFF'
+
+
+def test_edge_publishes_fresh_state(gpio, mqtt):
+    switch = ReedSwitch('window', 19, 'rpi2mqtt/window', True, mode='event', debounce=10)
+    try:
+        assert switch.state() == 'ON'
+        gpio.set_input(19, 0)
+        deadline = time.monotonic() + 2
+        message = None
+        while message is None and time.monotonic() < deadline:
+            message = mqtt.outbox.get(timeout=0.05)
+        assert message is not None and message.priority
+        payload = json.loads(message.payload)
+        # the levels read before the edge aren't reused
+        assert payload['state'] == 'OFF'
+        assert payload['timestamp']
+    finally:
+        ReedSwitch.banks.clear()
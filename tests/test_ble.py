@@ -0,0 +1,143 @@
+from rpi2mqtt.ble import AwayDetector, BeaconDispatcher
+import json
+import threading
+import time
+import pytest
+
+UUID = 'E2C56DB5-DFFB-48D2-B060-D0F5A71096E0'
+
+
+class Beacon(object):
+
+    def __init__(self, name, beacon_uuid, major=None, minor=None):
+        self.name = name
+        self.beacon_uuid = beacon_uuid
+        self.major = major
+        self.minor = minor
+        self.updates = []
+
+    def process_ble_update(self, bt_addr, rssi, packet, additional_info):
+        self.updates.append(rssi)
+
+
+def advertise(dispatcher, uuid, major, minor, rssi=-60):
+    dispatcher.dispatch('aa:bb:cc:dd:ee:ff', rssi, None, {'uuid': uuid, 'major': major, 'minor': minor})
+
+
+def test_dispatch_by_uuid_and_id():
+    dispatcher = BeaconDispatcher()
+    any_beacon = Beacon('any', UUID)
+    keys = Beacon('keys', UUID.lower(), 1, 7)
+    other = Beacon('other', UUID, 1, 8)
+    for sensor in (any_beacon, keys, other):
+        dispatcher.register(sensor)
+    assert len(dispatcher) == 3
+
+    advertise(dispatcher, UUID.lower(), 1, 7, -50)
+    advertise(dispatcher, UUID, 2, 1, -70)
+    assert any_beacon.updates == [-50, -70]
+    assert keys.updates == [-50]
+    assert other.updates == []
+
+
+def test_untracked_advertisements_are_counted_not_dispatched():
+    dispatcher = BeaconDispatcher()
+    keys = Beacon('keys', UUID, 1, 7)
+    dispatcher.register(keys)
+    advertise(dispatcher, '00000000-0000-0000-0000-000000000000', 1, 7)
+    dispatcher.dispatch('aa:bb:cc:dd:ee:ff', -60, None, {})
+    advertise(dispatcher, UUID, 1, 7)
+    assert (dispatcher.advertisements, dispatcher.dispatched) == (3, 1)
+    assert len(keys.updates) == 1
+
+
+class Presence(object):
+    """Sensor side of AwayDetector."""
+
+    def __init__(self, name, away_timeout):
+        self.name = name
+        self.away_timeout = away_timeout
+        self.present = 'ON'
+        self.last_seen = time.monotonic()
+        self.departed = threading.Event()
+
+    def check_away(self):
+        if self.present == 'ON' and self.last_seen + self.away_timeout <= time.monotonic():
+            self.present = 'OFF'
+            return True
+        return False
+
+    def publish_state(self, force=False, priority=False):
+        assert force and priority
+        self.departed.set()
+
+
+def test_departure_is_published_after_timeout():
+    detector = AwayDetector()
+    sensor = Presence('keys', 0.05)
+    start = time.monotonic()
+    detector.track(sensor)
+    detector.track(sensor)
+    assert len(detector) == 1
+    assert sensor.departed.wait(5)
+    assert time.monotonic() - start >= 0.05
+    assert sensor.present == 'OFF'
+    assert len(detector) == 0
+
+
+def test_advertisements_postpone_departure():
+    detector = AwayDetector()
+    sensor = Presence('keys', 0.2)
+    detector.track(sensor)
+    for _ in range(4):
+        time.sleep(0.1)
+        sensor.last_seen = time.monotonic()
+    assert not sensor.departed.is_set()
+    assert sensor.departed.wait(5)
+
+
+def test_departures_in_deadline_order():
+    detector = AwayDetector()
+    late = Presence('late', 0.3)
+    early = Presence('early', 0.05)
+    detector.track(late)
+    detector.track(early)
+    assert early.departed.wait(5)
+    assert not late.departed.is_set()
+    assert late.departed.wait(5)
+
+
+@pytest.fixture
+def scanner(mqtt):
+    from rpi2mqtt.ibeacon import Scanner
+
+    return Scanner('keys', 'rpi2mqtt/keys', UUID, away_timeout=30, major=1, minor=7, rssi_interval=60)
+
+
+def published(mqtt):
+    messages = []
+    while len(mqtt.outbox):
+        message = mqtt.outbox.get(timeout=0)
+        mqtt.outbox.sent_ok(message)
+        messages.append(json.loads(message.payload))
+    return messages
+
+
+def test_scanner_publishes_arrival_then_throttles_rssi(scanner, mqtt):
+    scanner.process_ble_update('aa:bb:cc:dd:ee:ff', -60, None, {})
+    assert published(mqtt) == [{'presence': 'ON', 'rssi': -60}]
+    scanner.process_ble_update('aa:bb:cc:dd:ee:ff', -80, None, {})
+    # smoothed and within rssi_interval
+    assert scanner.rssi == pytest.approx(-66)
+    assert published(mqtt) == []
+
+
+def test_scanner_publishes_rssi_after_interval(scanner, mqtt):
+    scanner.process_ble_update('aa:bb:cc:dd:ee:ff', -60, None, {})
+    published(mqtt)
+    scanner._published_at -= 60
+    scanner.process_ble_update('aa:bb:cc:dd:ee:ff', -60, None, {})
+    # unchanged RSSI isn't published
+    assert published(mqtt) == []
+    scanner.process_ble_update('aa:bb:cc:dd:ee:ff', -70, None, {})
+    assert published(mqtt) == [{'presence': 'ON', 'rssi': -63}]
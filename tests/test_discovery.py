@@ -0,0 +1,127 @@
+from collections import OrderedDict
+from rpi2mqtt.discovery import Discovery
+from rpi2mqtt.fakes import FakeMessageInfo
+from types import SimpleNamespace
+import json
+import pytest
+import threading
+
+
+class Unacknowledged(FakeMessageInfo):
+
+    def is_published(self):
+        return False
+
+
+class Disconnected(FakeMessageInfo):
+
+    def wait_for_publish(self, timeout=None):
+        # what paho raises for MQTT_ERR_NO_CONN
+        raise RuntimeError('The client is not currently connected.')
+
+
+@pytest.fixture
+def discovery(tmp_path, mqtt):
+    Discovery.pending = OrderedDict()
+    Discovery.setup(str(tmp_path / 'discovery.json'))
+    yield Discovery
+    Discovery.pending = OrderedDict()
+    Discovery.published = {}
+    Discovery.configs = {}
+    Discovery.force = False
+
+
+def published(mqtt, monkeypatch, info=FakeMessageInfo):
+    messages = []
+
+    def publish(topic, payload=None, qos=0, retain=False):
+        messages.append((topic, qos, retain))
+        return info(len(messages))
+    monkeypatch.setattr(mqtt.client, 'publish', publish)
+    return messages
+
+
+def test_publishes_with_qos_1_and_saves_hashes(discovery, mqtt, monkeypatch):
+    messages = published(mqtt, monkeypatch)
+    discovery.add('a/config', '{"name": "a"}')
+    discovery.add('b/config', '{"name": "b"}')
+    discovery.flush()
+    assert messages == [('a/config', 1, True), ('b/config', 1, True)]
+    with open(discovery.path) as f:
+        assert json.load(f) == {'a/config': Discovery.digest('{"name": "a"}'),
+                                'b/config': Discovery.digest('{"name": "b"}')}
+
+
+def test_unchanged_configs_are_skipped_after_restart(discovery, mqtt, monkeypatch):
+    messages = published(mqtt, monkeypatch)
+    discovery.add('a/config', '{"name": "a"}')
+    discovery.flush()
+
+    discovery.setup(discovery.path)
+    discovery.add('a/config', '{"name": "a"}')
+    discovery.add('b/config', '{"name": "b"}')
+    discovery.add('a/config', '{"name": "a"}')
+    assert list(discovery.pending) == ['b/config']
+    discovery.flush()
+    assert [topic for topic, _, _ in messages] == ['a/config', 'b/config']
+
+
+def test_changed_config_is_published(discovery, mqtt, monkeypatch):
+    published(mqtt, monkeypatch)
+    discovery.add('a/config', '{"name": "a"}')
+    discovery.flush()
+    discovery.add('a/config', '{"name": "renamed"}')
+    assert list(discovery.pending) == ['a/config']
+
+
+def test_force_publishes_unchanged_configs(discovery, mqtt, monkeypatch):
+    published(mqtt, monkeypatch)
+    discovery.add('a/config', '{"name": "a"}')
+    discovery.flush()
+    discovery.setup(discovery.path, force=True)
+    discovery.add('a/config', '{"name": "a"}')
+    assert list(discovery.pending) == ['a/config']
+
+
+@pytest.mark.parametrize('info', [Unacknowledged, Disconnected])
+def test_hashes_are_only_saved_once_acknowledged(discovery, mqtt, monkeypatch, info):
+    published(mqtt, monkeypatch, info)
+    discovery.add('a/config', '{"name": "a"}')
+    discovery.flush(timeout=0)
+    assert discovery.published == {}
+
+    discovery.setup(discovery.path)
+    discovery.add('a/config', '{"name": "a"}')
+    assert list(discovery.pending) == ['a/config']
+
+
+def test_broken_cache_publishes_everything(discovery, mqtt):
+    with open(discovery.path, 'w') as f:
+        f.write('{not json')
+    discovery.setup(discovery.path)
+    discovery.add('a/config', '{"name": "a"}')
+    assert list(discovery.pending) == ['a/config']
+
+
+def test_republish_includes_unchanged_configs(discovery, mqtt, monkeypatch):
+    messages = published(mqtt, monkeypatch)
+    discovery.add('a/config', '{"name": "a"}')
+    discovery.flush()
+    discovery.add('a/config', '{"name": "a"}')
+    assert not discovery.pending
+    discovery.republish()
+    assert [topic for topic, _, _ in messages] == ['a/config', 'a/config']
+
+
+@pytest.mark.parametrize('payload, retain, republished', [
+    (b'online', False, True),
+    # delivered on every subscribe
+    (b'online', True, False),
+    (b'offline', False, False),
+])
+def test_home_assistant_birth_republishes(discovery, mqtt, monkeypatch, payload, retain, republished):
+    calls = threading.Event()
+    monkeypatch.setattr(Discovery, 'republish', classmethod(lambda cls: calls.set()))
+    assert discovery.birth_topic in mqtt.subscribed_topics
+    discovery.on_birth(None, None, SimpleNamespace(topic='homeassistant/status', payload=payload, retain=retain))
+    assert calls.wait(1 if republished else 0.05) == republished
@@ -0,0 +1,91 @@
+from dotmap import DotMap
+from rpi2mqtt import encoding
+from rpi2mqtt.encoding import JSONEncoder, PayloadEncoder, template_keys
+import json
+import logging
+import pytest
+
+READING = {'temperature': 21.456789, 'humidity': 48.12345, 'pressure': float('nan'), 'bme280': {'temperature': 21.5}}
+
+
+def test_default_matches_stdlib():
+    assert encoding.DEFAULT.orjson is None
+    assert encoding.DEFAULT.encode(READING) == json.dumps(READING)
+
+
+def test_compact():
+    assert JSONEncoder(compact=True).encode({'a': 1, 'b': [1, 2]}) == '{"a":1,"b":[1,2]}'
+
+
+def test_orjson():
+    pytest.importorskip('orjson')
+    encoder = JSONEncoder(use_orjson=True)
+    assert encoder.orjson is not None
+    assert encoder.encode({'a': 1.5, 'b': float('nan')}) == '{"a":1.5,"b":null}'
+    # non string keys aren't supported by orjson
+    assert json.loads(encoder.encode({1: 'a'})) == {'1': 'a'}
+
+
+def test_precision_fields_exclude():
+    assert JSONEncoder(precision=1).prepare(READING)['bme280'] == {'temperature': 21.5}
+    assert JSONEncoder(precision=2).prepare(READING)['temperature'] == 21.46
+    assert list(JSONEncoder(fields=['humidity', 'temperature', 'missing']).prepare(READING)) == [
+        'humidity', 'temperature']
+    assert 'bme280' not in JSONEncoder(exclude=['bme280']).prepare(READING)
+    # not a reading
+    assert JSONEncoder(fields=['state']).prepare('online') == 'online'
+
+
+def test_from_config():
+    assert PayloadEncoder.from_config(DotMap({'name': 'a'})) is None
+    encoder = PayloadEncoder.from_config(DotMap({'name': 'a'}), {'format': 'json', 'precision': 1, 'compact': True})
+    assert (encoder.name, encoder.precision) == ('json', 1)
+    assert PayloadEncoder.from_config(DotMap({'name': 'a', 'encoding': 'json'}), {'precision': 1}).precision is None
+    with pytest.raises(ValueError):
+        PayloadEncoder.from_config(DotMap({'name': 'a', 'encoding': 'xml'}))
+
+
+@pytest.mark.parametrize('name, module', [('cbor', 'cbor2'), ('msgpack', 'msgpack')])
+def test_binary_round_trip(name, module):
+    pytest.importorskip(module)
+    encoder = PayloadEncoder.from_config(DotMap({'name': 'a', 'encoding': name}))
+    assert encoder.binary
+    assert encoder.loads(encoder.encode({'temperature': 21.5, 'state': 'on'})) == {'temperature': 21.5,
+                                                                                  'state': 'on'}
+
+
+def test_template_keys():
+    config = {'state_topic': 'climate',
+              'value_template': "{{ value_json['28-0316a2795c47'] }}",
+              'action_topic': 'climate',
+              'action_template': '{{ value_json.hvac_state }}',
+              'current_temperature_topic': 'climate',
+              'current_temperature_template': '{{ value_json.current_temperature | round(1) }}',
+              'mode_state_topic': 'other',
+              'mode_state_template': '{{ value_json.mode }}'}
+    assert template_keys(config, 'climate') == ['28-0316a2795c47', 'hvac_state', 'current_temperature']
+
+
+def test_check_templates(caplog):
+    configs = [json.dumps({'state_topic': 'climate', 'value_template': '{{ value_json.temperature }}'}),
+               json.dumps({'state_topic': 'climate', 'value_template': '{{ value_json.humidity }}'}),
+               json.dumps({'state_topic': 'other', 'value_template': '{{ value_json.pressure }}'})]
+    assert JSONEncoder().check_templates('climate', 'climate', configs) == []
+    assert JSONEncoder(exclude=['bme280']).check_templates('climate', 'climate', configs) == []
+    assert JSONEncoder(fields=['temperature', 'humidity']).check_templates('climate', 'climate', configs) == []
+    with caplog.at_level(logging.WARNING):
+        assert JSONEncoder(exclude=['humidity', 'pressure']).check_templates('climate', 'climate', configs) == [
+            'humidity']
+        assert JSONEncoder(fields=['pressure']).check_templates('climate', 'climate', configs) == [
+            'humidity', 'temperature']
+    assert 'climate drops humidity' in caplog.text
+
+
+def test_check_templates_of_sensor(mqtt):
+    from rpi2mqtt.discovery import Discovery
+    from rpi2mqtt.temperature import DHT
+
+    dht = DHT(4, 'rpi2mqtt/climate', 'climate', 'sensor', 'dht22')
+    Discovery.pending.clear()
+    encoder = JSONEncoder(fields=['temperature'])
+    assert encoder.check_templates(dht.name, dht.topic, Discovery.configs.values()) == ['humidity']
@@ -0,0 +1,18 @@
+import subprocess
+import sys
+
+IMPORTED = """
+import sys
+from rpi2mqtt import fakes
+fakes.install()
+import rpi2mqtt.event_loop
+print(' '.join(sorted(sys.modules)))
+"""
+
+
+def test_optional_services_are_not_imported():
+    # a fresh interpreter, the tests import these modules themselves
+    modules = set(subprocess.check_output([sys.executable, '-c', IMPORTED]).decode().split())
+    for module in ('rpi2mqtt.metrics', 'http.server', 'rpi2mqtt.history', 'mmap', 'cProfile', 'pstats',
+                   'rpi2mqtt.ble', 'rpi2mqtt.aggregate', 'importlib.metadata', 'rpi2mqtt.temperature'):
+        assert module not in modules
@@ -0,0 +1,157 @@
+from rpi2mqtt.history import History, RingStore
+import json
+import pytest
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'sensor.ring')
+
+
+def test_append_and_pending(path):
+    store = RingStore(path, 1024)
+    assert store.append(1.0, 'first')
+    assert store.append(2.0, b'second')
+    assert len(store) == 2
+
+    records, offset = store.pending(10)
+    assert records == [(1.0, b'first'), (2.0, b'second')]
+    store.ack(offset)
+    assert len(store) == 0
+    assert store.pending(10) == ([], offset)
+
+
+def test_payloads_larger_than_the_old_slots(path):
+    # HestiaPi publishes about 400 bytes including the nested bme280 reading
+    payload = json.dumps({'bme280': {'temperature': 70.123456, 'humidity': 45.6789, 'pressure': 1013.25},
+                          'mode': 'heat', 'hvac_state': 'heating', 'padding': 'x' * 300})
+    store = RingStore(path, 4096)
+    assert store.append(1.0, payload)
+    assert store.pending(1)[0] == [(1.0, payload.encode('utf-8'))]
+
+
+def test_payload_larger_than_the_ring_is_refused(path):
+    store = RingStore(path, 64)
+    assert not store.append(1.0, 'x' * 64)
+    assert len(store) == 0
+
+
+def test_full_ring_overwrites_oldest(path):
+    # every record takes 12 + 10 bytes, 4 fit
+    store = RingStore(path, 90)
+    for i in range(6):
+        assert store.append(float(i), '{:010d}'.format(i))
+    assert len(store) == 4
+    assert store.overwritten == 2
+    records, _ = store.pending(10)
+    assert [timestamp for timestamp, _ in records] == [2.0, 3.0, 4.0, 5.0]
+
+
+def test_records_wrap_around_the_end(path):
+    store = RingStore(path, 100)
+    for i in range(20):
+        payload = 'reading-{}'.format(i) * (i % 3 + 1)
+        store.append(float(i), payload)
+        records, offset = store.pending(1)
+        assert records == [(float(i), payload.encode('utf-8'))]
+        store.ack(offset)
+
+
+def test_pending_in_batches(path):
+    store = RingStore(path, 1024)
+    for i in range(5):
+        store.append(float(i), str(i))
+    records, offset = store.pending(2)
+    assert [p for _, p in records] == [b'0', b'1']
+    store.ack(offset)
+    records, offset = store.pending(10)
+    assert [p for _, p in records] == [b'2', b'3', b'4']
+
+
+def test_ack_after_overwrite(path):
+    store = RingStore(path, 90)
+    for i in range(4):
+        store.append(float(i), '{:010d}'.format(i))
+    records, offset = store.pending(2)
+    # the ring overwrites the records being backfilled meanwhile
+    for i in range(4, 7):
+        store.append(float(i), '{:010d}'.format(i))
+    store.ack(offset)
+    assert [t for t, _ in store.pending(10)[0]] == [3.0, 4.0, 5.0, 6.0]
+
+
+def test_restart_recovery(path):
+    store = RingStore(path, 1024)
+    for i in range(3):
+        store.append(float(i), 'reading {}'.format(i))
+    records, offset = store.pending(1)
+    store.ack(offset)
+    store.close()
+
+    store = RingStore(path, 1024)
+    assert len(store) == 2
+    assert store.pending(10)[0] == [(1.0, b'reading 1'), (2.0, b'reading 2')]
+    store.append(3.0, 'reading 3')
+    assert len(store) == 3
+
+
+def test_different_layout_is_discarded(path):
+    store = RingStore(path, 1024)
+    store.append(1.0, 'reading')
+    store.close()
+
+    store = RingStore(path, 2048)
+    assert len(store) == 0
+    assert store.pending(10)[0] == []
+
+
+def test_corrupt_header_is_discarded(path):
+    store = RingStore(path, 1024)
+    store.append(1.0, 'reading')
+    store.records = 5
+    store._write_header()
+    store.close()
+
+    assert len(RingStore(path, 1024)) == 0
+
+
+def test_batch_payload():
+    # the second reading was recorded before the sensor switched to msgpack
+    msgpack = b'\x81\xa5state\xa2ON'
+    payload = History.batch_payload([(1.0, b'{"state": "ON"}'), (2.0, msgpack)])
+    assert json.loads(payload) == [{'timestamp': 1.0, 'state': {'state': 'ON'}},
+                                   {'timestamp': 2.0, 'state': msgpack.decode('utf-8', 'replace')}]
+
+
+@pytest.fixture
+def history(mqtt, tmp_path):
+    History.setup({'path': str(tmp_path), 'size': 4096})
+    History.register('rpi2mqtt/test', 'test')
+    yield History
+    History.close()
+    History.config = None
+    mqtt.connect_listeners.remove(History.backfill)
+
+
+def pending(history):
+    records, _ = history.stores['rpi2mqtt/test'].pending(10)
+    return [payload for _, payload in records]
+
+
+def test_readings_lost_while_disconnected_are_recorded(history, mqtt):
+    mqtt.connected = False
+    mqtt.outbox.maxsize = 1
+    mqtt.publish('rpi2mqtt/test', '{"state": "ON"}')
+    # drops the queued reading
+    mqtt.publish('rpi2mqtt/other', '{"state": "OFF"}')
+    mqtt.publish('rpi2mqtt/test', '{"state": "OFF"}')
+    # conflates it
+    mqtt.publish('rpi2mqtt/test', '{"state": "ON"}')
+    assert pending(history) == [b'{"state": "ON"}', b'{"state": "OFF"}']
+
+
+def test_readings_conflated_while_connected_are_not_recorded(history, mqtt):
+    mqtt.publish('rpi2mqtt/test', '{"state": "ON"}')
+    mqtt.publish('rpi2mqtt/test', '{"state": "OFF"}')
+    assert mqtt.outbox.conflated == 1
+    assert pending(history) == []
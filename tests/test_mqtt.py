@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+
+
+def test_resubscribe_only_unacked_with_session(mqtt):
+    mqtt.subscribe('a/set', None)
+    mqtt.subscribe('b/set', None)
+    mid = mqtt.subscribed_topics['a/set'].mid
+    mqtt.on_subscribe(mqtt.client, None, mid, (1,))
+    assert mqtt.subscribed_topics['a/set'].acked
+    assert not mqtt.subscribed_topics['b/set'].acked
+
+    subscribed = []
+    subscribe = mqtt.client.subscribe
+    mqtt.client.subscribe = lambda topic, qos=0: subscribed.append(topic) or subscribe(topic, qos)
+    mqtt.resubscribe(session_present=True)
+    assert subscribed == ['b/set']
+    mqtt.resubscribe(session_present=False)
+    assert subscribed == ['b/set', 'a/set', 'b/set']
+
+
+def test_rejected_subscription_stays_unacked(mqtt):
+    mqtt.subscribe('a/set', None)
+    mqtt.on_subscribe(mqtt.client, None, mqtt.subscribed_topics['a/set'].mid, (0x80,))
+    assert not mqtt.subscribed_topics['a/set'].acked
+
+
+def test_subscribe_while_resubscribing(mqtt):
+    from rpi2mqtt.mqtt import Subscription
+
+    class Racing(Subscription):
+        @property
+        def acked(self):
+            # another thread subscribing while on_connect restores subscriptions
+            if 'b/set' not in mqtt.subscribed_topics:
+                mqtt.subscribe('b/set', None)
+            return True
+
+        @acked.setter
+        def acked(self, value):
+            pass
+
+    mqtt.subscribed_topics['a/set'] = Racing('a/set', None)
+    mqtt.resubscribe(session_present=True)
+    assert set(mqtt.subscribed_topics) == {'a/set', 'b/set'}
+
+
+def test_command_ignores_probes_and_clears_retained(mqtt):
+    calls = []
+
+    @mqtt.command
+    def callback(self, client, userdata, message):
+        calls.append(message.payload)
+
+    callback(None, None, None, SimpleNamespace(topic='a/set', payload=b'ping', retain=True))
+    callback(None, None, None, SimpleNamespace(topic='a/set', payload=b'', retain=False))
+    callback(None, None, None, SimpleNamespace(topic='a/set', payload=b'ON', retain=False))
+    assert calls == [b'ON']
+    message = mqtt.outbox.get(timeout=0)
+    assert (message.topic, message.payload) == ('a/set', '')
+
+
+def test_last_will_marks_device_offline(monkeypatch):
+    from dotmap import DotMap
+    from rpi2mqtt import mqtt as module
+    from rpi2mqtt.fakes import FakeClient
+
+    class Client(FakeClient):
+
+        def __init__(self, client_id=None, clean_session=None):
+            super(Client, self).__init__()
+            self.clean_session = clean_session
+            self.calls = []
+            self.will = None
+
+        def will_set(self, topic, payload=None, qos=0, retain=False):
+            self.will = (topic, payload, qos, retain)
+
+        def connect(self, host, port=1883, keepalive=60):
+            # the will is part of CONNECT
+            self.calls.append(('connect', self.will))
+
+        def publish(self, topic, payload=None, qos=0, retain=False):
+            self.calls.append(('publish', topic, payload, qos, retain))
+            return super(Client, self).publish(topic, payload, qos, retain)
+
+        def __getattr__(self, name):
+            # tls_set, username_pw_set, reconnect_delay_set, loop_start
+            return lambda *args, **kwargs: None
+
+    config = DotMap({'mqtt': {'host': 'broker', 'port': 8883, 'ca_cert': None, 'status_topic': 'rpi2mqtt/pi/status'}})
+    monkeypatch.setattr(module, 'Client', Client)
+    monkeypatch.setattr(module.Config, 'get_instance', staticmethod(lambda: config))
+    monkeypatch.setattr(module.MQTT, '_publisher', classmethod(lambda cls: None))
+    monkeypatch.setattr(module.MQTT, 'connect_listeners', [])
+    try:
+        module.MQTT.setup()
+        client = module.MQTT.client
+        assert client.calls == [('connect', ('rpi2mqtt/pi/status', 'offline', 1, True))]
+        # the broker must not queue commands for us while we're away
+        assert client.clean_session is True
+        module.MQTT.on_connect(client, None, {'session present': 0}, 0)
+        assert client.calls[-1] == ('publish', 'rpi2mqtt/pi/status', 'online', 1, True)
+    finally:
+        module.MQTT.connected = False
+        module.MQTT.status_topic = None
+
+
+def test_discovery_uses_device_availability(mqtt, monkeypatch):
+    from rpi2mqtt.base import Sensor
+    from rpi2mqtt.discovery import Discovery
+
+    monkeypatch.setattr(mqtt, 'status_topic', 'rpi2mqtt/pi/status')
+    sensor = Sensor('door', None, 'rpi2mqtt/door', 'door', 'test')
+    Discovery.pending.clear()
+    config = sensor.homeassistant_mqtt_config
+    assert config['availability'] == [{'topic': 'rpi2mqtt/door/availability'}, {'topic': 'rpi2mqtt/pi/status'}]
+    assert config['availability_mode'] == 'all'
+    assert 'availability_topic' not in config
@@ -0,0 +1,119 @@
+from rpi2mqtt.outbox import Message, Outbox, RetryPolicy
+
+
+def drain(outbox):
+    messages = []
+    while len(outbox):
+        message = outbox.get(timeout=0)
+        outbox.sent_ok(message)
+        messages.append((message.topic, message.payload))
+    return messages
+
+
+def test_conflates_per_topic():
+    outbox = Outbox()
+    outbox.put('a', '1')
+    outbox.put('b', '1')
+    outbox.put('a', '2')
+    assert len(outbox) == 2
+    assert outbox.conflated == 1
+    assert drain(outbox) == [('a', '2'), ('b', '1')]
+
+
+def test_priority_before_telemetry():
+    outbox = Outbox()
+    outbox.put('telemetry', '1')
+    outbox.put('ack', 'ON', priority=True)
+    assert drain(outbox) == [('ack', 'ON'), ('telemetry', '1')]
+
+
+def test_priority_replaces_queued_telemetry():
+    outbox = Outbox()
+    outbox.put('switch', 'OFF')
+    outbox.put('other', '1')
+    outbox.put('switch', 'ON', priority=True)
+    assert len(outbox) == 2
+    assert outbox.conflated == 1
+    # the stale telemetry payload doesn't follow the ack and overwrite the retained state
+    assert drain(outbox) == [('switch', 'ON'), ('other', '1')]
+
+
+def test_telemetry_replaces_queued_priority():
+    outbox = Outbox()
+    outbox.put('other', '1')
+    outbox.put('switch', 'ON', priority=True)
+    outbox.put('switch', 'OFF')
+    assert drain(outbox) == [('switch', 'OFF'), ('other', '1')]
+
+
+def test_full_queue_drops_oldest_telemetry():
+    lost = []
+    outbox = Outbox(maxsize=2)
+    outbox.on_lost = lambda topic, payload, timestamp: lost.append((topic, payload))
+    outbox.put('ack', 'ON', priority=True)
+    outbox.put('a', '1')
+    outbox.put('b', '1')
+    assert outbox.dropped == 1
+    assert lost == [('a', '1')]
+    assert drain(outbox) == [('ack', 'ON'), ('b', '1')]
+
+
+def test_full_queue_drops_priority_last():
+    outbox = Outbox(maxsize=2)
+    outbox.put('ack1', 'ON', priority=True)
+    outbox.put('ack2', 'ON', priority=True)
+    outbox.put('ack3', 'ON', priority=True)
+    assert drain(outbox) == [('ack2', 'ON'), ('ack3', 'ON')]
+
+
+def test_conflated_payload_is_lost():
+    lost = []
+    outbox = Outbox()
+    outbox.on_lost = lambda topic, payload, timestamp: lost.append((topic, payload))
+    outbox.put('a', '1')
+    outbox.put('a', '2', priority=True)
+    assert lost == [('a', '1')]
+
+
+def test_requeue_goes_first_unless_superseded():
+    outbox = Outbox()
+    outbox.put('a', '1')
+    outbox.put('b', '1')
+    message = outbox.get(timeout=0)
+    outbox.requeue(message)
+    assert outbox.retried == 1
+    assert drain(outbox) == [('a', '1'), ('b', '1')]
+
+    outbox.put('a', '1')
+    message = outbox.get(timeout=0)
+    outbox.put('a', '2', priority=True)
+    outbox.requeue(message)
+    assert outbox.conflated == 1
+    assert drain(outbox) == [('a', '2')]
+
+
+def test_join_waits_for_inflight():
+    outbox = Outbox()
+    outbox.put('a', '1')
+    message = outbox.get(timeout=0)
+    assert not outbox.join(timeout=0)
+    outbox.sent_ok(message)
+    assert outbox.join(timeout=0)
+    assert outbox.stats()['sent'] == 1
+
+
+def test_get_times_out():
+    assert Outbox().get(timeout=0) is None
+
+
+def test_retry_policy_backoff():
+    policy = RetryPolicy(retries=3, backoff=0.5, max_backoff=1.5)
+    message = Message('a', '1')
+    message.attempts = 1
+    assert policy.should_retry(message)
+    assert policy.delay(message) == 0.5
+    message.attempts = 2
+    assert policy.delay(message) == 1.0
+    message.attempts = 3
+    assert policy.delay(message) == 1.5
+    assert not policy.should_retry(message)
@@ -0,0 +1,89 @@
+from rpi2mqtt.profiling import Profiler, span
+from types import SimpleNamespace
+import os
+import pytest
+import signal
+import threading
+import time
+
+
+@pytest.fixture
+def profiler(tmp_path):
+    Profiler.config = {'path': str(tmp_path), 'duration': 0.05, 'interval': 0.001}
+    yield Profiler
+    Profiler.stop()
+    Profiler.config = None
+
+
+def command(profiler, payload):
+    profiler.command(profiler, None, None, SimpleNamespace(payload=payload.encode(), topic='profile'))
+
+
+def wait(profiler, timeout=5):
+    deadline = time.monotonic() + timeout
+    while profiler.session is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert profiler.session is None
+
+
+@pytest.mark.parametrize('payload', ['{"duration": "x"}', '{"duration": -1}', '{"duration": "nan"}',
+                                     '{"mode": "unknown"}', '[1, 2]', '{"duration": [1]}'])
+def test_invalid_commands_are_ignored(profiler, payload):
+    command(profiler, payload)
+    assert profiler.session is None
+
+
+def test_unwritable_path(profiler, tmp_path):
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    profiler.config['path'] = str(blocker / 'profiles')
+    command(profiler, 'sample')
+    assert profiler.session is None
+
+
+def test_sampling_session_writes_collapsed_stacks(profiler, tmp_path):
+    command(profiler, '{"mode": "sample", "duration": 0.05}')
+    session = profiler.session
+    assert session is not None
+    with span('read', 'test'):
+        time.sleep(0.1)
+    wait(profiler)
+    assert os.path.exists(session.filename)
+    assert session.samples > 0
+
+
+def test_only_one_session(profiler):
+    assert profiler.start('sample', 1) is not None
+    assert profiler.start('sample', 1) is None
+    command(profiler, 'stop')
+    wait(profiler)
+
+
+def test_signal_handler_defers_to_a_thread(profiler, monkeypatch):
+    started = []
+    done = threading.Event()
+
+    def start(mode=None, duration=None):
+        # blocks until the handler returned if it ran inline
+        with Profiler._lock:
+            started.append(threading.current_thread())
+        done.set()
+    monkeypatch.setattr(Profiler, 'start', start)
+    with Profiler._lock:
+        profiler.on_signal(signal.SIGUSR2, None)
+        assert not started
+    assert done.wait(5)
+    assert started[0] is not threading.main_thread()
+
+
+def test_second_signal_stops(profiler):
+    profiler.config['duration'] = 5
+    profiler.on_signal(signal.SIGUSR2, None)
+    deadline = time.monotonic() + 5
+    while profiler.session is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    session = profiler.session
+    assert session is not None
+    profiler.on_signal(signal.SIGUSR2, None)
+    assert session.stopped.wait(5)
+    wait(profiler)
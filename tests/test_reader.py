@@ -0,0 +1,74 @@
+from rpi2mqtt.reader import SensorReader
+from rpi2mqtt.scheduler import Scheduler
+import threading
+import time
+
+
+class Probe(object):
+
+    def __init__(self, name, release=None):
+        self.name = name
+        self.availability_topic = 'rpi2mqtt/{}/availability'.format(name)
+        self.release = release
+        self.reads = 0
+
+    def callback(self):
+        if self.release is not None:
+            self.release.wait(5)
+        self.reads += 1
+
+
+def run_until(scheduler, condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        scheduler.run_pending()
+        time.sleep(0.01)
+
+
+def test_deadline_counts_from_start_of_read(mqtt):
+    scheduler = Scheduler()
+    reader = SensorReader(scheduler, workers=1)
+    release = threading.Event()
+    hung, healthy = Probe('hung', release), Probe('healthy')
+    for probe in (hung, healthy):
+        reader.register(probe.name)
+    try:
+        reader.submit('hung', hung, 0.1)
+        reader.submit('healthy', healthy, 0.1)
+        run_until(scheduler, lambda: reader.stats['hung'].timeouts)
+        # queued behind the hung read for longer than its own timeout
+        time.sleep(0.15)
+        scheduler.run_pending()
+        assert reader.stats['hung'].timeouts == 1
+        assert reader.stats['healthy'].timeouts == 0
+
+        release.set()
+        run_until(scheduler, lambda: healthy.reads and not len(scheduler))
+        assert reader.stats['healthy'].timeouts == 0
+        assert reader.stale == set()
+    finally:
+        release.set()
+        reader.shutdown()
+
+
+def test_read_missing_its_deadline_is_stale(mqtt):
+    scheduler = Scheduler()
+    reader = SensorReader(scheduler, workers=2)
+    release = threading.Event()
+    hung = Probe('hung', release)
+    reader.register('hung')
+    try:
+        reader.submit('hung', hung, 0.05)
+        # still running, not submitted again
+        assert reader.submit('hung', hung, 0.05) is None
+        run_until(scheduler, lambda: reader.stats['hung'].timeouts)
+        assert 'hung' in reader.stale
+        messages = []
+        while len(mqtt.outbox):
+            message = mqtt.outbox.get(timeout=0)
+            mqtt.outbox.sent_ok(message)
+            messages.append((message.topic, message.payload))
+        assert messages == [('rpi2mqtt/hung/availability', 'offline')]
+    finally:
+        release.set()
+        reader.shutdown()
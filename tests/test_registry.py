@@ -0,0 +1,91 @@
+from dotmap import DotMap
+from rpi2mqtt.registry import Registry
+import importlib.metadata
+import sys
+import pytest
+
+PLUGIN = '''
+class Plugin(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    @classmethod
+    def from_config(cls, sensor, args):
+        return cls(sensor.name)
+'''
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(Registry, 'types', dict(Registry.types))
+    monkeypatch.setattr(Registry, '_entry_points_loaded', False)
+    return Registry
+
+
+@pytest.fixture
+def plugin(tmp_path, monkeypatch):
+    (tmp_path / 'rpi2mqtt_test_plugin.py').write_text(PLUGIN)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield 'rpi2mqtt_test_plugin:Plugin'
+    sys.modules.pop('rpi2mqtt_test_plugin', None)
+
+
+class EntryPoint(object):
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+
+class EntryPoints(list):
+
+    def select(self, group):
+        return [ep for ep, ep_group in self if ep_group == group]
+
+
+def test_import_path_is_loaded_on_first_use(plugin):
+    Registry.register('plugin', plugin)
+    assert 'rpi2mqtt_test_plugin' not in sys.modules
+    sensor = Registry.create(DotMap({'type': 'plugin', 'name': 'kitchen'}), None)
+    assert sensor.name == 'kitchen'
+    assert 'rpi2mqtt_test_plugin' in sys.modules
+    assert Registry.types['plugin'] is type(sensor)
+
+
+def test_register_class():
+
+    class Fake(object):
+
+        @classmethod
+        def from_config(cls, sensor, args):
+            return (sensor.name, args)
+
+    Registry.register('fake', Fake)
+    assert Registry.load('fake') is Fake
+    assert Registry.create(DotMap({'type': 'fake', 'name': 'a'}), 'args') == ('a', 'args')
+
+
+def test_unknown_type(monkeypatch):
+    calls = []
+    monkeypatch.setattr(Registry, 'load_entry_points', classmethod(lambda cls: calls.append(cls)))
+    assert Registry.create(DotMap({'type': 'sht31', 'name': 'a'}), None) is None
+    assert len(calls) == 1
+
+
+def test_built_in_types_skip_entry_points(monkeypatch):
+    monkeypatch.setattr(Registry, 'load_entry_points', classmethod(lambda cls: pytest.fail('scanned entry points')))
+    Registry.register('reed', object)
+    assert Registry.load('reed') is object
+
+
+def test_entry_points(plugin, monkeypatch):
+    eps = EntryPoints([(EntryPoint('plugin', plugin), Registry.ENTRY_POINT_GROUP),
+                       (EntryPoint('reed', plugin), Registry.ENTRY_POINT_GROUP),
+                       (EntryPoint('other', plugin), 'console_scripts')])
+    monkeypatch.setattr(importlib.metadata, 'entry_points', lambda: eps)
+    assert Registry.load('plugin').__name__ == 'Plugin'
+    # built in types can't be replaced
+    assert Registry.types['reed'] != plugin
+    assert 'other' not in Registry.types
+    assert Registry.load('missing') is None
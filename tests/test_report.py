@@ -0,0 +1,75 @@
+from rpi2mqtt.report import ReportPolicy, flatten
+from dotmap import DotMap
+import time
+
+
+def test_flatten():
+    assert flatten({'a': 1, 'b': {'c': 2, 'd': {'e': 3}}}) == {'a': 1, 'b.c': 2, 'b.d.e': 3}
+
+
+def test_first_reading_is_published():
+    assert ReportPolicy({'temperature': 0.5}).should_publish({'temperature': 70.0})
+
+
+def test_absolute_deadband():
+    policy = ReportPolicy({'temperature': 0.5})
+    policy.should_publish({'temperature': 70.0})
+    assert not policy.should_publish({'temperature': 70.4})
+    assert not policy.should_publish({'temperature': 69.6})
+    assert policy.should_publish({'temperature': 70.6})
+    # compared against the last published reading, not the last reading
+    assert not policy.should_publish({'temperature': 71.0})
+
+
+def test_relative_deadband():
+    policy = ReportPolicy({'humidity': '2%'})
+    policy.should_publish({'humidity': 50.0})
+    assert not policy.should_publish({'humidity': 50.9})
+    assert policy.should_publish({'humidity': 51.1})
+
+
+def test_fields_without_deadband_publish_on_change():
+    policy = ReportPolicy({'temperature': 0.5})
+    policy.should_publish({'temperature': 70.0, 'mode': 'heat'})
+    assert not policy.should_publish({'temperature': 70.0, 'mode': 'heat'})
+    assert policy.should_publish({'temperature': 70.0, 'mode': 'cool'})
+
+
+def test_nested_fields_use_the_leaf_deadband():
+    policy = ReportPolicy({'temperature': 0.5})
+    policy.should_publish({'bme280': {'temperature': 70.0}})
+    assert not policy.should_publish({'bme280': {'temperature': 70.2}})
+    assert policy.should_publish({'bme280': {'temperature': 71.0}})
+
+
+def test_ignored_fields():
+    policy = ReportPolicy()
+    policy.should_publish({'state': 'ON', 'timestamp': '1', 'window': {'state': {'count': 1}}})
+    assert not policy.should_publish({'state': 'ON', 'timestamp': '2', 'window': {'state': {'count': 2}}})
+
+
+def test_changed_fields_publish():
+    policy = ReportPolicy({'temperature': 0.5})
+    policy.should_publish({'temperature': 70.0})
+    assert policy.should_publish({'temperature': 70.0, 'humidity': 40.0})
+
+
+def test_heartbeat():
+    policy = ReportPolicy({'temperature': 0.5}, heartbeat=0.05)
+    policy.should_publish({'temperature': 70.0})
+    assert not policy.should_publish({'temperature': 70.0})
+    time.sleep(0.06)
+    assert policy.should_publish({'temperature': 70.0})
+
+
+def test_force():
+    policy = ReportPolicy({'temperature': 0.5})
+    policy.should_publish({'temperature': 70.0})
+    assert policy.should_publish({'temperature': 70.0}, force=True)
+
+
+def test_from_config():
+    assert ReportPolicy.from_config(DotMap({'name': 'a'})) is None
+    policy = ReportPolicy.from_config(DotMap({'name': 'a', 'deadband': {'temperature': 0.5}}), heartbeat=600)
+    assert policy.deadbands == {'temperature': (0.5, False)}
+    assert policy.heartbeat == 600
@@ -0,0 +1,139 @@
+from rpi2mqtt.scheduler import Scheduler
+import threading
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.values = []
+
+    def observe(self, value):
+        self.values.append(value)
+
+
+def test_jobs_run_at_their_own_interval():
+    clock = Clock()
+    scheduler = Scheduler(clock)
+    runs = []
+    scheduler.add('fast', lambda: runs.append('fast'), 5)
+    scheduler.add('slow', lambda: runs.append('slow'), 15, offset=1)
+    for _ in range(30):
+        scheduler.run_pending()
+        clock.now += 1
+    assert runs.count('fast') == 6
+    assert runs.count('slow') == 2
+    assert runs[:2] == ['fast', 'slow']
+
+
+def test_returns_seconds_until_next_deadline():
+    clock = Clock()
+    scheduler = Scheduler(clock)
+    assert scheduler.run_pending() is None
+    scheduler.add('job', lambda: None, 10, offset=3)
+    assert scheduler.run_pending() == 3
+    clock.now += 3
+    assert scheduler.run_pending() == 10
+
+
+def test_slow_callbacks_do_not_drift():
+    clock = Clock()
+    scheduler = Scheduler(clock)
+    started = []
+
+    def slow():
+        started.append(clock.now)
+        clock.now += 2
+
+    job = scheduler.add('slow', slow, 10)
+    for _ in range(3):
+        scheduler.run_pending()
+        clock.now = job.deadline
+    assert started == [1000, 1010, 1020]
+
+
+def test_missed_runs_are_skipped():
+    clock = Clock()
+    scheduler = Scheduler(clock)
+    runs = []
+    job = scheduler.add('job', lambda: runs.append(clock.now), 10)
+    scheduler.run_pending()
+    clock.now += 35
+    scheduler.run_pending()
+    assert runs == [1000, 1035]
+    assert job.last_lag == 25
+    # back on the original grid
+    assert job.deadline == 1040
+
+
+def test_call_later_runs_once():
+    clock = Clock()
+    scheduler = Scheduler(clock)
+    runs = []
+    scheduler.call_later(5, 'once', lambda: runs.append(clock.now))
+    for _ in range(20):
+        scheduler.run_pending()
+        clock.now += 1
+    assert runs == [1005]
+    assert len(scheduler) == 0
+
+
+def test_failing_job_is_rescheduled():
+    clock = Clock()
+    scheduler = Scheduler(clock)
+    runs = []
+
+    def fail():
+        runs.append(clock.now)
+        raise RuntimeError('sensor unplugged')
+
+    scheduler.add('fail', fail, 10)
+    scheduler.run_pending()
+    clock.now += 10
+    scheduler.run_pending()
+    assert runs == [1000, 1010]
+
+
+def test_jitter_stays_within_bounds():
+    clock = Clock()
+    scheduler = Scheduler(clock)
+    job = scheduler.add('job', lambda: None, 10, jitter=2)
+    for run in range(1, 20):
+        clock.now = job.deadline
+        scheduler.run_pending()
+        assert 1000 + run * 10 <= job.deadline <= 1000 + run * 10 + 2
+
+
+def test_histograms():
+    clock = Clock()
+    scheduler = Scheduler(clock)
+    scheduler.iteration_histogram = Histogram()
+    scheduler.lag_histogram = Histogram()
+    scheduler.add('job', lambda: None, 10)
+    scheduler.run_pending()
+    clock.now += 12
+    scheduler.run_pending()
+    scheduler.run_pending()
+    assert scheduler.lag_histogram.values == [0, 2]
+    # iterations without a due job aren't observed
+    assert len(scheduler.iteration_histogram.values) == 2
+
+
+def test_stop():
+    scheduler = Scheduler()
+    ran = threading.Event()
+    scheduler.add('job', ran.set, 0.01)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    assert ran.wait(5)
+    scheduler.stop()
+    thread.join(5)
+    assert not thread.is_alive()
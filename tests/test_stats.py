@@ -0,0 +1,147 @@
+from dotmap import DotMap
+from rpi2mqtt.discovery import Discovery
+from rpi2mqtt.stats import RingBuffer, StreamingStats
+from types import SimpleNamespace
+import pytest
+
+
+def test_ring_buffer_evicts_oldest():
+    buffer = RingBuffer(3)
+    assert [buffer.append(i) for i in range(5)] == [None, None, None, 0, 1]
+    assert list(buffer) == [2, 3, 4]
+    assert buffer[-1] == 4
+    with pytest.raises(IndexError):
+        buffer[3]
+
+
+@pytest.fixture(params=[False, True], ids=['direct', 'incremental'])
+def stats(request, monkeypatch):
+    if request.param:
+        monkeypatch.setattr(StreamingStats, 'INCREMENTAL_CAPACITY', 1)
+    stats = StreamingStats(4)
+    assert stats.incremental == request.param
+    return stats
+
+
+def test_window(stats):
+    for i, value in enumerate([5, 1, 4, 2, 3, 6]):
+        stats.append(value, i * 60.0)
+    assert stats.values() == [4, 2, 3, 6]
+    assert stats.mean == 3.75
+    assert stats.min == 2
+    assert stats.max == 6
+
+
+def test_slope(stats):
+    assert stats.slope is None
+    stats.append(20.0, 0.0)
+    assert stats.slope is None
+    for i in range(1, 10):
+        stats.append(20.0 + 0.5 * i, i * 300.0)
+    assert stats.slope == pytest.approx(0.5 / 300)
+
+
+def test_slope_needs_distinct_timestamps(stats):
+    stats.append(20.0, 10.0)
+    stats.append(21.0, 10.0)
+    assert stats.slope is None
+
+
+def test_slope_of_monotonic_timestamps(stats):
+    # days of uptime, the slope is taken relative to the oldest sample
+    start = 3e6 + 0.123
+    for i in range(50):
+        stats.append(70.0 + 0.01 * i, start + i * 300.0)
+    assert stats.slope == pytest.approx(0.01 / 300, rel=1e-9)
+
+
+def test_ewma_and_clear(stats):
+    stats.append(10.0, 0)
+    stats.append(20.0, 1)
+    assert stats.ewma == pytest.approx(13.0)
+    stats.clear()
+    assert len(stats) == 0
+    assert stats.ewma is None
+    assert stats.mean is None and stats.min is None and stats.slope is None
+
+
+def test_incremental_matches_direct(monkeypatch):
+    direct = StreamingStats(8)
+    monkeypatch.setattr(StreamingStats, 'INCREMENTAL_CAPACITY', 1)
+    incremental = StreamingStats(8)
+    for i in range(200):
+        value = 60 + (i * 7919 % 101) / 10.0
+        direct.append(value, i * 13.0)
+        incremental.append(value, i * 13.0)
+        assert incremental.slope == pytest.approx(direct.slope, rel=1e-9, abs=1e-12)
+        assert (incremental.mean, incremental.min, incremental.max, incremental.ewma) == pytest.approx(
+            (direct.mean, direct.min, direct.max, direct.ewma))
+
+
+@pytest.fixture
+def hestiapi(mqtt, gpio):
+    from rpi2mqtt.thermostat import HestiaPi
+
+    thermostat = HestiaPi('thermostat', 'rpi2mqtt/thermostat', 68, 76, dry_run=True)
+    Discovery.pending.clear()
+    return thermostat
+
+
+@pytest.mark.parametrize('rate, boost', [
+    (None, False),
+    # identical readings, e.g. right after the heat came on
+    (0, False),
+    (0.0, False),
+    (-0.05, True),
+    (0.005, True),
+    (0.01, True),
+    (0.02, False),
+])
+def test_heat_boost(hestiapi, rate, boost):
+    assert hestiapi.needs_heat_boost(rate) == boost
+
+
+def test_no_heat_boost_outside_heat_mode(hestiapi):
+    hestiapi.mode = 'cool'
+    assert not hestiapi.needs_heat_boost(-0.05)
+
+
+def test_heat_boost_from_history(hestiapi):
+    # 0.025 degrees per 5 minutes is 0.005 per minute
+    for i in range(4):
+        hestiapi.temperature_history.append(66.0 + 0.025 * i, i * 300.0)
+    assert hestiapi.temperature_rate_of_change == pytest.approx(0.005)
+    assert hestiapi.needs_heat_boost(hestiapi.temperature_rate_of_change)
+
+    hestiapi.temperature_history.clear()
+    for i in range(4):
+        hestiapi.temperature_history.append(66.0, i * 300.0)
+    assert not hestiapi.needs_heat_boost(hestiapi.temperature_rate_of_change)
+
+
+def test_heat_boost_threshold_follows_interval(mqtt, gpio):
+    from rpi2mqtt.thermostat import HestiaPi
+
+    thermostat = HestiaPi('thermostat', 'rpi2mqtt/thermostat', 68, 76, dry_run=True, interval=60)
+    Discovery.pending.clear()
+    # 0.05 degrees per reading, once a minute
+    assert thermostat.minimum_temp_rate_of_change == pytest.approx(0.05)
+    for i in range(4):
+        thermostat.temperature_history.append(66.0 + 0.04 * i, i * 60.0)
+    assert thermostat.needs_heat_boost(thermostat.temperature_rate_of_change)
+
+    thermostat.temperature_history.clear()
+    for i in range(4):
+        thermostat.temperature_history.append(66.0 + 0.06 * i, i * 60.0)
+    assert not thermostat.needs_heat_boost(thermostat.temperature_rate_of_change)
+
+
+def test_heat_boost_settings_from_config(mqtt, gpio):
+    from rpi2mqtt.thermostat import HestiaPi
+
+    sensor = DotMap({'name': 'thermostat', 'topic': 'rpi2mqtt/thermostat', 'heat_setpoint': 68, 'cool_setpoint': 76,
+                     'interval': 120, 'min_rate_of_change': 0.1})
+    thermostat = HestiaPi.from_config(sensor, SimpleNamespace(dry_run=True))
+    Discovery.pending.clear()
+    assert (thermostat.interval, thermostat.min_rate_of_change) == (120, 0.1)
+    assert thermostat.minimum_temp_rate_of_change == pytest.approx(0.05)
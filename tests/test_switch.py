@@ -0,0 +1,44 @@
+from rpi2mqtt.aggregate import WindowAggregator
+from rpi2mqtt.discovery import Discovery
+from rpi2mqtt.switch import Switch
+from types import SimpleNamespace
+import json
+import pytest
+
+
+def published(mqtt):
+    messages = []
+    while len(mqtt.outbox):
+        message = mqtt.outbox.get(timeout=0)
+        mqtt.outbox.sent_ok(message)
+        messages.append(json.loads(message.payload))
+    return messages
+
+
+def command(payload):
+    return SimpleNamespace(payload=payload.encode(), topic='rpi2mqtt/switch/set', retain=False)
+
+
+@pytest.fixture
+def switch(gpio, mqtt):
+    switch = Switch('switch', 21, 'rpi2mqtt/switch')
+    Discovery.pending.clear()
+    return switch
+
+
+def test_command_acks_new_state(switch, mqtt):
+    switch.mqtt_callback(None, None, command('ON'))
+    assert published(mqtt) == [{'power_state': 'ON'}]
+
+
+def test_sampling_switch_acks_new_state(switch, mqtt):
+    switch.aggregate = WindowAggregator()
+    switch.sample()
+    switch.mqtt_callback(None, None, command('ON'))
+    assert published(mqtt) == [{'power_state': 'ON'}]
+    # the sample is left for the scheduled publish
+    switch.sample()
+    switch.publish_state()
+    (payload,) = published(mqtt)
+    assert payload['power_state'] == 'ON'
+    assert 'window' in payload
@@ -0,0 +1,102 @@
+from rpi2mqtt.aggregate import WindowAggregator
+from rpi2mqtt.discovery import Discovery
+from rpi2mqtt.report import ReportPolicy
+from rpi2mqtt.temperature import DHT, OneWire
+from rpi2mqtt.fakes import w1_tree
+import json
+import pytest
+
+
+def published(mqtt):
+    messages = []
+    while len(mqtt.outbox):
+        message = mqtt.outbox.get(timeout=0)
+        mqtt.outbox.sent_ok(message)
+        messages.append(json.loads(message.payload))
+    return messages
+
+
+@pytest.fixture
+def dht(mqtt):
+    Discovery.pending.clear()
+    return DHT(4, 'rpi2mqtt/climate', 'climate', 'sensor', 'dht22')
+
+
+def test_dht_discovery(dht):
+    assert list(Discovery.pending) == ['homeassistant/sensor/climate_temp/config',
+                                       'homeassistant/sensor/climate_humidity/config']
+    Discovery.pending.clear()
+
+
+def test_dht_publishes_through_sensor(dht, mqtt):
+    dht.callback()
+    (payload,) = published(mqtt)
+    assert set(payload) == {'humidity', 'temperature'}
+
+
+def test_dht_report_policy(dht, mqtt):
+    dht.report = ReportPolicy({'temperature': 100, 'humidity': 100})
+    dht.callback()
+    dht.callback()
+    assert len(published(mqtt)) == 1
+
+
+def test_dht_aggregate(dht, mqtt):
+    dht.aggregate = WindowAggregator()
+    for _ in range(3):
+        dht.sample()
+    dht.callback()
+    (payload,) = published(mqtt)
+    assert payload['window']['temperature']['count'] == 3
+
+
+def test_onewire_publishes_every_probe(mqtt, tmp_path):
+    w1_tree(str(tmp_path), 3)
+    Discovery.pending.clear()
+    sensor = OneWire('freezers', 'rpi2mqtt/freezers', base_dir=str(tmp_path))
+    try:
+        # one entity per probe, the bus isn't an entity of its own
+        assert len(Discovery.pending) == 3
+        assert 'homeassistant/sensor/freezers_temperature/config' not in Discovery.pending
+        sensor.callback()
+        (payload,) = published(mqtt)
+        assert len(payload) == 3
+        assert 'state' not in payload
+    finally:
+        sensor.close()
+        Discovery.pending.clear()
+
+
+def test_onewire_removes_bus_entity_of_earlier_versions(mqtt, tmp_path, monkeypatch):
+    w1_tree(str(tmp_path), 1)
+    Discovery.pending.clear()
+    monkeypatch.setattr(Discovery, 'published', {'homeassistant/sensor/freezers_temperature/config': 'abc'})
+    sensor = OneWire('freezers', 'rpi2mqtt/freezers', base_dir=str(tmp_path))
+    try:
+        assert Discovery.pending['homeassistant/sensor/freezers_temperature/config'] == ('', None)
+        Discovery.flush()
+        assert 'homeassistant/sensor/freezers_temperature/config' not in Discovery.published
+    finally:
+        sensor.close()
+        Discovery.pending.clear()
+
+
+def test_onewire_legacy_entity(mqtt, tmp_path):
+    w1_tree(str(tmp_path), 3)
+    Discovery.pending.clear()
+    sensor = OneWire('freezers', 'rpi2mqtt/freezers', base_dir=str(tmp_path), legacy_entity=True)
+    try:
+        assert 'homeassistant/sensor/freezers_temperature/config' in Discovery.pending
+        sensor.callback()
+        (payload,) = published(mqtt)
+        assert payload['state'] == 73.6
+        assert len(payload) == 4
+    finally:
+        sensor.close()
+        Discovery.pending.clear()
+
+
+def test_onewire_crc():
+    assert OneWire.parse_one_wire_file('28-1', '72 01 : crc=57 YES\n72 01 t=23125') == 23.125
+    assert OneWire.parse_one_wire_file('28-1', '72 01 : crc=57 NO\n72 01 t=23125') is None
+    assert OneWire.parse_temperature('23125\n') == 23.125